@@ -0,0 +1,392 @@
+#!/bin/env python
+
+"""
+Benchmarks for the hot paths of the SDK. They run against the local
+stand-ins for the QDS API and S3 in qds_sdk.fake_api, so they need no
+network access and give repeatable numbers.
+
+Results are written to benchmarks/results/<sdk version>-py<python version>.json
+with --save, and can be compared against an earlier results file with
+--compare to spot regressions between releases.
+
+Usage:
+    python benchmarks/run.py [--filter SUBSTRING] [--repeat N] [--save]
+                             [--compare RESULTS_FILE] [--threshold PERCENT]
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from argparse import ArgumentParser
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from qds_sdk.qubole import Qubole
+from qds_sdk.commands import Command, HiveCommand, _download_to_local, _read_iteratively
+from qds_sdk.fake_api import FakeQdsServer, FakeS3Server
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+MB = 1024 * 1024
+
+BENCHMARKS = []
+
+
+def benchmark(name, unit="s", repeat=None):
+    """
+    Registers a benchmark. The decorated function receives the running
+    servers, does any setup and returns a callable to time together with the
+    amount of work done by one call (bytes, objects or requests), which is
+    used to report throughput in `unit`.
+    """
+    def decorator(f):
+        BENCHMARKS.append({"name": name, "setup": f, "unit": unit, "repeat": repeat})
+        return f
+    return decorator
+
+
+def memory_benchmark(name):
+    """
+    Registers a benchmark of memory use. The decorated function returns a
+    callable building the objects to measure and their number; the memory
+    still allocated once the callable returns is reported per object.
+    """
+    def decorator(f):
+        BENCHMARKS.append({"name": name, "setup": f, "unit": "bytes/object",
+                           "repeat": None, "memory": True})
+        return f
+    return decorator
+
+
+class Servers(object):
+    def __init__(self):
+        self.s3 = FakeS3Server().start()
+        self.api = FakeQdsServer(s3=self.s3)
+
+    def reset(self):
+        """Start every benchmark from an empty API server."""
+        self.api.stop()
+        self.api = FakeQdsServer(s3=self.s3).start()
+        self.api.configure()
+
+    def stop(self):
+        self.api.stop()
+        self.s3.stop()
+
+
+@benchmark("connection.get", unit="requests/s")
+def connection_get(servers):
+    conn = Qubole.agent()
+    requests = 200
+
+    def run():
+        for i in range(requests):
+            conn.get("accounts/get_creds")
+    return run, requests
+
+
+def _command_run(poll_interval):
+    def setup(servers):
+        servers.api.polls_to_done = 3
+
+        def run():
+            saved = Qubole.poll_interval
+            # Bypasses Qubole.MIN_POLL_INTERVAL to compare poll policies
+            Qubole.poll_interval = poll_interval
+            try:
+                HiveCommand.run(query="show tables")
+            finally:
+                Qubole.poll_interval = saved
+        return run, 1
+    return setup
+
+for _interval in (1.0, 0.1, 0.01):
+    benchmark("command.run poll=%ss" % _interval, unit="commands/s",
+              repeat=2 if _interval >= 1 else None)(_command_run(_interval))
+
+
+def _get_results(size, inline):
+    def setup(servers):
+        servers.api.inline_result_limit = size if inline else 0
+        cmd = HiveCommand(servers.api.add_command(status="done", result_size=size))
+
+        def run():
+            cmd.get_results(io.BytesIO())
+        return run, size
+    return setup
+
+benchmark("get_results inline 8MB", unit="MB/s")(_get_results(8 * MB, True))
+benchmark("get_results s3 8MB", unit="MB/s")(_get_results(8 * MB, False))
+
+
+def _s3_result(servers, size, files):
+    servers.api.inline_result_limit = 0
+    servers.api.result_file_size = size // files
+    command = servers.api.add_command(status="done", result_size=size)
+    location = servers.api.command_results({}, None, str(command["id"]))["result_location"][0]
+    return servers.s3.boto_connection(), location
+
+
+def _download(delim):
+    def setup(servers):
+        boto_conn, location = _s3_result(servers, 32 * MB, 4)
+
+        def run():
+            if delim is None:
+                fp = io.BytesIO()
+            else:
+                fp = io.TextIOWrapper(io.BytesIO(), encoding="utf8")
+            _download_to_local(boto_conn, location, fp, 1, delim=delim)
+        return run, 32 * MB
+    return setup
+
+benchmark("_download_to_local 32MB", unit="MB/s")(_download(None))
+benchmark("_download_to_local 32MB delim", unit="MB/s")(_download("\t"))
+
+
+@benchmark("_read_iteratively 32MB", unit="MB/s")
+def read_iteratively(servers):
+    boto_conn, location = _s3_result(servers, 32 * MB, 1)
+    bucket_name, prefix = location[len("s3://"):].split("/", 1)
+    bucket = boto_conn.get_bucket(bucket_name)
+
+    def run():
+        key = bucket.get_key(prefix + "0/0")
+        with open(os.devnull, "w") as fp:
+            _read_iteratively(key, fp, "\t")
+    return run, 32 * MB
+
+
+@benchmark("Resource.list 10k objects", unit="objects/s")
+def resource_list(servers):
+    count = 10000
+    for i in range(count):
+        servers.api.add_command(query="select %d" % i, status="done")
+
+    def run():
+        commands = Command.list(per_page=count)
+        assert len(commands) == count
+    return run, count
+
+
+def _command_payload(count):
+    """A listing of commands with the fields returned by QDS"""
+    return json.dumps({"commands": [{
+        "id": i, "command_type": "HiveCommand", "status": "done",
+        "created_at": "2015-01-01T00:00:00Z", "updated_at": "2015-01-01T00:01:00Z",
+        "start_time": 1420070400, "end_time": 1420070460, "submit_time": 1420070400,
+        "label": "default", "num_result_dir": 1, "progress": 100,
+        "qbol_session_id": 1000 + i, "user_id": 42, "account_id": 7,
+        "can_notify": False, "resolved_macros": None, "pid": 12345,
+        "template": "generic", "command_source": "API", "timeout": None,
+        "pool": None, "name": None, "tags": [], "saved_query_mutable_id": None,
+        "path": "/tmp/2015-01-01/7/%d" % i, "nezha_resources": [],
+        "email": "user@example.com", "uid": 42,
+        "command": {"query": "select * from t where id = %d" % i, "sample": False,
+                    "approx_mode": False, "loader_stable": None},
+        "meta_data": {"results_resource": "commands/%d/results" % i,
+                      "logs_resource": "commands/%d/logs" % i}}
+        for i in range(count)]})
+
+
+def _find_many(concurrency):
+    def setup(servers):
+        # Enough latency for the round trips to dominate, as against QDS
+        servers.api.latency = 0.01
+        ids = [servers.api.add_command(status="done")["id"] for i in range(100)]
+
+        def run():
+            Command.find_many(ids, concurrency=concurrency)
+        return run, len(ids)
+    return setup
+
+for _concurrency in (1, 8):
+    benchmark("find_many 100 concurrency=%d" % _concurrency, unit="objects/s",
+              repeat=3)(_find_many(_concurrency))
+
+
+@benchmark("validate cluster payload 10k", unit="payloads/s")
+def validate_payloads(servers):
+    from qds_sdk.cluster import ClusterInfoV13
+    from qds_sdk.cluster_schema import validate_payload
+    count = 10000
+    cluster_info = ClusterInfoV13(["etl"])
+    cluster_info.set_cluster_info(aws_region="us-east-1", initial_nodes=2, max_nodes=10,
+                                  slave_request_type="spot", maximum_bid_price_percentage=80,
+                                  ebs_volume_count=2, ebs_volume_size=500,
+                                  custom_ec2_tags='{"team": "data"}')
+    payload = cluster_info.minimal_payload()
+
+    def run():
+        for i in range(count):
+            validate_payload(payload, "create")
+    return run, count
+
+
+@benchmark("command_class hydrate 100k rows", unit="objects/s")
+def hydrate_commands(servers):
+    from qds_sdk.commands import command_class
+    rows = json.loads(_command_payload(100000))["commands"]
+
+    def run():
+        for row in rows:
+            command_class(row.get("command_type"))(row)
+    return run, len(rows)
+
+
+@memory_benchmark("Command memory 100k objects")
+def command_memory(servers):
+    count = 100000
+    payload = _command_payload(count)
+
+    def run():
+        return [Command(c) for c in json.loads(payload)["commands"]]
+    return run, count
+
+
+def _cli(args):
+    def setup(servers):
+        env = dict(os.environ, QDS_API_TOKEN="dummy_token",
+                   QDS_API_URL=servers.api.url + "/api/", QDS_DAEMON_SOCKET=os.devnull)
+        cmd = [sys.executable] + args
+        if args[0].endswith("qds.py"):
+            servers.api.add_command(status="done")
+
+        def run():
+            subprocess.check_call(cmd, env=env, cwd=ROOT, stdout=open(os.devnull, "w"))
+        return run, 1
+    return setup
+
+benchmark("cli import qds", unit="invocations/s")(
+    _cli(["-c", "import sys; sys.path.insert(0, 'bin'); import qds"]))
+benchmark("cli hivecmd check", unit="invocations/s")(
+    _cli([os.path.join(ROOT, "bin", "qds.py"), "hivecmd", "check", "1"]))
+
+
+def sdk_version():
+    with open(os.path.join(ROOT, "setup.py")) as f:
+        for line in f:
+            if line.strip().startswith("version="):
+                return line.split('"')[1]
+    return "unknown"
+
+
+def _measure_memory(fn, count):
+    try:
+        import tracemalloc
+    except ImportError:
+        print("tracemalloc is not available, skipping memory benchmarks")
+        return None
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = fn()
+        size = (tracemalloc.get_traced_memory()[0] - before) / float(count)
+    finally:
+        tracemalloc.stop()
+    del objects
+    # Stored like timings, so that growth is reported by --compare
+    return {"min": size, "median": size, "unit": "bytes/object", "throughput": None}
+
+
+def run_benchmarks(servers, name_filter=None, repeat=5):
+    results = {}
+    for bench in BENCHMARKS:
+        if name_filter and name_filter not in bench["name"]:
+            continue
+        servers.reset()
+        fn, work = bench["setup"](servers)
+        if bench.get("memory"):
+            result = _measure_memory(fn, work)
+            if result is not None:
+                results[bench["name"]] = result
+                print("%-36s %9.1f %s" % (bench["name"], result["median"], bench["unit"]))
+            continue
+        fn()  # warm up connection pools and caches
+        timings = []
+        for i in range(bench["repeat"] or repeat):
+            start = time.time()
+            fn()
+            timings.append(time.time() - start)
+        timings.sort()
+        best = timings[0]
+        median = timings[len(timings) // 2]
+        scale = MB if bench["unit"] == "MB/s" else 1
+        results[bench["name"]] = {
+            "min": best,
+            "median": median,
+            "unit": bench["unit"],
+            "throughput": (work / float(scale)) / median if median else None,
+        }
+        print("%-36s median %9.4fs  min %9.4fs  %12.2f %s" %
+              (bench["name"], median, best, results[bench["name"]]["throughput"], bench["unit"]))
+        sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline_file, threshold):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    print("\nCompared to %s (sdk %s):" % (baseline_file, baseline["version"]))
+    regressions = 0
+    for name, result in sorted(results.items()):
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        change = (result["median"] - old["median"]) * 100.0 / old["median"]
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("%-36s %+8.1f%%%s" % (name, change, flag))
+    return regressions
+
+
+def main():
+    argparser = ArgumentParser(description="Benchmarks for the qds_sdk hot paths")
+    argparser.add_argument("--filter", dest="name_filter",
+                           help="only run benchmarks whose name contains this string")
+    argparser.add_argument("--repeat", type=int, default=5,
+                           help="number of timed runs of each benchmark")
+    argparser.add_argument("--save", action="store_true",
+                           help="save results to %s" % RESULTS_DIR)
+    argparser.add_argument("--compare", dest="baseline",
+                           help="results file to compare against")
+    argparser.add_argument("--threshold", type=float, default=10,
+                           help="slowdown in percent reported as a regression")
+    arguments = argparser.parse_args()
+
+    servers = Servers()
+    try:
+        results = run_benchmarks(servers, arguments.name_filter, arguments.repeat)
+    finally:
+        servers.stop()
+
+    regressions = 0
+    if arguments.baseline:
+        # Before saving, which may overwrite the baseline
+        regressions = compare(results, arguments.baseline, arguments.threshold)
+
+    if arguments.save:
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        path = os.path.join(RESULTS_DIR, "%s-py%s.json" %
+                            (sdk_version(), ".".join(platform.python_version_tuple()[:2])))
+        with open(path, "w") as f:
+            json.dump({"version": sdk_version(),
+                       "python": platform.python_version(),
+                       "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                       "results": results}, f, indent=4, sort_keys=True)
+        print("\nSaved results to %s" % path)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,38 +1,30 @@
 #!/bin/env python
 
 from __future__ import print_function
-from qds_sdk.qubole import Qubole
-from qds_sdk.commands import *
-from qds_sdk.cluster import *
 import qds_sdk.exception
-from qds_sdk.scheduler import SchedulerCmdLine
-from qds_sdk.actions import ActionCmdLine
-from qds_sdk.report import ReportCmdLine
-from qds_sdk.dbtaps import DbTapCmdLine
-from qds_sdk.role import RoleCmdLine
-from qds_sdk.group import GroupCmdLine
-from qds_sdk.account import AccountCmdLine
-from qds_sdk.app import AppCmdLine
-from qds_sdk.nezha import NezhaCmdLine
 
 import os
 import sys
+import signal
 import traceback
 import logging
 import json
 from optparse import OptionParser
 
 log = logging.getLogger("qds")
+
+# Subcommand modules are imported only when the subcommand is dispatched,
+# so that a single invocation does not pay for loading the whole SDK.
 CommandClasses = {
-    "hivecmd": HiveCommand,
-    "sparkcmd": SparkCommand,
-    "dbtapquerycmd": DbTapQueryCommand,
-    "pigcmd":  PigCommand,
-    "hadoopcmd": HadoopCommand,
-    "shellcmd": ShellCommand,
-    "dbexportcmd": DbExportCommand,
-    "dbimportcmd": DbImportCommand,
-    "prestocmd": PrestoCommand
+    "hivecmd": "HiveCommand",
+    "sparkcmd": "SparkCommand",
+    "dbtapquerycmd": "DbTapQueryCommand",
+    "pigcmd":  "PigCommand",
+    "hadoopcmd": "HadoopCommand",
+    "shellcmd": "ShellCommand",
+    "dbexportcmd": "DbExportCommand",
+    "dbimportcmd": "DbImportCommand",
+    "prestocmd": "PrestoCommand"
 }
 
 usage_str = (
@@ -54,6 +46,9 @@ usage_str = (
     "    list: list existing cluster(s)\n"
     "    start: start an existing cluster\n"
     "    terminate: terminate a running cluster\n"
+    "    start_many: start many clusters, selected by id/label or filters\n"
+    "    terminate_many: terminate many clusters, selected by id/label or filters\n"
+    "    reconcile: update clusters to the configurations in a directory\n"
     "    status: show whether the cluster is up or down\n"
     "    reassign_label: reassign label from one cluster to another\n"
     "    snapshot: take snapshot of cluster\n"
@@ -61,6 +56,9 @@ usage_str = (
     "    add_node: add a node to existing cluster\n"
     "    remove_node: remove a node to existing cluster\n"
     "    update_node: update a node on a existing cluster\n"
+    "    add_nodes: add many nodes to an existing cluster\n"
+    "    remove_nodes: remove many nodes from an existing cluster\n"
+    "    update_nodes: update many nodes of an existing cluster\n"
     "    get_snapshot_schedule: get details of scheduled snapshots on a hbase cluster\n"
     "    update_snapshot_schedule: update scheduled snapshots on a hbase cluster\n"
     "\nDbTap subcommand:\n"
@@ -80,7 +78,10 @@ usage_str = (
     "\nAccount subcommand:\n"
     "  account --help\n"
     "\nNezha subcommand:\n"
-    "  nezha --help\n")
+    "  nezha --help\n"
+    "\nDaemon subcommand:\n"
+    "  daemon [--socket <path>] : serve qds.py invocations from a warm process.\n"
+    "    While it runs, qds.py forwards invocations to it transparently.\n")
 
 
 def usage(parser=None):
@@ -107,7 +108,7 @@ def submitaction(cmdclass, args):
 
 
 def _getresult(cmdclass, cmd):
-    if Command.is_success(cmd.status):
+    if cmdclass.is_success(cmd.status):
         log.info("Fetching results for %s, Id: %s" % (cmdclass.__name__, cmd.id))
         cmd.get_results(sys.stdout, delim='\t')
         return 0
@@ -163,7 +164,7 @@ def getlogaction(cmdclass, args):
 def getjobsaction(cmdclass, args):
     checkargs_id(args)
     cmd = cmdclass.find(args.pop(0))
-    if Command.is_done(cmd.status):
+    if cmdclass.is_done(cmd.status):
         log.info("Fetching jobs for %s, Id: %s" % (cmdclass.__name__, cmd.id))
         print(cmdclass.get_jobs_id(cmd.id))
         return 0
@@ -173,7 +174,8 @@ def getjobsaction(cmdclass, args):
 
 
 def cmdmain(cmd, args):
-    cmdclass = CommandClasses[cmd]
+    import qds_sdk.commands
+    cmdclass = getattr(qds_sdk.commands, CommandClasses[cmd])
 
     actionset = set(["submit", "run", "check", "cancel", "getresult", "getlog", "getjobs"])
     if len(args) < 1:
@@ -197,7 +199,7 @@ def checkargs_cluster_id_label(args):
 def cluster_create_action(clusterclass, args, api_version=1.2):
     arguments = clusterclass._parse_create_update(args, "create", api_version)
     cluster_info = _create_cluster_info(arguments, api_version)
-    result = clusterclass.create(cluster_info.minimal_payload())
+    result = clusterclass.create(cluster_info.minimal_payload(), validate=True)
     print(json.dumps(result, indent=4))
     return 0
 
@@ -205,18 +207,22 @@ def cluster_create_action(clusterclass, args, api_version=1.2):
 def cluster_update_action(clusterclass, args, api_version=1.2):
     arguments = clusterclass._parse_create_update(args, "update", api_version)
     cluster_info = _create_cluster_info(arguments, api_version)
-    result = clusterclass.update(arguments.cluster_id_label, cluster_info.minimal_payload())
+    result = clusterclass.update(arguments.cluster_id_label, cluster_info.minimal_payload(),
+                                 validate=True)
     print(json.dumps(result, indent=4))
     return 0
 
 def cluster_clone_action(clusterclass, args, api_version=1.2):
     arguments = clusterclass._parse_create_update(args, "clone", api_version)
     cluster_info = _create_cluster_info(arguments, api_version)
-    result = clusterclass.clone(arguments.cluster_id_label, cluster_info.minimal_payload())
+    result = clusterclass.clone(arguments.cluster_id_label, cluster_info.minimal_payload(),
+                                validate=True)
     print(json.dumps(result, indent=4))
     return 0
 
 def _create_cluster_info(arguments, api_version):
+    from qds_sdk.cluster import ClusterInfo, ClusterInfoV13
+
     custom_config = _read_file(arguments.custom_config_file, "custom config file")
     presto_custom_config = _read_file(arguments.presto_custom_config_file, "presto custom config file")
     fairscheduler_config_xml = _read_file(arguments.fairscheduler_config_xml_file, "config xml file")
@@ -334,9 +340,9 @@ def cluster_list_action(clusterclass, args):
     elif arguments['label'] is not None:
         result = clusterclass.show(arguments['label'])
     elif arguments['state'] is not None:
-        result = clusterclass.list(state=arguments['state'])
+        result = clusterclass.list(state=arguments['state'], fields=arguments['fields'])
     else:
-        result = clusterclass.list()
+        result = clusterclass.list(fields=arguments['fields'])
     print(json.dumps(result, indent=4))
     return 0
 
@@ -355,6 +361,65 @@ def cluster_terminate_action(clusterclass, args):
     return 0
 
 
+def _cluster_many_action(clusterclass, args, action):
+    arguments = clusterclass._parse_many(args, action)
+    try:
+        outcomes = getattr(clusterclass, action)(arguments["cluster_id_labels"] or None,
+                                                 wait=arguments["wait"],
+                                                 timeout=arguments["timeout"],
+                                                 concurrency=arguments["concurrency"],
+                                                 **arguments["filters"])
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    report = {}
+    for cluster_id_label, outcome in outcomes.items():
+        report[cluster_id_label] = {
+            "response": outcome.response,
+            "state": outcome.state,
+            "error": str(outcome.error) if outcome.error is not None else None,
+        }
+    print(json.dumps(report, indent=4, sort_keys=True))
+    return 1 if any(o.error is not None for o in outcomes.values()) else 0
+
+
+def cluster_start_many_action(clusterclass, args):
+    return _cluster_many_action(clusterclass, args, "start_many")
+
+
+def cluster_terminate_many_action(clusterclass, args):
+    return _cluster_many_action(clusterclass, args, "terminate_many")
+
+
+def cluster_reconcile_action(clusterclass, args):
+    from qds_sdk.reconcile import Reconciler
+    arguments = clusterclass._parse_reconcile(args)
+    try:
+        reconciler = Reconciler.from_directory(arguments.directory,
+                                               concurrency=arguments.concurrency,
+                                               create_missing=arguments.create_missing)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        return 1
+    plan, outcomes = reconciler.apply(dry_run=arguments.dry_run)
+    report = {"plan": {}, "results": {}, "timings": reconciler.timings}
+    for item in plan:
+        report["plan"][item.cluster] = {
+            "action": item.action,
+            "changes": item.changes,
+            "error": str(item.error) if item.error is not None else None,
+        }
+    for cluster_id_label, outcome in outcomes.items():
+        report["results"][cluster_id_label] = {
+            "response": outcome.response,
+            "error": str(outcome.error) if outcome.error is not None else None,
+        }
+    print(json.dumps(report, indent=4, sort_keys=True))
+    failed = any(item.action == "error" for item in plan) or \
+        any(o.error is not None for o in outcomes.values())
+    return 1 if failed else 0
+
+
 def cluster_status_action(clusterclass, args):
     checkargs_cluster_id_label(args)
     result = clusterclass.status(args.pop(0))
@@ -411,9 +476,45 @@ def cluster_update_node_action(clusterclass, args):
     print(json.dumps(result, indent=4))
     return 0
 
+def _cluster_node_many_action(clusterclass, args, action):
+    arguments = clusterclass._parse_node_many(args, action)
+    cluster_id_label = arguments.cluster_id or arguments.label
+    kwargs = {"concurrency": arguments.concurrency, "rate": arguments.rate,
+              "wait": arguments.wait, "timeout": arguments.timeout}
+    if action == "add_nodes":
+        outcomes = clusterclass.add_nodes({cluster_id_label: arguments.count}, **kwargs)
+    elif action == "remove_nodes":
+        outcomes = clusterclass.remove_nodes({cluster_id_label: arguments.private_dns},
+                                             **kwargs)
+    else:
+        outcomes = clusterclass.update_nodes({cluster_id_label: arguments.private_dns},
+                                             arguments.command, **kwargs)
+    report = [{
+        "node": outcome.node,
+        "response": outcome.response,
+        "status": outcome.status,
+        "error": str(outcome.error) if outcome.error is not None else None,
+    } for outcome in outcomes]
+    print(json.dumps(report, indent=4, sort_keys=True))
+    return 1 if any(o.error is not None for o in outcomes) else 0
+
+
+def cluster_add_nodes_action(clusterclass, args):
+    return _cluster_node_many_action(clusterclass, args, "add_nodes")
+
+
+def cluster_remove_nodes_action(clusterclass, args):
+    return _cluster_node_many_action(clusterclass, args, "remove_nodes")
+
+
+def cluster_update_nodes_action(clusterclass, args):
+    return _cluster_node_many_action(clusterclass, args, "update_nodes")
+
+
 def clustermain(args, api_version):
+    from qds_sdk.cluster import Cluster
     clusterclass = Cluster
-    actionset = set(["create", "delete", "update", "clone", "list", "start", "terminate", "status", "reassign_label", "add_node", "remove_node", "update_node", "snapshot", "restore_point", "get_snapshot_schedule", "update_snapshot_schedule"])
+    actionset = set(["create", "delete", "update", "clone", "list", "start", "terminate", "start_many", "terminate_many", "reconcile", "status", "reassign_label", "add_node", "remove_node", "update_node", "add_nodes", "remove_nodes", "update_nodes", "snapshot", "restore_point", "get_snapshot_schedule", "update_snapshot_schedule"])
 
     if len(args) < 1:
         sys.stderr.write("missing argument containing action\n")
@@ -429,43 +530,78 @@ def clustermain(args, api_version):
         return globals()["cluster_" + action + "_action"](clusterclass, args)
 
 def accountmain(args):
+    from qds_sdk.account import AccountCmdLine
     result = AccountCmdLine.run(args)
     print(result)
 
 def reportmain(args):
+    from qds_sdk.report import ReportCmdLine
     result = ReportCmdLine.run(args)
-    print(result)
+    if result is not None:
+        print(result)
 
 
 def actionmain(args):
+    from qds_sdk.actions import ActionCmdLine
     result = ActionCmdLine.run(args)
-    print(result)
+    # bulk-kill and bulk-rerun print their own summary and return the exit status
+    if isinstance(result, int):
+        return result
+    if result is not None:
+        print(result)
 
 def schedulermain(args):
+    from qds_sdk.scheduler import SchedulerCmdLine
     result = SchedulerCmdLine.run(args)
-    print(result)
+    # backfill prints its own report and returns the exit status
+    if isinstance(result, int):
+        return result
+    if result is not None:
+        print(result)
 
 def dbtapmain(args):
+    from qds_sdk.dbtaps import DbTapCmdLine
     result = DbTapCmdLine.run(args)
     print(result)
 
 def rolemain(args):
+    from qds_sdk.role import RoleCmdLine
     result = RoleCmdLine.run(args)
     print(result)
 
 def groupmain(args):
+    from qds_sdk.group import GroupCmdLine
     result = GroupCmdLine.run(args)
     print(result)
 
 def appmain(args):
+    from qds_sdk.app import AppCmdLine
     result = AppCmdLine.run(args)
     print(result)
 
 def nezhamain(args):
+    from qds_sdk.nezha import NezhaCmdLine
     result = NezhaCmdLine.run(args)
     print(result)
 
-def main():
+def daemonmain(args):
+    from argparse import ArgumentParser
+    from qds_sdk.daemon import QdsDaemon
+    argparser = ArgumentParser(prog="qds.py daemon",
+                               description="Serve qds.py invocations over a Unix domain socket.")
+    argparser.add_argument("--socket", dest="socket_path",
+                           help="path of the socket to listen on. defaults to "
+                                "QDS_DAEMON_SOCKET or ~/.qds/daemon.sock")
+    arguments = argparser.parse_args(args)
+    daemon = QdsDaemon(run, arguments.socket_path)
+    # Exit through serve_forever's cleanup so the socket is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    daemon.bind()
+    sys.stderr.write("qds daemon listening on %s\n" % daemon.path)
+    daemon.serve_forever()
+    return 0
+
+def main(argv=None, use_daemon=False):
 
     optparser = OptionParser(usage=usage_str)
     optparser.add_option("--token", dest="api_token",
@@ -485,6 +621,11 @@ def main():
                          default=os.getenv('QDS_POLL_INTERVAL'),
                          help="interval for polling API for completion and other events. defaults to 5s")
 
+    optparser.add_option("--timeout", dest="timeout",
+                         type=int,
+                         default=os.getenv('QDS_TIMEOUT'),
+                         help="secs to wait for a response to a REST request. defaults to 300s")
+
     optparser.add_option("--skip_ssl_cert_check", dest="skip_ssl_cert_check", action="store_true",
                          default=False,
                          help="skip verification of server SSL certificate. Insecure: use with caution.")
@@ -498,14 +639,23 @@ def main():
                          help="very verbose mode - debug level logging")
 
     optparser.disable_interspersed_args()
-    (options, args) = optparser.parse_args()
+    (options, args) = optparser.parse_args(argv)
+
+    if use_daemon and args and args[0] != "daemon":
+        from qds_sdk.daemon import forward
+        status = forward(sys.argv[1:] if argv is None else argv)
+        if status is not None:
+            return status
 
     if options.chatty:
-        logging.basicConfig(level=logging.DEBUG)
+        level = logging.DEBUG
     elif options.verbose:
-        logging.basicConfig(level=logging.INFO)
+        level = logging.INFO
     else:
-        logging.basicConfig(level=logging.WARN)
+        level = logging.WARN
+    logging.basicConfig(level=level)
+    # basicConfig does nothing in the daemon, where logging is already set up
+    logging.getLogger().setLevel(level)
 
     if options.api_token is None:
         sys.stderr.write("No API Token provided\n")
@@ -520,16 +670,21 @@ def main():
     if options.poll_interval is None:
         options.poll_interval = 5
 
+    if options.timeout is None:
+        options.timeout = 300
+
     if options.skip_ssl_cert_check is None:
         options.skip_ssl_cert_check = False
     elif options.skip_ssl_cert_check:
         log.warn("Insecure mode enabled: skipping SSL cert verification\n")
 
+    from qds_sdk.qubole import Qubole
     Qubole.configure(api_token=options.api_token,
                      api_url=options.api_url,
                      version=options.api_version,
                      poll_interval=options.poll_interval,
-                     skip_ssl_cert_check=options.skip_ssl_cert_check)
+                     skip_ssl_cert_check=options.skip_ssl_cert_check,
+                     timeout=int(options.timeout))
 
     if len(args) < 1:
         sys.stderr.write("Missing first argument containing subcommand\n")
@@ -570,26 +725,39 @@ def main():
     if a0 == "nezha":
         return nezhamain(args)
 
+    if a0 == "daemon":
+        return daemonmain(args)
+
     cmdset = set(CommandClasses.keys())
     sys.stderr.write("First command must be one of <%s>\n" %
                      "|".join(cmdset.union(["cluster", "action", "scheduler", "report",
-                       "dbtap", "role", "group", "app", "account", "nezha"])))
+                       "dbtap", "role", "group", "app", "account", "nezha",
+                       "daemon"])))
 
     usage(optparser)
 
 
-if __name__ == '__main__':
+def run(argv, use_daemon=False):
     try:
-        sys.exit(main())
+        return main(argv, use_daemon)
     except qds_sdk.exception.Error as e:
         sys.stderr.write("Error: Status code %s (%s) from url %s\n" %
                          (e.request.status_code, e.__class__.__name__,
                           e.request.url))
-        sys.exit(1)
+        return 1
+    except qds_sdk.exception.ValidationError as e:
+        sys.stderr.write("Error: invalid settings\n")
+        for error in e.errors:
+            sys.stderr.write("  %s\n" % error)
+        return 1
     except qds_sdk.exception.ParseError as e:
         sys.stderr.write("Error: %s\n" % str(e))
         sys.stderr.write("Usage: %s\n" % e.usage)
-        sys.exit(2)
+        return 2
     except Exception:
         traceback.print_exc(file=sys.stderr)
-        sys.exit(3)
+        return 3
+
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:], use_daemon=True))
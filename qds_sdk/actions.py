@@ -4,16 +4,27 @@ The actions module contains the definition for actions started by scheduler.
 
 from __future__ import print_function
 import json
+import sys
+import time
 
 from qds_sdk.qubole import Qubole
 from qds_sdk.resource import Resource
+from qds_sdk.exception import ParseError
+from qds_sdk import util
+from qds_sdk.util import parse_time
 from argparse import ArgumentParser
+from collections import namedtuple
 from qds_sdk.commands import *
 
 import logging
 
 log = logging.getLogger("qds_actions")
 
+"""The result of killing or rerunning one action with Action.kill_many or
+Action.rerun_many"""
+ActionOutcome = namedtuple("ActionOutcome", ["action", "response", "error"])
+
+
 class ActionCmdLine:
     """
     qds_sdk.ActionsCmdLine is the interface used by qds.py.
@@ -60,14 +71,44 @@ class ActionCmdLine:
         logs = subparsers.add_parser("logs",
                                      help="logs for a specific schedule action")
         logs.add_argument("id", help="Numeric id or name of the action")
+        logs.add_argument("--follow", dest="follow", action="store_true", default=False,
+                          help="Print the log as it is written, until the action is done")
         logs.set_defaults(func=ActionCmdLine.logs)
 
         #resultss
         results = subparsers.add_parser("results",
                                      help="results for a specific schedule action")
         results.add_argument("id", help="Numeric id or name of the action")
+        results.add_argument("--output", dest="output",
+                             help="File to write the results to, as they are downloaded")
         results.set_defaults(func=ActionCmdLine.results)
 
+        for operation in ("kill", "rerun"):
+            bulk = subparsers.add_parser("bulk-%s" % operation,
+                                         help="%s many actions at once" %
+                                              operation.capitalize())
+            bulk.add_argument("ids", nargs="*",
+                              help="Numeric ids of the actions. Without ids, the"
+                                   " actions matching the filters are selected")
+            bulk.add_argument("--status", dest="statuses", action="append",
+                              help="Status of the actions to select, may be given"
+                                   " more than once")
+            bulk.add_argument("--schedule", dest="scheduler_id",
+                              help="Numeric id of the schedule of the actions to select")
+            bulk.add_argument("--from", dest="start",
+                              help="Select the actions with a nominal time from this"
+                                   " one, e.g. 2015-01-31 or 2015-01-31T10:00Z")
+            bulk.add_argument("--to", dest="end",
+                              help="Select the actions with a nominal time before this one")
+            bulk.add_argument("--concurrency", dest="concurrency", type=int, default=4,
+                              help="Number of requests made in parallel. Default: 4")
+            bulk.add_argument("--rate", dest="rate", type=float,
+                              help="Most requests made per second")
+            bulk.add_argument("--dry-run", dest="dry_run", action="store_true",
+                              default=False,
+                              help="Only print the ids of the actions selected")
+            bulk.set_defaults(func=ActionCmdLine.bulk, operation=operation)
+
         return argparser
 
     @staticmethod
@@ -93,7 +134,7 @@ class ActionCmdLine:
 
     @staticmethod
     def view(args):
-        act = Action.find(args.id)
+        act = Action.find(args.id, fields=args.fields)
         if args.fields:
             act.attributes = ActionCmdLine.filter_fields(act.attributes, args.fields)
         return json.dumps(act.attributes, sort_keys=True, indent=4)
@@ -110,15 +151,53 @@ class ActionCmdLine:
         ret_val = conn.post(Action.element_path(args.id) + "/rerun", data=None)
         return json.dumps(ret_val, sort_keys=True, indent=4)
 
+    @staticmethod
+    def bulk(args):
+        ids = args.ids
+        filters = (args.statuses, args.scheduler_id, args.start, args.end)
+        if ids and any(f is not None for f in filters):
+            raise ParseError("Action ids and filters cannot be given together",
+                             ActionCmdLine.parsers().format_help())
+        if not ids:
+            if all(f is None for f in filters):
+                raise ParseError("Either action ids or filters must be given",
+                                 ActionCmdLine.parsers().format_help())
+            ids = [a.id for a in Action.select(*filters)]
+        if args.dry_run:
+            return json.dumps({"actions": ids}, sort_keys=True, indent=4)
+        start = time.time()
+        operate = Action.kill_many if args.operation == "kill" else Action.rerun_many
+        outcomes = operate(ids, args.concurrency, args.rate)
+        failed = [o for o in outcomes if o.error is not None]
+        summary = {
+            "operation": args.operation,
+            "total": len(outcomes),
+            "succeeded": len(outcomes) - len(failed),
+            "failed": len(failed),
+            "elapsed": time.time() - start,
+            "errors": dict((str(o.action), str(o.error)) for o in failed),
+        }
+        sys.stdout.write(json.dumps(summary, sort_keys=True, indent=4) + "\n")
+        return 1 if failed else 0
+
     @staticmethod
     def logs(args):
         action = Action.find(args.id)
-        print(action.logs())
+        if not args.follow:
+            print(action.logs())
+            return
+        for chunk in action.iter_logs(follow=True):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
 
     @staticmethod
     def results(args):
         action = Action.find(args.id)
-        action.results()
+        if args.output is None:
+            action.results()
+            return
+        with open(args.output, "wb") as fp:
+            action.results(fp)
 
 class Action(Resource):
 
@@ -133,9 +212,7 @@ class Action(Resource):
         cmd = self.attributes["command"]
         if cmd is None:
             return None
-        cmdclass = globals()[cmd["command_type"]]
-        obj = cmdclass(cmd)
-        return obj
+        return command_class(cmd.get("command_type"))(cmd)
 
     @staticmethod
     def list(page = None, per_page = None):
@@ -154,6 +231,73 @@ class Action(Resource):
             actlist.append(Action(a))
         return actlist
 
+    @staticmethod
+    def select(statuses=None, scheduler_id=None, start=None, end=None, per_page=100):
+        """
+        Lazily yields the actions of all the schedules with one of the
+        `statuses`, of the schedule `scheduler_id` and with a nominal time
+        in [`start`, `end`), walking every page of actions. Arguments left
+        to None are not filtered on.
+        """
+        start = parse_time(start)
+        end = parse_time(end)
+        conn = Qubole.agent()
+        pages = util.iter_pages(
+            lambda page: conn.get(Action.rest_entity_path, {"page": page, "per_page": per_page}),
+            "actions", per_page)
+        for found in pages:
+            for attributes in found:
+                if statuses and attributes.get("status") not in statuses:
+                    continue
+                if scheduler_id is not None and \
+                        str(attributes.get("periodic_job_id")) != str(scheduler_id):
+                    continue
+                if start is not None or end is not None:
+                    nominal = parse_time(attributes.get("nominal_time") or
+                                         attributes.get("created_at"))
+                    if nominal is None or (start is not None and nominal < start) or \
+                            (end is not None and nominal >= end):
+                        continue
+                yield Action(attributes)
+
+    @staticmethod
+    def kill_many(ids, concurrency=4, rate=None):
+        """
+        Kills the actions with the ids `ids`. See `rerun_many`.
+        """
+        return Action._many("kill", ids, concurrency, rate)
+
+    @staticmethod
+    def rerun_many(ids, concurrency=4, rate=None):
+        """
+        Reruns the actions with the ids `ids`, with up to `concurrency`
+        requests in parallel and at most `rate` requests per second. An
+        action which cannot be rerun does not stop the others.
+
+        Returns:
+            a list of ActionOutcome, in the order of `ids`
+        """
+        return Action._many("rerun", ids, concurrency, rate)
+
+    @staticmethod
+    def _many(operation, ids, concurrency, rate):
+        ids = list(ids)
+        conn = Qubole.agent()
+        limiter = util.RateLimiter(rate)
+        requests = {"kill": lambda id: conn.put(Action.element_path(id) + "/kill", data=None),
+                    "rerun": lambda id: conn.post(Action.element_path(id) + "/rerun", data=None)}
+
+        def run(index):
+            limiter.wait()
+            return requests[operation](ids[index])
+
+        outcomes = [ActionOutcome(id, None, None) for id in ids]
+        for index, response, error in util.run_concurrently(run, range(len(ids)), concurrency):
+            if error is not None:
+                log.warning("Could not %s action %s: %s" % (operation, ids[index], error))
+            outcomes[index] = outcomes[index]._replace(response=response, error=error)
+        return outcomes
+
     def kill(self):
         conn = Qubole.agent()
         return conn.put(self.element_path(self.id) + "/kill", data=None)
@@ -165,26 +309,64 @@ class Action(Resource):
     def status(self):
         return self.attributes["status"]
 
+    """Why the logs of an action in these statuses are not available"""
+    _NO_LOGS = {
+        "submitted": "Logs for action are not yet available. Action is waiting for underlying command to be created.",
+        "waiting": "Logs for action are not yet available. Waiting for dependencies to be met.",
+        "not_found": "Logs for action are not available. Dependencies not found.",
+        "cancelled": "Logs for action are not available. Action was cancelled before underlying command gets created.",
+    }
+
     def logs(self):
-        if self.status().lower() == "submitted":
-            return "Logs for action are not yet available. Action is waiting for underlying command to be created."
-        if self.status().lower() == "waiting":
-            return "Logs for action are not yet available. Waiting for dependencies to be met."
-        if self.status().lower() == "not_found":
-            return "Logs for action are not available. Dependencies not found."
-        if self.status().lower() == "cancelled":
-            return "Logs for action are not available. Action was cancelled before underlying command gets created."
+        message = self._NO_LOGS.get(self.status().lower())
+        if message is not None:
+            return message
         cmd = self.getcommand()
         if cmd is None:
             return "Logs for action are not yet available."
         else:
             return cmd.get_log()
 
-    def results(self):
+    def iter_logs(self, follow=True, interval=None):
+        """
+        Yields the log of the command of this action in chunks, as by
+        `Command.iter_log`. With `follow`, the action is polled every
+        `interval` secs until its command is created, then the command is
+        followed until it is done. Nothing is yielded if the action has or
+        will have no command.
+        """
+        interval = interval or Qubole.poll_interval or Qubole.MIN_POLL_INTERVAL
+        action = self
+        while True:
+            cmd = action.getcommand()
+            status = action.status().lower()
+            if cmd is not None:
+                break
+            if not follow or status in ("not_found", "cancelled") or Command.is_done(status):
+                log.info(self._NO_LOGS.get(status, "Logs for action are not yet available."))
+                return
+            time.sleep(interval)
+            action = Action.find(self.id)
+        for chunk in cmd.iter_log(follow=follow, interval=interval):
+            yield chunk
+
+    def iter_results(self, inline=True, delim=None, fetch=True):
+        """
+        Yields the result of the command of this action as chunks of bytes,
+        as by `Command.iter_results`. Nothing is yielded if the action has no
+        command yet.
+        """
+        cmd = self.getcommand()
+        if cmd is None:
+            log.info("Results for action are not yet available.")
+            return
+        for chunk in cmd.iter_results(inline=inline, delim=delim, fetch=fetch):
+            yield chunk
+
+    def results(self, fp=None, delim=None):
+        fp = fp or sys.stdout
         cmd = self.getcommand()
         if cmd is None:
             print("Results for action are not yet available.")
         else:
-            cmd.get_results()
-
-
+            cmd.get_results(fp, delim=delim)
@@ -0,0 +1,283 @@
+"""
+The analytics module answers questions about the command history of an
+account, such as the runtime percentiles of each command type, the queries
+reading the most bytes or the failure rate of each cluster label, from a
+local copy of the all_commands report.
+
+Rows are kept by column: numbers in arrays of doubles, and strings encoded
+as indices into the list of their distinct values, so that grouping by a
+string column only compares integers. The store is synced incrementally,
+from the day of the newest command it holds (or of the oldest one which
+had not finished yet), and can be saved to a directory.
+"""
+
+from qds_sdk.report import ReportClient, _date, _today
+from qds_sdk.util import parse_time
+from array import array
+
+import os
+import json
+import math
+import datetime
+import logging
+
+log = logging.getLogger("qds_analytics")
+
+"""Numeric columns of the all_commands report"""
+NUMERIC_COLUMNS = ("cpu", "fs_bytes_read", "fs_bytes_written", "runtime")
+
+"""String columns of the all_commands report"""
+STRING_COLUMNS = ("command_type", "status", "label", "submitted_by", "command_summary")
+
+"""Statuses of the commands counted as failed by `failure_rate`"""
+FAILED_STATUSES = ("error",)
+
+"""Statuses of commands which will not change, as for Command.is_done"""
+FINAL_STATUSES = ("done", "error", "cancelled")
+
+
+def percentile(values, q):
+    """
+    Returns:
+        the `q`th percentile (0 to 100) of the sorted list `values`,
+        interpolated between the closest ranks, None if it is empty
+    """
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100.0
+    low = int(math.floor(rank))
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class CommandStore(object):
+    """
+    A columnar store of the rows of the all_commands report.
+    """
+
+    def __init__(self):
+        self.ids = []
+        # id -> index of its row
+        self._index = {}
+        self.created_at = array("d")
+        self.numbers = dict((c, array("d")) for c in NUMERIC_COLUMNS)
+        self.codes = dict((c, array("i")) for c in STRING_COLUMNS)
+        self.values = dict((c, []) for c in STRING_COLUMNS)
+        self._value_codes = dict((c, {}) for c in STRING_COLUMNS)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def ingest(self, rows):
+        """
+        Adds report rows to the store. Rows already in it, by id, replace
+        the stored ones if those had not finished, and are skipped
+        otherwise.
+
+        Returns:
+            the number of rows added or replaced
+        """
+        added = 0
+        for row in rows:
+            id = row.get("id")
+            index = self._index.get(id)
+            if index is None:
+                self._index[id] = len(self.ids)
+                self.ids.append(id)
+                self.created_at.append(self._time(row))
+                for column, numbers in self.numbers.items():
+                    numbers.append(self._number(row, column))
+                for column, codes in self.codes.items():
+                    codes.append(self._encode(column, row.get(column)))
+            elif self._final(index):
+                continue
+            else:
+                self.created_at[index] = self._time(row)
+                for column, numbers in self.numbers.items():
+                    numbers[index] = self._number(row, column)
+                for column, codes in self.codes.items():
+                    codes[index] = self._encode(column, row.get(column))
+            added += 1
+        return added
+
+    @staticmethod
+    def _time(row):
+        return parse_time(row.get("created_at")) or float("nan")
+
+    @staticmethod
+    def _number(row, column):
+        value = row.get(column)
+        return float(value) if value is not None else float("nan")
+
+    def _final(self, index):
+        return self.values["status"][self.codes["status"][index]] in FINAL_STATUSES
+
+    def _encode(self, column, value):
+        value_codes = self._value_codes[column]
+        code = value_codes.get(value)
+        if code is None:
+            code = value_codes[value] = len(self.values[column])
+            self.values[column].append(value)
+        return code
+
+    def sync(self, client=None, end_date=None, days=7):
+        """
+        Ingests the rows of the all_commands report from the day of the
+        newest command in the store, or of the oldest one which had not
+        finished, or from `days` days before `end_date` if the store is
+        empty, to `end_date` (today by default).
+
+        Args:
+            `client`: the ReportClient fetching the report. Give it a
+                cache_dir to keep the days which are over on disk.
+
+        Returns:
+            the number of rows added or replaced
+        """
+        client = client or ReportClient()
+        end = _date(end_date) or _today()
+        times = [t for t in self.created_at if not math.isnan(t)]
+        unfinished = [t for i, t in enumerate(self.created_at)
+                      if not math.isnan(t) and not self._final(i)]
+        if times:
+            since = min(unfinished) if unfinished else max(times)
+            start = datetime.datetime.utcfromtimestamp(since).date()
+        else:
+            start = end - datetime.timedelta(days=days)
+        added = self.ingest(client.iter_rows("all_commands", start, end))
+        log.info("Added or updated %d commands in the store, %d in all" % (added, len(self)))
+        return added
+
+    def column(self, name):
+        """
+        Returns:
+            the values of the column `name`, decoded
+        """
+        if name in self.codes:
+            values = self.values[name]
+            return [values[code] for code in self.codes[name]]
+        if name == "created_at":
+            return list(self.created_at)
+        if name == "id":
+            return list(self.ids)
+        return list(self.numbers[name])
+
+    def _rows(self, where):
+        """
+        Returns:
+            the indices of the rows whose string columns have the values
+            in `where`, a dictionary of column to value or list of values
+        """
+        indices = range(len(self))
+        for column, allowed in (where or {}).items():
+            if not isinstance(allowed, (list, tuple, set)):
+                allowed = [allowed]
+            value_codes = self._value_codes[column]
+            wanted = set(value_codes[v] for v in allowed if v in value_codes)
+            codes = self.codes[column]
+            indices = [i for i in indices if codes[i] in wanted]
+        return indices
+
+    def _groups(self, by, where):
+        """
+        Returns:
+            a list of (value of the column `by`, indices of its rows) pairs,
+            sorted by value
+        """
+        codes = self.codes[by]
+        groups = {}
+        for i in self._rows(where):
+            groups.setdefault(codes[i], []).append(i)
+        values = self.values[by]
+        return [(values[code], groups[code]) for code in sorted(
+            groups, key=lambda code: (values[code] is None, values[code]))]
+
+    def percentiles(self, column, by="command_type", q=(50, 95), where=None):
+        """
+        Args:
+            `column`: the numeric column, e.g. "runtime"
+
+            `by`: the string column to group by
+
+            `q`: the percentiles to compute, from 0 to 100
+
+            `where`: dictionary of string column to the value or list of
+                values of the rows to keep
+
+        Returns:
+            a dictionary of group to the list of its percentiles
+        """
+        numbers = self.numbers[column]
+        result = {}
+        for group, indices in self._groups(by, where):
+            values = sorted(v for v in (numbers[i] for i in indices) if not math.isnan(v))
+            result[group] = [percentile(values, p) for p in q]
+        return result
+
+    def top(self, column, by="command_summary", n=10, where=None):
+        """
+        Returns:
+            the `n` groups with the largest total of the numeric `column`,
+            e.g. the queries reading the most with "fs_bytes_read", as a
+            list of (group, total) pairs
+        """
+        numbers = self.numbers[column]
+        totals = []
+        for group, indices in self._groups(by, where):
+            totals.append((group, sum(v for v in (numbers[i] for i in indices)
+                                      if not math.isnan(v))))
+        totals.sort(key=lambda t: t[1], reverse=True)
+        return totals[:n]
+
+    def failure_rate(self, by="label", where=None):
+        """
+        Returns:
+            a dictionary of group to the fraction of its commands which
+            failed
+        """
+        failed_codes = set(self._value_codes["status"][s] for s in FAILED_STATUSES
+                           if s in self._value_codes["status"])
+        statuses = self.codes["status"]
+        result = {}
+        for group, indices in self._groups(by, where):
+            failed = sum(1 for i in indices if statuses[i] in failed_codes)
+            result[group] = failed / float(len(indices))
+        return result
+
+    def save(self, directory):
+        """
+        Saves the store to `directory`, created if needed.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name, column in [("created_at", self.created_at)] + \
+                list(self.numbers.items()) + list(self.codes.items()):
+            with open(os.path.join(directory, name + ".bin"), "wb") as f:
+                column.tofile(f)
+        with open(os.path.join(directory, "store.json"), "w") as f:
+            json.dump({"ids": self.ids, "values": self.values}, f)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Returns:
+            the store saved in `directory`, an empty one if there is none
+        """
+        store = cls()
+        path = os.path.join(directory, "store.json")
+        if not os.path.exists(path):
+            return store
+        with open(path) as f:
+            saved = json.load(f)
+        store.ids = saved["ids"]
+        store._index = dict((id, index) for index, id in enumerate(store.ids))
+        count = len(store.ids)
+        for name, column in [("created_at", store.created_at)] + \
+                list(store.numbers.items()) + list(store.codes.items()):
+            with open(os.path.join(directory, name + ".bin"), "rb") as f:
+                column.fromfile(f, count)
+        for column in STRING_COLUMNS:
+            store.values[column] = saved["values"][column]
+            store._value_codes[column] = dict(
+                (value, code) for code, value in enumerate(store.values[column]))
+        return store
@@ -4,14 +4,35 @@ cluster information.
 """
 
 from qds_sdk.qubole import Qubole
-from qds_sdk.resource import Resource
+from qds_sdk.resource import Resource, query_params, select_fields, matches
+from qds_sdk.exception import ClientError, RetryWithDelay, WaitTimeout, ValidationError
+from qds_sdk.cluster_schema import validate_payload, AWS_REGIONS, SLAVE_REQUEST_TYPES
+from qds_sdk import util
 from argparse import ArgumentParser
+from collections import namedtuple
 
+import os
 import logging
 import json
+import time
 
 log = logging.getLogger("qds_cluster")
 
+"""A cluster seen in a new state (or failing to be polled) by Cluster.watch"""
+ClusterStateChange = namedtuple("ClusterStateChange",
+                                ["cluster", "previous", "state", "time", "error"])
+
+"""The result of starting or terminating one cluster with start_many/terminate_many"""
+ClusterOutcome = namedtuple("ClusterOutcome", ["cluster", "response", "state", "error"])
+
+"""
+The result of one node operation of add_nodes/remove_nodes/update_nodes.
+`node` is the private dns of the node, or None for added nodes. `response` is
+the cluster manage command started by the operation and `status` its last
+status seen.
+"""
+NodeOutcome = namedtuple("NodeOutcome", ["cluster", "node", "response", "status", "error"])
+
 
 def str2bool(v):
     return v.lower() in ("yes", "true", "t", "1")
@@ -25,6 +46,10 @@ class Cluster(Resource):
 
     rest_entity_path = "clusters"
 
+    """Seconds for which cluster configurations are cached by current_config"""
+    CONFIG_CACHE_TTL = 60
+    _config_cache = {}
+
     @classmethod
     def _parse_list(cls, args):
         """
@@ -51,30 +76,42 @@ class Cluster(Resource):
                            choices=['up', 'down', 'pending', 'terminating'],
                            help="list only clusters in the given state")
 
+        argparser.add_argument("--fields", nargs="*", dest="fields",
+                               help="list only these fields of the clusters")
+
         arguments = argparser.parse_args(args)
         return vars(arguments)
 
     @classmethod
-    def list(cls, state=None):
+    def list(cls, state=None, fields=None, **filters):
         """
         List existing clusters present in your account.
 
         Kwargs:
             `state`: list only those clusters which are in this state
 
+            `fields`: names of the cluster fields to return
+
+            `**filters`: list only those clusters whose field has this value
+                (or one of these values, if a list is given)
+
+        The state, fields and filters are sent to the API, and applied
+        locally to whatever it returns anyway.
+
         Returns:
             List of clusters satisfying the given criteria
         """
         conn = Qubole.agent()
-        if state is None:
-            return conn.get(cls.rest_entity_path)
-        elif state is not None:
-            cluster_list = conn.get(cls.rest_entity_path)
-            result = []
-            for cluster in cluster_list:
-                if state.lower() == cluster['cluster']['state'].lower():
-                    result.append(cluster)
-            return result
+        if state is not None:
+            filters["state"] = state
+        cluster_list = conn.get(cls.rest_entity_path, query_params(fields, filters))
+        if not filters and not fields:
+            return cluster_list
+        result = []
+        for cluster in cluster_list:
+            if matches(cluster['cluster'], filters):
+                result.append({'cluster': select_fields(cluster['cluster'], fields)})
+        return result
 
     @classmethod
     def show(cls, cluster_id_label):
@@ -110,6 +147,200 @@ class Cluster(Resource):
         data = {"state": "terminate"}
         return conn.put(cls.element_path(cluster_id_label) + "/state", data)
 
+    @classmethod
+    def start_many(cls, cluster_id_labels=None, wait=False, timeout=None,
+                   concurrency=8, **filters):
+        """
+        Start many clusters at once.
+
+        Args:
+            `cluster_id_labels`: ids/labels of the clusters to start. If
+                None, the clusters matching `filters` (see `list`) are
+                started. Raises ValueError if the API does not return a field
+                filtered on, so that it cannot be checked.
+
+        Kwargs:
+            `wait`: wait until the clusters are up
+
+            `timeout`: secs to wait for. Waits forever if None
+
+            `concurrency`: number of clusters started in parallel
+
+        Returns:
+            dict mapping every cluster id/label to a ClusterOutcome
+        """
+        return cls._change_state_many(cls.start, "UP", cluster_id_labels,
+                                      wait, timeout, concurrency, filters)
+
+    @classmethod
+    def terminate_many(cls, cluster_id_labels=None, wait=False, timeout=None,
+                       concurrency=8, **filters):
+        """
+        Terminate many clusters at once. Takes the same arguments as
+        `start_many`, and waits until the clusters are down if `wait` is set.
+
+        Returns:
+            dict mapping every cluster id/label to a ClusterOutcome
+        """
+        return cls._change_state_many(cls.terminate, "DOWN", cluster_id_labels,
+                                      wait, timeout, concurrency, filters)
+
+    @classmethod
+    def _change_state_many(cls, change, target, cluster_id_labels, wait,
+                           timeout, concurrency, filters):
+        if cluster_id_labels is None:
+            cluster_id_labels = cls._select_ids(filters)
+
+        outcomes = {}
+        for cluster_id_label in cluster_id_labels:
+            outcomes[cluster_id_label] = ClusterOutcome(cluster_id_label, None, None, None)
+        for cluster_id_label, response, error in util.run_concurrently(
+                change, list(outcomes), concurrency):
+            outcomes[cluster_id_label] = outcomes[cluster_id_label]._replace(
+                response=response, error=error)
+
+        if wait:
+            waiting = [c for c, o in outcomes.items() if o.error is None]
+            for event in cls.watch(waiting, states=[target], timeout=timeout,
+                                   concurrency=concurrency):
+                outcome = outcomes[event.cluster]
+                if event.error is not None:
+                    outcome = outcome._replace(error=event.error)
+                else:
+                    outcome = outcome._replace(state=event.state, error=None)
+                outcomes[event.cluster] = outcome
+            for cluster_id_label in waiting:
+                outcome = outcomes[cluster_id_label]
+                if outcome.state != target and outcome.error is None:
+                    outcomes[cluster_id_label] = outcome._replace(error=WaitTimeout(
+                        "Cluster %s did not reach state %s within %s seconds" %
+                        (cluster_id_label, target, timeout)))
+        return outcomes
+
+    @classmethod
+    def _select_ids(cls, filters):
+        """
+        Returns:
+            the ids of the clusters matching `filters`, checked locally on
+            the fields filtered on, as the API may ignore some filters.
+            Raises ValueError if the API does not return one of these fields,
+            rather than selecting clusters it cannot check.
+        """
+        conn = Qubole.agent()
+        fields = ["id"] + sorted(name for name in filters if name != "id")
+        clusters = [c["cluster"] for c in
+                    conn.get(cls.rest_entity_path, query_params(fields, filters))]
+        unchecked = sorted(set(name for c in clusters for name in filters if name not in c))
+        if unchecked:
+            raise ValueError("Cannot select clusters by %s: not returned by the API" %
+                             ", ".join(unchecked))
+        return [str(c["id"]) for c in clusters if matches(c, filters)]
+
+    @classmethod
+    def watch(cls, cluster_id_labels, states=None, timeout=None,
+              interval=None, max_interval=60, concurrency=8):
+        """
+        Polls the state of many clusters and yields a ClusterStateChange for
+        the first state seen of each cluster and for every transition after.
+
+        The clusters are polled over a shared pool of `concurrency` threads.
+        Each one is polled every `interval` secs after its state changes,
+        and less often (up to every `max_interval` secs) while it stays the
+        same. Errors are yielded as events with `error` set, and the cluster
+        is polled again.
+
+        Args:
+            `cluster_id_labels`: ids/labels of the clusters to watch
+
+        Kwargs:
+            `states`: stop watching a cluster once it is in one of these
+                states. Clusters are watched until `timeout` otherwise.
+
+            `timeout`: stop watching after this many secs
+
+            `interval`: shortest interval in secs between polls of a
+                cluster. Defaults to Qubole.poll_interval
+        """
+        interval = interval or Qubole.poll_interval or Qubole.MIN_POLL_INTERVAL
+        targets = None
+        if states is not None:
+            targets = set(state.upper() for state in states)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        # id/label -> [last state, current interval, time of next poll]
+        watched = {}
+        for cluster_id_label in cluster_id_labels:
+            watched.setdefault(cluster_id_label, [None, interval, time.time()])
+
+        def poll(cluster_id_label):
+            return cls.status(cluster_id_label)["state"].upper()
+
+        pool = util.thread_pool(min(concurrency, len(watched)))
+        try:
+            while watched:
+                now = time.time()
+                due = [c for c, w in watched.items() if w[2] <= now]
+                for cluster_id_label, state, error in util.run_concurrently(
+                        poll, due, concurrency, pool=pool):
+                    watch = watched[cluster_id_label]
+                    now = time.time()
+                    if error is not None:
+                        watch[2] = now + watch[1]
+                        yield ClusterStateChange(cluster_id_label, watch[0], None, now, error)
+                        continue
+                    if state != watch[0]:
+                        yield ClusterStateChange(cluster_id_label, watch[0], state, now, None)
+                        watch[0] = state
+                        watch[1] = interval
+                    else:
+                        watch[1] = min(watch[1] * 1.5, max(max_interval, interval))
+                    watch[2] = now + watch[1]
+                    if targets is not None and state in targets:
+                        del watched[cluster_id_label]
+
+                if not watched:
+                    return
+                wake = min(w[2] for w in watched.values())
+                if deadline is not None and wake > deadline:
+                    return
+                time.sleep(max(0, wake - time.time()))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @classmethod
+    def wait_until(cls, cluster_id_label, state, timeout=None, interval=None):
+        """
+        Waits until the cluster with id/label `cluster_id_label` is in
+        `state` (e.g. "up" or "down").
+
+        Kwargs:
+            `timeout`: secs to wait before giving up. Waits forever if None
+
+            `interval`: shortest interval in secs between polls
+
+        Returns:
+            The ClusterStateChange into `state`
+
+        Raises:
+            WaitTimeout: if the cluster is not in `state` within `timeout`
+            ClientError: if the state of the cluster cannot be fetched
+        """
+        for event in cls.watch([cluster_id_label], states=[state],
+                               timeout=timeout, interval=interval):
+            if event.error is not None:
+                if isinstance(event.error, ClientError) and \
+                        not isinstance(event.error, RetryWithDelay):
+                    raise event.error
+                log.warn("Could not fetch the state of cluster %s: %s" %
+                         (cluster_id_label, event.error))
+            elif event.state == state.upper():
+                return event
+        raise WaitTimeout("Cluster %s did not reach state %s within %s seconds" %
+                          (cluster_id_label, state, timeout))
+
     @classmethod
     def _parse_create_update(cls, args, action, api_version):
         """
@@ -157,8 +388,7 @@ class Cluster(Resource):
                                     " creating the cluster",)
         ec2_group.add_argument("--aws-region",
                                dest="aws_region",
-                               choices=["us-east-1", "us-west-2", "ap-northeast-1", "sa-east-1",
-                                        "eu-west-1", "ap-southeast-1", "us-west-1"],
+                               choices=AWS_REGIONS,
                                help="aws region to create the cluster in",)
         ec2_group.add_argument("--aws-availability-zone",
                                dest="aws_availability_zone",
@@ -197,7 +427,7 @@ class Cluster(Resource):
                                        " may be auto-scaled up to")
         node_config_group.add_argument("--slave-request-type",
                                   dest="slave_request_type",
-                                  choices=["ondemand", "spot", "hybrid"],
+                                  choices=SLAVE_REQUEST_TYPES,
                                   help="purchasing option for slave instaces",)
         hadoop_group.add_argument("--custom-config",
                                   dest="custom_config_file",
@@ -405,28 +635,146 @@ class Cluster(Resource):
         return arguments
 
     @classmethod
-    def create(cls, cluster_info):
+    def validate(cls, cluster_info, action="update"):
+        """
+        Checks the payload `cluster_info` locally, without sending it.
+
+        Args:
+            `cluster_info`: a `ClusterInfo`/`ClusterInfoV13` object or a
+                payload dict as built by their `minimal_payload` methods
+
+            `action`: "create", "update" or "clone"
+
+        Returns:
+            a list of all the errors found, empty if the payload is valid
+        """
+        if hasattr(cluster_info, "minimal_payload"):
+            cluster_info = cluster_info.minimal_payload()
+        return validate_payload(cluster_info, action)
+
+    @classmethod
+    def _check(cls, cluster_info, action):
+        errors = cls.validate(cluster_info, action)
+        if errors:
+            raise ValidationError(errors)
+
+    @classmethod
+    def create(cls, cluster_info, validate=False):
         """
         Create a new cluster using information provided in `cluster_info`.
+        With `validate`, the payload is checked first and ValidationError is
+        raised with all the errors found.
         """
+        if validate:
+            cls._check(cluster_info, "create")
         conn = Qubole.agent()
         return conn.post(cls.rest_entity_path, data=cluster_info)
 
     @classmethod
-    def update(cls, cluster_id_label, cluster_info):
+    def update(cls, cluster_id_label, cluster_info, validate=False):
         """
         Update the cluster with id/label `cluster_id_label` using information provided in
-        `cluster_info`.
+        `cluster_info`. See `create` for `validate`.
         """
+        if validate:
+            cls._check(cluster_info, "update")
         conn = Qubole.agent()
+        cls._forget_config(cluster_id_label)
         return conn.put(cls.element_path(cluster_id_label), data=cluster_info)
 
     @classmethod
-    def clone(cls, cluster_id_label, cluster_info):
+    def current_config(cls, cluster_id_label, max_age=None):
+        """
+        Returns the configuration of the cluster with id/label
+        `cluster_id_label`, as returned by `show`. Configurations are cached
+        for `max_age` seconds (`CONFIG_CACHE_TTL` by default); a `max_age` of
+        0 always fetches the cluster.
+        """
+        conn = Qubole.agent()
+        key = (conn.base_url, Qubole.api_token, str(cluster_id_label))
+        if max_age is None:
+            max_age = cls.CONFIG_CACHE_TTL
+        cached = cls._config_cache.get(key)
+        if cached is not None and time.time() - cached[0] < max_age:
+            return cached[1]
+        config = cls.show(cluster_id_label)
+        cls._config_cache[key] = (time.time(), config)
+        return config
+
+    @classmethod
+    def _forget_config(cls, cluster_id_label):
+        """
+        Drops the cached configurations of the cluster with id/label
+        `cluster_id_label`, whether cached by its id or by any of its labels.
+        """
+        conn = Qubole.agent()
+        account = (conn.base_url, Qubole.api_token)
+        names = set([str(cluster_id_label)])
+        for key, (_, config) in list(cls._config_cache.items()):
+            if isinstance(config, dict) and list(config) == ["cluster"]:
+                config = config["cluster"]
+            labels = config.get("label") or []
+            if not isinstance(labels, list):
+                labels = [labels]
+            aliases = set(str(i) for i in [config.get("id")] + labels if i is not None)
+            if key[:2] == account and (key[2] in names or names & aliases):
+                names.update(aliases)
+        for key in list(cls._config_cache):
+            if key[:2] == account and key[2] in names:
+                del cls._config_cache[key]
+
+    @classmethod
+    def diff(cls, cluster_id_label, desired_info, max_age=None):
+        """
+        Computes the changes needed to bring the cluster with id/label
+        `cluster_id_label` to the configuration in `desired_info`.
+
+        Args:
+            `desired_info`: a `ClusterInfo`/`ClusterInfoV13` object or a
+                payload dict as built by their `minimal_payload` methods.
+                Settings which are None or empty are left as they are.
+            `max_age`: see `current_config`
+
+        Returns:
+            the minimal payload holding only the settings which differ from
+            the current configuration, empty if there is nothing to change
+        """
+        if hasattr(desired_info, "minimal_payload"):
+            desired = desired_info.minimal_payload()
+        else:
+            desired = _make_minimal(desired_info)
+        return _diff_payload(desired, cls.current_config(cluster_id_label, max_age))
+
+    @classmethod
+    def update_diff(cls, cluster_id_label, desired_info, max_age=None):
+        """
+        Update the cluster with id/label `cluster_id_label` to the
+        configuration in `desired_info`, sending only the settings which
+        differ from its current configuration. When nothing differs no
+        update is made, so applying an unchanged configuration costs a
+        single GET (none if the configuration is cached).
+
+        Args:
+            `desired_info`, `max_age`: see `diff`
+
+        Returns:
+            the response of the update, or None if nothing was changed
+        """
+        changes = cls.diff(cluster_id_label, desired_info, max_age)
+        if not changes:
+            log.info("Cluster %s is up to date" % cluster_id_label)
+            return None
+        log.info("Updating cluster %s with %s" % (cluster_id_label, json.dumps(changes)))
+        return cls.update(cluster_id_label, changes)
+
+    @classmethod
+    def clone(cls, cluster_id_label, cluster_info, validate=False):
         """
         Update the cluster with id/label `cluster_id_label` using information provided in
-        `cluster_info`.
+        `cluster_info`. See `create` for `validate`.
         """
+        if validate:
+            cls._check(cluster_info, "clone")
         conn = Qubole.agent()
         return conn.post(cls.element_path(cluster_id_label) + '/clone', data=cluster_info)
 
@@ -456,6 +804,132 @@ class Cluster(Resource):
       arguments = argparser.parse_args(args)
       return arguments
 
+    @classmethod
+    def _parse_node_many(cls, args, action):
+        """
+        Parse command line arguments for adding, removing or updating many
+        nodes of a cluster.
+
+        Args:
+            `args`: sequence of arguments
+
+            `action`: "add_nodes", "remove_nodes" or "update_nodes"
+        """
+        argparser = ArgumentParser(prog="cluster %s" % action)
+
+        group = argparser.add_mutually_exclusive_group(required=True)
+        group.add_argument("--id", dest="cluster_id",
+                           help="execute on cluster with this id")
+        group.add_argument("--label", dest="label",
+                           help="execute on cluster with this label")
+
+        if action == "add_nodes":
+            argparser.add_argument("--count", dest="count", type=int, required=True,
+                                   help="number of nodes to add")
+        else:
+            argparser.add_argument("--private_dns", dest="private_dns", nargs="+",
+                                   required=True,
+                                   help="the private_dns of the machines to be"
+                                        " updated/removed")
+        if action == "update_nodes":
+            argparser.add_argument("--command", required=True, choices=["replace"],
+                                   help="the update command to be executed")
+        argparser.add_argument("--concurrency", dest="concurrency", type=int,
+                               default=4,
+                               help="number of nodes changed in parallel. default: 4")
+        argparser.add_argument("--rate", dest="rate", type=float,
+                               help="most node operations started per second")
+        argparser.add_argument("--wait", dest="wait", action="store_true",
+                               default=False,
+                               help="wait until the node operations are done")
+        argparser.add_argument("--timeout", dest="timeout", type=float,
+                               help="secs to wait for, with --wait")
+
+        arguments = argparser.parse_args(args)
+        if action == "add_nodes" and arguments.count < 1:
+            argparser.error("--count must be at least 1")
+        return arguments
+
+    @classmethod
+    def _parse_many(cls, args, action):
+        """
+        Parse command line arguments for starting or terminating many
+        clusters.
+
+        Args:
+            `args`: sequence of arguments
+
+            `action`: "start_many" or "terminate_many"
+
+        Returns:
+            Dictionary that can be used to select and change the clusters
+        """
+        argparser = ArgumentParser(prog="cluster %s" % action)
+
+        argparser.add_argument("cluster_id_labels", nargs="*",
+                               metavar="cluster_id_label",
+                               help="ids/labels of the clusters")
+        argparser.add_argument("--state", dest="state",
+                               choices=['up', 'down', 'pending', 'terminating'],
+                               help="select the clusters in the given state")
+        argparser.add_argument("--filter", dest="filters", action="append",
+                               default=[], metavar="FIELD=VALUE",
+                               help="select the clusters with this value of "
+                                    "the field. can be repeated")
+        argparser.add_argument("--wait", dest="wait", action="store_true",
+                               default=False,
+                               help="wait until the clusters reach the target state")
+        argparser.add_argument("--timeout", dest="timeout", type=float,
+                               help="secs to wait for, with --wait")
+        argparser.add_argument("--concurrency", dest="concurrency", type=int,
+                               default=8,
+                               help="number of clusters changed in parallel."
+                                    " default: 8")
+
+        arguments = vars(argparser.parse_args(args))
+        filters = {}
+        for f in arguments.pop("filters"):
+            if "=" not in f:
+                argparser.error("filter %s is not of the form FIELD=VALUE" % f)
+            field, value = f.split("=", 1)
+            filters[field] = value
+        if arguments["state"] is not None:
+            filters["state"] = arguments["state"]
+        del arguments["state"]
+        if not arguments["cluster_id_labels"] and not filters:
+            argparser.error("expecting cluster ids/labels, --state or --filter")
+        if arguments["cluster_id_labels"] and filters:
+            argparser.error("cluster ids/labels cannot be combined with --state or --filter")
+        arguments["filters"] = filters
+        return arguments
+
+    @classmethod
+    def _parse_reconcile(cls, args):
+        """
+        Parse command line arguments for reconciling clusters with the
+        configurations in a directory.
+        """
+        argparser = ArgumentParser(prog="cluster reconcile")
+
+        argparser.add_argument("directory",
+                               help="directory of cluster configurations, one"
+                                    " JSON payload per cluster")
+        argparser.add_argument("--dry-run", dest="dry_run", action="store_true",
+                               default=False,
+                               help="only print the changes which would be made")
+        argparser.add_argument("--create-missing", dest="create_missing",
+                               action="store_true", default=False,
+                               help="create the configured clusters which do not exist")
+        argparser.add_argument("--concurrency", dest="concurrency", type=int,
+                               default=8,
+                               help="number of clusters fetched or changed in"
+                                    " parallel. default: 8")
+
+        arguments = argparser.parse_args(args)
+        if not os.path.isdir(arguments.directory):
+            argparser.error("%s is not a directory" % arguments.directory)
+        return arguments
+
     @classmethod
     def _parse_reassign_label(cls, args):
         """
@@ -496,6 +970,7 @@ class Cluster(Resource):
         Delete the cluster with id/label `cluster_id_label`.
         """
         conn = Qubole.agent()
+        cls._forget_config(cluster_id_label)
         return conn.delete(cls.element_path(cluster_id_label))
 
     @classmethod
@@ -653,6 +1128,125 @@ class Cluster(Resource):
         data = {"command" : command, "private_dns" : private_dns, "parameters" : parameters}
         return conn.put(cls.element_path(cluster_id_label) + "/nodes", data)
 
+    @classmethod
+    def add_nodes(cls, cluster_nodes, parameters=None, **kwargs):
+        """
+        Add nodes to many clusters.
+
+        Args:
+            `cluster_nodes`: dictionary of cluster id/label to the number of
+                nodes to add to it
+
+        Kwargs:
+            `parameters`, and `concurrency`, `rate`, `wait`, `timeout` and
+            `interval` as for `_node_many`
+
+        Returns:
+            a list of NodeOutcome, one per node added
+        """
+        operations = []
+        for cluster_id_label, count in cluster_nodes.items():
+            operations.extend([(cluster_id_label, None)] * count)
+        return cls._node_many(
+            lambda c, node: cls.add_node(c, parameters), operations, **kwargs)
+
+    @classmethod
+    def remove_nodes(cls, cluster_nodes, parameters=None, **kwargs):
+        """
+        Remove nodes from many clusters.
+
+        Args:
+            `cluster_nodes`: dictionary of cluster id/label to the list of
+                private dns of the nodes to remove from it
+
+        Returns:
+            a list of NodeOutcome, one per node. See `add_nodes`
+        """
+        return cls._node_many(
+            lambda c, node: cls.remove_node(c, node, parameters),
+            cls._node_operations(cluster_nodes), **kwargs)
+
+    @classmethod
+    def update_nodes(cls, cluster_nodes, command, parameters=None, **kwargs):
+        """
+        Run the update `command` (e.g. "replace") on nodes of many clusters.
+
+        Args:
+            `cluster_nodes`: dictionary of cluster id/label to the list of
+                private dns of the nodes to update
+
+        Returns:
+            a list of NodeOutcome, one per node. See `add_nodes`
+        """
+        return cls._node_many(
+            lambda c, node: cls.update_node(c, command, node, parameters),
+            cls._node_operations(cluster_nodes), **kwargs)
+
+    @staticmethod
+    def _node_operations(cluster_nodes):
+        return [(cluster_id_label, node)
+                for cluster_id_label, nodes in cluster_nodes.items()
+                for node in nodes]
+
+    @classmethod
+    def _node_many(cls, operate, operations, concurrency=4, rate=None,
+                   wait=False, timeout=None, interval=None):
+        """
+        Runs the node `operations`, pairs of cluster id/label and private
+        dns, with `operate`.
+
+        Kwargs:
+            `concurrency`: number of operations started in parallel
+
+            `rate`: most operations started per second, across all threads
+
+            `wait`: wait until the cluster manage commands started by the
+                operations are done
+
+            `timeout`: secs to wait for, with `wait`
+
+            `interval`: secs between polls of the commands, with `wait`.
+                Defaults to Qubole.poll_interval
+        """
+        limiter = util.RateLimiter(rate)
+
+        def run(index):
+            limiter.wait()
+            return operate(*operations[index])
+
+        outcomes = [NodeOutcome(c, node, None, None, None) for c, node in operations]
+        for index, response, error in util.run_concurrently(
+                run, range(len(operations)), concurrency):
+            status = response.get("status") if isinstance(response, dict) else None
+            outcomes[index] = outcomes[index]._replace(response=response, status=status,
+                                                       error=error)
+        if wait:
+            cls._wait_for_nodes(outcomes, concurrency, timeout, interval)
+        return outcomes
+
+    @classmethod
+    def _wait_for_nodes(cls, outcomes, concurrency, timeout, interval):
+        from qds_sdk.commands import Command
+        # command id -> indices of the outcomes waiting for it
+        pending = {}
+        for index, outcome in enumerate(outcomes):
+            if outcome.error is None and isinstance(outcome.response, dict) \
+                    and "id" in outcome.response and not Command.is_done(outcome.status):
+                pending.setdefault(outcome.response["id"], []).append(index)
+        if not pending:
+            return
+        commands = Command.wait_many(list(pending), concurrency, timeout, interval)
+        for id, indices in pending.items():
+            command = commands.get(id)
+            for index in indices:
+                if isinstance(command, Exception):
+                    outcomes[index] = outcomes[index]._replace(error=command)
+                    continue
+                outcomes[index] = outcomes[index]._replace(status=command.status)
+                if not Command.is_done(command.status):
+                    outcomes[index] = outcomes[index]._replace(error=WaitTimeout(
+                        "Node command %s was not done within %s seconds" % (id, timeout)))
+
 class ClusterInfo():
     """
     qds_sdk.ClusterInfo is the class which stores information about a cluster.
@@ -1145,6 +1739,38 @@ class ClusterInfoV13():
         return _make_minimal(payload_dict)
 
 
+def _make_diff(desired, current):
+    """
+    This function returns the keys of the minimal dictionary `desired` whose
+    values differ from those in `current`, recursing into nested
+    dictionaries so that only the changed settings of a section are kept.
+    """
+    diff = {}
+    for key, value in _make_minimal(desired).items():
+        current_value = current.get(key) if isinstance(current, dict) else None
+        if isinstance(value, dict) and isinstance(current_value, dict):
+            changes = _make_diff(value, current_value)
+            if changes:
+                diff[key] = changes
+        elif value != current_value:
+            diff[key] = value
+    return diff
+
+
+def _diff_payload(desired, current):
+    """
+    Like _make_diff, for a cluster payload and configuration either of which
+    may be wrapped in a "cluster" key, as in API version 1.2 and in the
+    responses of `show`. The diff is wrapped like the payload.
+    """
+    if isinstance(current, dict) and list(current) == ["cluster"]:
+        current = current["cluster"]
+    if list(desired) == ["cluster"]:
+        changes = _make_diff(desired["cluster"], current)
+        return {"cluster": changes} if changes else {}
+    return _make_diff(desired, current)
+
+
 def _make_minimal(dictionary):
     """
     This function removes all the keys whose value is either None or an empty
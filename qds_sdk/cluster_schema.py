@@ -0,0 +1,242 @@
+"""
+The cluster_schema module checks cluster payloads, as built by
+`ClusterInfo.minimal_payload` and `ClusterInfoV13.minimal_payload`, before
+they are sent to create, update or clone a cluster. The validators are built
+once, when the module is imported, and every error found in a payload is
+reported rather than only the first.
+"""
+
+import six
+
+AWS_REGIONS = ["us-east-1", "us-west-2", "ap-northeast-1", "sa-east-1",
+               "eu-west-1", "ap-southeast-1", "us-west-1"]
+SLAVE_REQUEST_TYPES = ["ondemand", "spot", "hybrid"]
+
+"""Size limits of EBS volumes in GB, by volume type"""
+EBS_VOLUME_SIZES = {"standard": (1, 1024), "gp2": (1, 16384)}
+
+_KINDS = {
+    "string": (six.string_types, "a string"),
+    "integer": (six.integer_types, "an integer"),
+    "number": (six.integer_types + (float,), "a number"),
+    "boolean": ((bool,), "a boolean"),
+    "object": ((dict,), "an object"),
+}
+
+
+def _field(kind, choices=None, minimum=None, maximum=None, fields=None,
+           values=None, rules=()):
+    """
+    Returns a validator of values of the given kind. Validators are called
+    with the value, its path in the payload and the list errors are added
+    to. None values are not sent, so they are always valid.
+
+    Kwargs:
+        `fields`: validators of the known keys of an object
+
+        `values`: validator of every value of an object
+
+        `rules`: functions checking an object as a whole, called like
+            validators
+    """
+    types, description = _KINDS[kind]
+
+    def validate(value, path, errors):
+        if value is None:
+            return
+        if not isinstance(value, types) or (kind != "boolean" and isinstance(value, bool)):
+            errors.append("%s must be %s, not %r" % (path, description, value))
+            return
+        if choices is not None and value not in choices:
+            errors.append("%s must be one of %s, not %r" % (path, ", ".join(choices), value))
+        if minimum is not None and value < minimum:
+            errors.append("%s must be at least %s, not %r" % (path, minimum, value))
+        if maximum is not None and value > maximum:
+            errors.append("%s must be at most %s, not %r" % (path, maximum, value))
+        if fields is not None:
+            for key, item in value.items():
+                if key in fields:
+                    fields[key](item, "%s.%s" % (path, key) if path else key, errors)
+        if values is not None:
+            for key, item in value.items():
+                values(item, "%s.%s" % (path, key), errors)
+        for rule in rules:
+            rule(value, path, errors)
+    return validate
+
+
+def _label(value, path, errors):
+    if value is None:
+        return
+    if isinstance(value, six.string_types):
+        value = [value]
+    if not isinstance(value, list) or not value or \
+            not all(isinstance(l, six.string_types) and l for l in value):
+        errors.append("%s must be a non-empty list of labels, not %r" % (path, value))
+
+
+def _node_rules(nodes, path, errors):
+    """Checks the node settings which depend on each other"""
+    prefix = path + "." if path else ""
+    initial_nodes = nodes.get("initial_nodes")
+    max_nodes = nodes.get("max_nodes")
+    if isinstance(initial_nodes, six.integer_types) and \
+            isinstance(max_nodes, six.integer_types) and initial_nodes > max_nodes:
+        errors.append("%sinitial_nodes (%d) cannot be more than max_nodes (%d)" %
+                      (prefix, initial_nodes, max_nodes))
+
+    request_type = nodes.get("slave_request_type")
+    if request_type not in SLAVE_REQUEST_TYPES:
+        return
+    spot = nodes.get("spot_instance_settings")
+    if spot and request_type == "ondemand":
+        errors.append("%sspot_instance_settings are only valid when "
+                      "slave_request_type is spot or hybrid" % prefix)
+    if isinstance(spot, dict) and spot.get("maximum_spot_instance_percentage") is not None \
+            and request_type != "hybrid":
+        errors.append("%sspot_instance_settings.maximum_spot_instance_percentage is only "
+                      "valid when slave_request_type is hybrid" % prefix)
+    if nodes.get("fallback_to_ondemand") and request_type != "spot":
+        errors.append("%sfallback_to_ondemand is only valid when slave_request_type "
+                      "is spot" % prefix)
+
+
+def _ebs_rules(nodes, path, errors, default_type=None):
+    """
+    Checks the size of EBS volumes against the limits of their type. The
+    type of an existing cluster is not known when the payload leaves it out,
+    so the size is only checked against `default_type` if one is given.
+    """
+    size = nodes.get("ebs_volume_size")
+    volume_type = nodes.get("ebs_volume_type", default_type)
+    limits = EBS_VOLUME_SIZES.get(volume_type)
+    if limits is None or not isinstance(size, six.integer_types):
+        return
+    if not limits[0] <= size <= limits[1]:
+        errors.append("%sebs_volume_size must be between %d and %d GB for %s volumes, not %d" %
+                      (path + "." if path else "", limits[0], limits[1], volume_type, size))
+
+
+_STRING = _field("string")
+_BOOLEAN = _field("boolean")
+
+_EC2_SETTINGS = _field("object", fields={
+    "compute_access_key": _STRING,
+    "compute_secret_key": _STRING,
+    "aws_region": _field("string", choices=AWS_REGIONS),
+    "aws_preferred_availability_zone": _STRING,
+    "vpc_id": _STRING,
+    "subnet_id": _STRING,
+    "role_instance_profile": _STRING,
+})
+
+_SPOT_INSTANCE_SETTINGS = _field("object", fields={
+    "maximum_bid_price_percentage": _field("number", minimum=0),
+    "timeout_for_request": _field("integer", minimum=1),
+    "maximum_spot_instance_percentage": _field("number", minimum=0, maximum=100),
+})
+
+_STABLE_SPOT_INSTANCE_SETTINGS = _field("object", fields={
+    "maximum_bid_price_percentage": _field("number", minimum=0),
+    "timeout_for_request": _field("integer", minimum=1),
+    "allow_fallback": _BOOLEAN,
+})
+
+_NODE_SETTINGS = {
+    "master_instance_type": _STRING,
+    "slave_instance_type": _STRING,
+    "initial_nodes": _field("integer", minimum=1),
+    "max_nodes": _field("integer", minimum=1),
+    "slave_request_type": _field("string", choices=SLAVE_REQUEST_TYPES),
+    "spot_instance_settings": _SPOT_INSTANCE_SETTINGS,
+    "stable_spot_instance_settings": _STABLE_SPOT_INSTANCE_SETTINGS,
+}
+
+_HADOOP_SETTINGS = {
+    "custom_config": _STRING,
+    "use_hbase": _BOOLEAN,
+    "use_hadoop2": _BOOLEAN,
+    "use_spark": _BOOLEAN,
+    "custom_ec2_tags": _field("object", values=_STRING),
+    "fairscheduler_settings": _field("object", fields={
+        "fairscheduler_config_xml": _STRING,
+        "default_pool": _STRING,
+    }),
+}
+
+_PRESTO_SETTINGS = _field("object", fields={
+    "enable_presto": _BOOLEAN,
+    "custom_config": _STRING,
+})
+
+_CLUSTER_SETTINGS = {
+    "label": _label,
+    "disallow_cluster_termination": _BOOLEAN,
+    "enable_ganglia_monitoring": _BOOLEAN,
+    "node_bootstrap_file": _STRING,
+    "ec2_settings": _EC2_SETTINGS,
+    "presto_settings": _PRESTO_SETTINGS,
+}
+
+"""Validator of payloads of API version 1.3"""
+validate_v13 = _field("object", fields=dict(_CLUSTER_SETTINGS, **{
+    "hadoop_settings": _field("object", fields=dict(
+        _HADOOP_SETTINGS, use_qubole_placement_policy=_BOOLEAN)),
+    "node_configuration": _field("object", fields=dict(
+        _NODE_SETTINGS,
+        fallback_to_ondemand=_BOOLEAN,
+        ebs_volume_count=_field("integer", minimum=0),
+        ebs_volume_type=_field("string", choices=sorted(EBS_VOLUME_SIZES)),
+        ebs_volume_size=_field("integer", minimum=1)),
+        rules=(_node_rules, _ebs_rules)),
+    "security_settings": _field("object", fields={
+        "encrypted_ephemerals": _BOOLEAN,
+        "ssh_public_key": _STRING,
+        "persistent_security_group": _STRING,
+    }),
+}))
+
+"""Validator of payloads of API version 1.2, in which the node settings are
+part of the hadoop settings"""
+validate_v12 = _field("object", fields={"cluster": _field("object", fields=dict(
+    _CLUSTER_SETTINGS, **{
+        "hadoop_settings": _field("object", fields=dict(_HADOOP_SETTINGS, **_NODE_SETTINGS),
+                                  rules=(_node_rules,)),
+        "security_settings": _field("object", fields={
+            "encrypted_ephemerals": _BOOLEAN,
+            "customer_ssh_key": _STRING,
+            "persistent_security_group": _STRING,
+        }),
+    }))})
+
+
+def validate_payload(payload, action="update"):
+    """
+    Checks a cluster payload without sending it.
+
+    Args:
+        `payload`: a payload of API version 1.3, or one of version 1.2
+            wrapped in a "cluster" key
+
+        `action`: "create", "update" or "clone". A label is required to
+            create a cluster, and the EBS volumes of a new cluster are
+            standard ones unless their type is given.
+
+    Returns:
+        a list of the errors found, empty if the payload is valid
+    """
+    errors = []
+    if not isinstance(payload, dict):
+        return ["the payload must be an object, not %r" % (payload,)]
+    if list(payload) == ["cluster"]:
+        validate_v12(payload, "", errors)
+        settings = payload["cluster"] if isinstance(payload["cluster"], dict) else {}
+    else:
+        validate_v13(payload, "", errors)
+        settings = payload
+        nodes = payload.get("node_configuration")
+        if action == "create" and isinstance(nodes, dict) and "ebs_volume_type" not in nodes:
+            _ebs_rules(nodes, "node_configuration", errors, default_type="standard")
+    if action == "create" and settings.get("label") is None:
+        errors.append("label is required to create a cluster")
+    return errors
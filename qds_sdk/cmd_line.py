@@ -17,7 +17,7 @@ class CmdLine:
 
     @staticmethod
     def list(cls, args):
-        resource_list = cls.list(args.page, args.per_page)
+        resource_list = cls.list(args.page, args.per_page, fields=args.fields)
         if args.fields:
             for s in resource_list:
                 s.attributes = CmdLine.filter_fields(s.attributes, args.fields)
@@ -25,7 +25,7 @@ class CmdLine:
 
     @staticmethod
     def view(cls, args):
-        cls_instance = cls.find(args.id)
+        cls_instance = cls.find(args.id, fields=args.fields)
         if args.fields:
             cls_instance.attributes = CmdLine.filter_fields(cls_instance.attributes, args.fields)
         return json.dumps(cls_instance.attributes, sort_keys=True, indent=4)
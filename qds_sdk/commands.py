@@ -11,11 +11,16 @@ from qds_sdk.account import Account
 from qds_sdk.util import GentleOptionParser
 from qds_sdk.util import OptionParsingError
 from qds_sdk.util import OptionParsingExit
+from qds_sdk.util import lazy_class_property
+from qds_sdk.metrics import registry
 from optparse import SUPPRESS_HELP
-import boto
+from six.moves import queue
 
+import io
+import six
 import time
 import logging
+import threading
 import sys
 import re
 import pipes
@@ -87,13 +92,83 @@ class Command(Resource):
         Returns:
             Command object
         """
-        cmd = cls.create(**kwargs)
-        while not Command.is_done(cmd.status):
-            time.sleep(Qubole.poll_interval)
-            cmd = cls.find(cmd.id)
+        labels = {"command_type": kwargs.get('command_type') or cls.__name__}
+        with registry.span("qds.command.run", {"qds.command_type": labels["command_type"]}) as span:
+            cmd = cls.create(**kwargs)
+            polls = 0
+            while not Command.is_done(cmd.status):
+                time.sleep(Qubole.poll_interval)
+                cmd = cls.find(cmd.id)
+                polls += 1
+                registry.inc("qds_command_polls_total", labels)
+            registry.observe("qds_command_polls", polls, labels)
+            if span is not None:
+                span.set_attribute("qds.command_id", cmd.id)
+                span.set_attribute("qds.status", cmd.status)
+                span.set_attribute("qds.polls", polls)
 
         return cmd
 
+    @classmethod
+    def wait_many(cls, ids, concurrency=8, timeout=None, interval=None, progress=None,
+                  previous=None):
+        """
+        Polls many commands, in batches fetched with `find_many`, until they
+        are all done or `timeout` secs have passed.
+
+        Args:
+            `ids`: ids of the commands
+
+            `concurrency`: number of commands polled in parallel
+
+            `interval`: secs between two rounds of polls. Defaults to
+                Qubole.poll_interval
+
+            `progress`: called with the number of commands done and the
+                number of commands after every round of polls
+
+            `previous`: dict mapping the ids of commands which were just
+                rerun to their final status before the rerun. Until such a
+                command is seen with another status, it is not done.
+
+        Returns:
+            dict mapping every id to the command as last seen, or to the
+            exception raised when polling it if it was never seen. Commands
+            which are not done ran past the timeout, as did those mapped to
+            None, which were rerun but always seen with their old status.
+        """
+        interval = interval or Qubole.poll_interval or Qubole.MIN_POLL_INTERVAL
+        deadline = time.time() + timeout if timeout is not None else None
+        commands = {}
+        pending = set(ids)
+        previous = dict(previous or {})
+        total = len(pending)
+        labels = {"command_type": cls.__name__}
+        while pending:
+            polled = cls.find_many(pending, concurrency)
+            registry.inc("qds_command_polls_total", labels, len(polled))
+            for id, cmd in polled.items():
+                if isinstance(cmd, Exception):
+                    # Polled again in the next round
+                    log.warning("Could not poll command %s: %s" % (id, cmd))
+                    commands.setdefault(id, cmd)
+                    continue
+                if id in previous and cmd.status == previous[id]:
+                    commands[id] = None
+                    continue
+                previous.pop(id, None)
+                commands[id] = cmd
+                if Command.is_done(cmd.status):
+                    pending.discard(id)
+            if progress is not None:
+                progress(total - len(pending), total)
+            if not pending:
+                break
+            if deadline is not None and time.time() + interval > deadline:
+                break
+            time.sleep(interval)
+        return commands
+
     @classmethod
     def cancel_id(cls, id):
         """
@@ -136,6 +211,63 @@ class Command(Resource):
         r = conn.get_raw(log_path)
         return r.text
 
+    def iter_log(self, follow=False, interval=None):
+        """
+        Yields the log of the command represented by this object in chunks.
+        With `follow`, the command is polled every `interval` secs (
+        Qubole.poll_interval by default) until it is done, and every poll
+        yields the part of the log written since the previous one.
+        """
+        interval = interval or Qubole.poll_interval or Qubole.MIN_POLL_INTERVAL
+        conn = Qubole.agent()
+        labels = {"command_type": self.__class__.__name__}
+        cmd = self
+        seen = 0
+        while True:
+            # The log is fetched once more after the command is seen done
+            done = not follow or Command.is_done(cmd.status)
+            log_path = (cmd.attributes.get("meta_data") or {}).get("logs_resource") or \
+                cmd.element_path(cmd.id) + "/logs"
+            text = conn.get_raw(log_path).text
+            if len(text) > seen:
+                yield text[seen:]
+                seen = len(text)
+            if done:
+                return
+            time.sleep(interval)
+            cmd = self.__class__.find(self.id)
+            registry.inc("qds_command_polls_total", labels)
+
+    def iter_results(self, inline=True, delim=None, fetch=True, buffered_chunks=16):
+        """
+        Yields the result of the command represented by this object as
+        chunks of bytes, as they are downloaded. The download runs in a
+        thread which stops when `buffered_chunks` chunks are waiting to be
+        read, so results are never held in memory as a whole. See
+        `get_results` for the other arguments.
+        """
+        chunks = _ChunkWriter(buffered_chunks)
+        errors = []
+
+        def download():
+            try:
+                self.get_results(chunks, inline=inline, delim=delim, fetch=fetch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                chunks.close()
+
+        thread = threading.Thread(target=download)
+        thread.daemon = True
+        thread.start()
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            chunks.cancel()
+            thread.join()
+        if errors:
+            raise errors[0]
 
     @classmethod
     def get_jobs_id(cls, id):
@@ -154,7 +286,7 @@ class Command(Resource):
         return r.text
 
 
-    def get_results(self, fp=sys.stdout, inline=True, delim=None, fetch=True):
+    def get_results(self, fp=None, inline=True, delim=None, fetch=True):
         """
         Fetches the result for the command represented by this object
 
@@ -165,11 +297,13 @@ class Command(Resource):
         to fp. The retrieval of results from s3 can be turned off by the `fetch` argument
 
         Args:
-            `fp`: a file object to write the results to directly
+            `fp`: a file object to write the results to directly. Defaults
+                  to the current sys.stdout
             `inline`: whether or not results are returned inline as CRLF separated string
             `fetch`: True to fetch the result even if it is greater than 20MB, False to
                      only get the result location on s3
         """
+        fp = fp or sys.stdout
         result_path = self.meta_data['results_resource']
 
         conn = Qubole.agent()
@@ -190,9 +324,7 @@ class Command(Resource):
         else:
             if fetch:
                 storage_credentials = conn.get(Account.credentials_rest_entity_path)
-                boto_conn = boto.connect_s3(aws_access_key_id=storage_credentials['storage_access_key'],
-                                            aws_secret_access_key=storage_credentials['storage_secret_key'],
-                                            security_token = storage_credentials['session_token'])
+                boto_conn = _get_s3_connection(storage_credentials)
 
                 log.info("Starting download from result locations: [%s]" % ",".join(r['result_location']))
                 #fetch latest value of num_result_dir
@@ -213,32 +345,35 @@ class HiveCommand(Command):
 
     usage = ("hivecmd <submit|run> [options]")
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("-q", "--query", dest="query", help="query string")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("-q", "--query", dest="query", help="query string")
 
-    optparser.add_option("-f", "--script_location", dest="script_location",
-                         help="Path where hive query to run is stored. Can be S3 URI or local file path")
+        optparser.add_option("-f", "--script_location", dest="script_location",
+                             help="Path where hive query to run is stored. Can be S3 URI or local file path")
 
-    optparser.add_option("--macros", dest="macros",
-                         help="expressions to expand macros used in query")
+        optparser.add_option("--macros", dest="macros",
+                             help="expressions to expand macros used in query")
 
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
 
-    optparser.add_option("--sample_size", dest="sample_size",
-                         help="size of sample in bytes on which to run query")
+        optparser.add_option("--sample_size", dest="sample_size",
+                             help="size of sample in bytes on which to run query")
 
-    optparser.add_option("--cluster-label", dest="label",
-                         help="the label of the cluster to run the command on")
+        optparser.add_option("--cluster-label", dest="label",
+                             help="the label of the cluster to run the command on")
 
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
 
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this query")
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this query")
 
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -297,32 +432,35 @@ class SqlCommand(Command):
 
     usage = ("sqlcmd <submit|run> [options]")
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("-q", "--query", dest="query", help="query string")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("-q", "--query", dest="query", help="query string")
 
-    optparser.add_option("-f", "--script_location", dest="script_location",
-                         help="Path where hive query to run is stored. Can be S3 URI or local file path")
+        optparser.add_option("-f", "--script_location", dest="script_location",
+                             help="Path where hive query to run is stored. Can be S3 URI or local file path")
 
-    optparser.add_option("--macros", dest="macros",
-                         help="expressions to expand macros used in query")
+        optparser.add_option("--macros", dest="macros",
+                             help="expressions to expand macros used in query")
 
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
 
-    optparser.add_option("--sample_size", dest="sample_size",
-                         help="size of sample in bytes on which to run query")
+        optparser.add_option("--sample_size", dest="sample_size",
+                             help="size of sample in bytes on which to run query")
 
-    optparser.add_option("--cluster-label", dest="label",
-                         help="the label of the cluster to run the command on")
+        optparser.add_option("--cluster-label", dest="label",
+                             help="the label of the cluster to run the command on")
 
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
 
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this query")
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this query")
 
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -382,38 +520,42 @@ class SparkCommand(Command):
     usage = ("sparkcmd <submit|run> [options]")
     allowedlanglist = ["python", "scala","R"]
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("--program", dest="program",help=SUPPRESS_HELP)
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("--program", dest="program",help=SUPPRESS_HELP)
 
-    optparser.add_option("--cmdline", dest="cmdline", help="command line for Spark")
+        optparser.add_option("--cmdline", dest="cmdline", help="command line for Spark")
 
-    optparser.add_option("--sql", dest="sql", help="sql for Spark")
+        optparser.add_option("--sql", dest="sql", help="sql for Spark")
 
-    optparser.add_option("-f", "--script_location", dest="script_location",
-                         help="Path where spark program to run is stored. Has to be a local file path")
+        optparser.add_option("-f", "--script_location", dest="script_location",
+                             help="Path where spark program to run is stored. Has to be a local file path")
 
-    optparser.add_option("--macros", dest="macros",
-                         help="expressions to expand macros used in query")
+        optparser.add_option("--macros", dest="macros",
+                             help="expressions to expand macros used in query")
 
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
 
-    optparser.add_option("--cluster-label", dest="label", help="the label of the cluster to run the command on")
+        optparser.add_option("--cluster-label", dest="label", help="the label of the cluster to run the command on")
 
-    optparser.add_option("--language", dest="language", choices = allowedlanglist, help=SUPPRESS_HELP)
+        optparser.add_option("--language", dest="language", choices = cls.allowedlanglist, help=SUPPRESS_HELP)
 
-    optparser.add_option("--app-id", dest="app_id", type=int, help="The Spark Job Server app id to submit this snippet to.")
+        optparser.add_option("--app-id", dest="app_id", type=int, help="The Spark Job Server app id to submit this snippet to.")
 
-    optparser.add_option("--notify", action="store_true", dest="can_notify", default=False, help="sends an email on command completion")
+        optparser.add_option("--notify", action="store_true", dest="can_notify", default=False, help="sends an email on command completion")
 
-    optparser.add_option("--name", dest="name", help="Assign a name to this query")
+        optparser.add_option("--name", dest="name", help="Assign a name to this query")
 
-    optparser.add_option("--arguments", dest = "arguments", help = "Spark Submit Command Line Options")
+        optparser.add_option("--arguments", dest = "arguments", help = "Spark Submit Command Line Options")
 
-    optparser.add_option("--user_program_arguments", dest = "user_program_arguments", help = "Arguments for User Program")
+        optparser.add_option("--user_program_arguments", dest = "user_program_arguments", help = "Arguments for User Program")
+
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
     @classmethod
     def validate_program(cls, options):
         bool_program = options.program is not None
@@ -546,29 +688,32 @@ class PrestoCommand(Command):
 
     usage = ("prestocmd <submit|run> [options]")
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("-q", "--query", dest="query", help="query string")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("-q", "--query", dest="query", help="query string")
 
-    optparser.add_option("-f", "--script_location", dest="script_location",
-                         help="Path where presto query to run is stored. Can be S3 URI or local file path")
+        optparser.add_option("-f", "--script_location", dest="script_location",
+                             help="Path where presto query to run is stored. Can be S3 URI or local file path")
 
-    optparser.add_option("--macros", dest="macros",
-                         help="expressions to expand macros used in query")
+        optparser.add_option("--macros", dest="macros",
+                             help="expressions to expand macros used in query")
 
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
 
-    optparser.add_option("--cluster-label", dest="label",
-                         help="the label of the cluster to run the command on")
+        optparser.add_option("--cluster-label", dest="label",
+                             help="the label of the cluster to run the command on")
 
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
 
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this query")
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this query")
 
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -627,23 +772,26 @@ class HadoopCommand(Command):
     subcmdlist = ["jar", "s3distcp", "streaming"]
     usage = "hadoopcmd <submit|run> [options] <%s> <arg1> [arg2] ..." % "|".join(subcmdlist)
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("--cluster-label", dest="label",
-                         help="the label of the cluster to run the command on")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("--cluster-label", dest="label",
+                             help="the label of the cluster to run the command on")
 
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
 
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this command")
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this command")
 
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
 
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
 
-    optparser.disable_interspersed_args()
+        optparser.disable_interspersed_args()
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -693,32 +841,35 @@ class HadoopCommand(Command):
 class ShellCommand(Command):
     usage = ("shellcmd <submit|run> [options] [arg1] [arg2] ...")
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("-s", "--script", dest="inline", help="inline script that can be executed by bash")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("-s", "--script", dest="inline", help="inline script that can be executed by bash")
 
-    optparser.add_option("-f", "--script_location", dest="script_location",
-                         help="Path where bash script to run is stored. Can be S3 URI or local file path")
+        optparser.add_option("-f", "--script_location", dest="script_location",
+                             help="Path where bash script to run is stored. Can be S3 URI or local file path")
 
-    optparser.add_option("-i", "--files", dest="files",
-                         help="List of files [optional] Format : file1,file2 (files in s3 bucket) These files will be copied to the working directory where the command is executed")
+        optparser.add_option("-i", "--files", dest="files",
+                             help="List of files [optional] Format : file1,file2 (files in s3 bucket) These files will be copied to the working directory where the command is executed")
 
-    optparser.add_option("-a", "--archives", dest="archives",
-                         help="List of archives [optional] Format : archive1,archive2 (archives in s3 bucket) These are unarchived in the working directory where the command is executed")
+        optparser.add_option("-a", "--archives", dest="archives",
+                             help="List of archives [optional] Format : archive1,archive2 (archives in s3 bucket) These are unarchived in the working directory where the command is executed")
 
-    optparser.add_option("--cluster-label", dest="label",
-                         help="the label of the cluster to run the command on")
+        optparser.add_option("--cluster-label", dest="label",
+                             help="the label of the cluster to run the command on")
 
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
 
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
 
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this command")
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this command")
 
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -791,27 +942,30 @@ class ShellCommand(Command):
 class PigCommand(Command):
     usage = ("pigcmd <submit|run> [options] [key1=value1] [key2=value2] ...")
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("-s", "--script", dest="latin_statements",
-                         help="latin statements that has to be executed")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("-s", "--script", dest="latin_statements",
+                             help="latin statements that has to be executed")
 
-    optparser.add_option("-f", "--script_location", dest="script_location",
-                         help="Path where bash script to run is stored. Can be S3 URI or local file path")
+        optparser.add_option("-f", "--script_location", dest="script_location",
+                             help="Path where bash script to run is stored. Can be S3 URI or local file path")
 
-    optparser.add_option("--cluster-label", dest="label",
-                         help="the label of the cluster to run the command on")
+        optparser.add_option("--cluster-label", dest="label",
+                             help="the label of the cluster to run the command on")
 
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
 
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
 
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this command")
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this command")
 
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -889,44 +1043,47 @@ class PigCommand(Command):
 class DbExportCommand(Command):
     usage = ("dbexportcmd <submit|run> [options]")
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("-m", "--mode", dest="mode",
-                         help="Can be 1 for Hive export or 2 for HDFS/S3 export")
-    optparser.add_option("--hive_table", dest="hive_table",
-                         help="Mode 1: Name of the Hive Table from which data will be exported")
-    optparser.add_option("--partition_spec", dest="partition_spec",
-                         help="Mode 1: (optional) Partition specification for Hive table")
-    optparser.add_option("--dbtap_id", dest="dbtap_id",
-                         help="Modes 1 and 2: DbTap Id of the target database in Qubole")
-    optparser.add_option("--db_table", dest="db_table",
-                         help="Modes 1 and 2: Table to export to in the target database")
-    optparser.add_option("--db_update_mode", dest="db_update_mode",
-                         help="Modes 1 and 2: (optional) can be 'allowinsert' or "
-                              "'updateonly'. If updateonly is "
-                              "specified - only existing rows are updated. If allowinsert "
-                              "is specified - then existing rows are updated and non existing "
-                              "rows are inserted. If this option is not specified - then the "
-                              "given the data will be appended to the table")
-    optparser.add_option("--db_update_keys", dest="db_update_keys",
-                         help="Modes 1 and 2: Columns used to determine the uniqueness of rows for "
-                              "'updateonly' mode")
-    optparser.add_option("--export_dir", dest="export_dir",
-                         help="Mode 2: HDFS/S3 location from which data will be exported")
-    optparser.add_option("--fields_terminated_by", dest="fields_terminated_by",
-                         help="Mode 2: Hex of the char used as column separator "
-                              "in the dataset, for eg. \0x20 for space")
-
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
-
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
-
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this command")
-
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("-m", "--mode", dest="mode",
+                             help="Can be 1 for Hive export or 2 for HDFS/S3 export")
+        optparser.add_option("--hive_table", dest="hive_table",
+                             help="Mode 1: Name of the Hive Table from which data will be exported")
+        optparser.add_option("--partition_spec", dest="partition_spec",
+                             help="Mode 1: (optional) Partition specification for Hive table")
+        optparser.add_option("--dbtap_id", dest="dbtap_id",
+                             help="Modes 1 and 2: DbTap Id of the target database in Qubole")
+        optparser.add_option("--db_table", dest="db_table",
+                             help="Modes 1 and 2: Table to export to in the target database")
+        optparser.add_option("--db_update_mode", dest="db_update_mode",
+                             help="Modes 1 and 2: (optional) can be 'allowinsert' or "
+                                  "'updateonly'. If updateonly is "
+                                  "specified - only existing rows are updated. If allowinsert "
+                                  "is specified - then existing rows are updated and non existing "
+                                  "rows are inserted. If this option is not specified - then the "
+                                  "given the data will be appended to the table")
+        optparser.add_option("--db_update_keys", dest="db_update_keys",
+                             help="Modes 1 and 2: Columns used to determine the uniqueness of rows for "
+                                  "'updateonly' mode")
+        optparser.add_option("--export_dir", dest="export_dir",
+                             help="Mode 2: HDFS/S3 location from which data will be exported")
+        optparser.add_option("--fields_terminated_by", dest="fields_terminated_by",
+                             help="Mode 2: Hex of the char used as column separator "
+                                  "in the dataset, for eg. \0x20 for space")
+
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
+
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this command")
+
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -994,39 +1151,42 @@ class DbexportCommand(DbExportCommand):
 class DbImportCommand(Command):
     usage = "dbimportcmd <submit|run> [options]"
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("-m", "--mode", dest="mode",
-                         help="Can be 1 for Hive export or 2 for HDFS/S3 export")
-    optparser.add_option("--hive_table", dest="hive_table",
-                         help="Mode 1: Name of the Hive Table from which data will be exported")
-    optparser.add_option("--dbtap_id", dest="dbtap_id",
-                         help="Modes 1 and 2: DbTap Id of the target database in Qubole")
-    optparser.add_option("--db_table", dest="db_table",
-                         help="Modes 1 and 2: Table to export to in the target database")
-    optparser.add_option("--where_clause", dest="db_where",
-                         help="Mode 1: where clause to be applied to the table before extracting rows to be imported")
-    optparser.add_option("--parallelism", dest="db_parallelism",
-                         help="Mode 1 and 2: Number of parallel threads to use for extracting data")
-
-    optparser.add_option("--extract_query", dest="db_extract_query",
-                         help="Modes 2: SQL query to be applied at the source database for extracting data. "
-                              "$CONDITIONS must be part of the where clause")
-    optparser.add_option("--boundary_query", dest="db_boundary_query",
-                         help="Mode 2: query to be used get range of rowids to be extracted")
-    optparser.add_option("--split_column", dest="db_split_column",
-                         help="column used as rowid to split data into range")
-
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
-
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
-
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this command")
-
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("-m", "--mode", dest="mode",
+                             help="Can be 1 for Hive export or 2 for HDFS/S3 export")
+        optparser.add_option("--hive_table", dest="hive_table",
+                             help="Mode 1: Name of the Hive Table from which data will be exported")
+        optparser.add_option("--dbtap_id", dest="dbtap_id",
+                             help="Modes 1 and 2: DbTap Id of the target database in Qubole")
+        optparser.add_option("--db_table", dest="db_table",
+                             help="Modes 1 and 2: Table to export to in the target database")
+        optparser.add_option("--where_clause", dest="db_where",
+                             help="Mode 1: where clause to be applied to the table before extracting rows to be imported")
+        optparser.add_option("--parallelism", dest="db_parallelism",
+                             help="Mode 1 and 2: Number of parallel threads to use for extracting data")
+
+        optparser.add_option("--extract_query", dest="db_extract_query",
+                             help="Modes 2: SQL query to be applied at the source database for extracting data. "
+                                  "$CONDITIONS must be part of the where clause")
+        optparser.add_option("--boundary_query", dest="db_boundary_query",
+                             help="Mode 2: query to be used get range of rowids to be extracted")
+        optparser.add_option("--split_column", dest="db_split_column",
+                             help="column used as rowid to split data into range")
+
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
+
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this command")
+
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -1098,22 +1258,25 @@ class CompositeCommand(Command):
 class DbTapQueryCommand(Command):
     usage = "dbtapquerycmd <submit|run> [options]"
 
-    optparser = GentleOptionParser(usage=usage)
-    optparser.add_option("--db_tap_id", dest="db_tap_id",
-                         help="dbTap Id of the target database in Qubole")
-    optparser.add_option("-q", "--query", dest="query", help="query string")
-    optparser.add_option("--notify", action="store_true", dest="can_notify",
-                         default=False, help="sends an email on command completion")
-    optparser.add_option("--macros", dest="macros",
-                         help="expressions to expand macros used in query")
-
-    optparser.add_option("--tags", dest="tags",
-                         help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
-    optparser.add_option("--name", dest="name",
-                         help="Assign a name to this command")
-
-    optparser.add_option("--print-logs", action="store_true", dest="print_logs",
-                         default=False, help="Fetch logs and print them to stderr.")
+    @lazy_class_property
+    def optparser(cls):
+        optparser = GentleOptionParser(usage=cls.usage)
+        optparser.add_option("--db_tap_id", dest="db_tap_id",
+                             help="dbTap Id of the target database in Qubole")
+        optparser.add_option("-q", "--query", dest="query", help="query string")
+        optparser.add_option("--notify", action="store_true", dest="can_notify",
+                             default=False, help="sends an email on command completion")
+        optparser.add_option("--macros", dest="macros",
+                             help="expressions to expand macros used in query")
+
+        optparser.add_option("--tags", dest="tags",
+                             help="comma-separated list of tags to be associated with the query ( e.g., tag1 tag1,tag2 )")
+        optparser.add_option("--name", dest="name",
+                             help="Assign a name to this command")
+
+        optparser.add_option("--print-logs", action="store_true", dest="print_logs",
+                             default=False, help="Fetch logs and print them to stderr.")
+        return optparser
 
     @classmethod
     def parse(cls, args):
@@ -1151,6 +1314,154 @@ class DbTapQueryCommand(Command):
         v["command_type"] = "DbTapQueryCommand"
         return v
 
+"""
+command_type -> class of the commands of that type, or the "module:Class"
+path of a registered class not imported yet
+"""
+_command_classes = {}
+_command_classes_lock = threading.Lock()
+_builtin_classes_loaded = False
+
+
+def register_command_class(command_type, cls):
+    """
+    Registers the class of the commands of type `command_type`, the value
+    of the `command_type` field of commands returned by the API, for
+    `command_class`. Registered classes take precedence over the classes
+    defined in this module.
+
+    Args:
+        `cls`: a subclass of Command, or the "package.module:ClassName"
+            path of one. Paths are imported the first time a command of the
+            type is returned, so plugins cost nothing until then.
+    """
+    if not isinstance(cls, six.string_types) and \
+            not (isinstance(cls, type) and issubclass(cls, Command)):
+        raise TypeError("%r is neither a Command subclass nor the path of one" % (cls,))
+    with _command_classes_lock:
+        _command_classes[command_type] = cls
+
+
+def command_class(command_type):
+    """
+    Returns:
+        the class of commands of type `command_type`, as given by the
+        `command_type` field of commands returned by the API. Command for
+        unknown types.
+    """
+    cls = _command_classes.get(command_type)
+    if isinstance(cls, type):
+        return cls
+    return _resolve_command_class(command_type)
+
+
+def _resolve_command_class(command_type):
+    global _builtin_classes_loaded
+    with _command_classes_lock:
+        if not _builtin_classes_loaded:
+            classes = [Command]
+            while classes:
+                cls = classes.pop()
+                _command_classes.setdefault(cls.__name__, cls)
+                classes.extend(cls.__subclasses__())
+            _builtin_classes_loaded = True
+        cls = _command_classes.get(command_type)
+        if isinstance(cls, six.string_types):
+            cls = _import_command_class(command_type, cls)
+        elif cls is None:
+            # Unknown types are remembered too, so that they are resolved
+            # with a single lookup from then on
+            cls = Command
+        _command_classes[command_type] = cls
+        return cls
+
+
+def _import_command_class(command_type, path):
+    module_name, _, class_name = path.partition(":")
+    try:
+        # importlib is not available on Python 2.6
+        __import__(module_name)
+        cls = getattr(sys.modules[module_name], class_name)
+        if not issubclass(cls, Command):
+            raise TypeError("%s is not a Command subclass" % path)
+        return cls
+    except Exception as e:
+        log.warning("Could not load the class %s of %s commands, using Command: %s" %
+                    (path, command_type, e))
+        return Command
+
+
+class _ChunkWriter(io.RawIOBase):
+    """
+    A binary file object handing the chunks written to it to a reader
+    iterating over it, from another thread. Writes block while `maxsize`
+    chunks are waiting to be read.
+    """
+
+    _END = object()
+
+    def __init__(self, maxsize):
+        super(_ChunkWriter, self).__init__()
+        self._chunks = queue.Queue(maxsize)
+        self._cancelled = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self._cancelled:
+            raise IOError("The reader of the results went away")
+        if not isinstance(data, bytes):
+            data = data.encode("utf8")
+        if data:
+            self._chunks.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._chunks.put(self._END)
+        super(_ChunkWriter, self).close()
+
+    def cancel(self):
+        """Called by the reader when it stops reading: unblocks the writer"""
+        self._cancelled = True
+        while True:
+            try:
+                self._chunks.get_nowait()
+            except queue.Empty:
+                if self.closed:
+                    return
+                time.sleep(0.01)
+
+    def __iter__(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is self._END:
+                return
+            yield chunk
+
+
+def _get_s3_connection(storage_credentials):
+    '''
+    Returns a boto S3 connection using the storage credentials of the account.
+    Connects to Qubole.s3_endpoint instead of AWS when it is configured.
+    '''
+    import boto
+    kwargs = {}
+    if Qubole.s3_endpoint is not None:
+        from boto.s3.connection import OrdinaryCallingFormat
+        from six.moves.urllib.parse import urlparse
+        endpoint = urlparse(Qubole.s3_endpoint)
+        kwargs = {'host': endpoint.hostname,
+                  'port': endpoint.port,
+                  'is_secure': endpoint.scheme == 'https',
+                  'calling_format': OrdinaryCallingFormat()}
+    return boto.connect_s3(aws_access_key_id=storage_credentials['storage_access_key'],
+                           aws_secret_access_key=storage_credentials['storage_secret_key'],
+                           security_token=storage_credentials['session_token'],
+                           **kwargs)
+
+
 def _read_iteratively(key_instance, fp, delim):
     key_instance.open_read()
     while True:
@@ -1173,6 +1484,28 @@ def _read_iteratively(key_instance, fp, delim):
             return
 
 
+def _download_key(key_instance, fp, delim):
+    """
+    Writes the contents of one S3 object to fp, recording the bytes
+    downloaded and the throughput achieved
+    """
+    start = time.time()
+    with registry.span("qds.s3.download", {"s3.bucket": key_instance.bucket.name,
+                                           "s3.key": key_instance.name,
+                                           "s3.size": key_instance.size}):
+        if delim is None:
+            key_instance.get_contents_to_file(fp)  # cb=_callback
+        else:
+            # Get contents as string. Replace parameters and write to file.
+            _read_iteratively(key_instance, fp, delim=delim)
+    elapsed = time.time() - start
+    size = key_instance.size or 0
+    registry.inc("qds_s3_download_bytes_total", value=size)
+    registry.observe("qds_s3_download_duration_seconds", elapsed)
+    if elapsed > 0:
+        registry.observe("qds_s3_download_throughput_bytes", size / elapsed)
+
+
 def _download_to_local(boto_conn, s3_path, fp, num_result_dir, delim=None):
     '''
     Downloads the contents of all objects in s3_path into fp
@@ -1240,11 +1573,7 @@ def _download_to_local(boto_conn, s3_path, fp, num_result_dir, delim=None):
         if key_instance is None:
             raise Exception("Results file not available on s3 yet. This can be because of s3 eventual consistency issues.")
         log.info("Downloading file from %s" % s3_path)
-        if delim is None:
-            key_instance.get_contents_to_file(fp)  # cb=_callback
-        else:
-            # Get contents as string. Replace parameters and write to file.
-            _read_iteratively(key_instance, fp, delim=delim)
+        _download_key(key_instance, fp, delim)
 
     else:
         #It is a folder
@@ -1267,7 +1596,4 @@ def _download_to_local(boto_conn, s3_path, fp, num_result_dir, delim=None):
                 continue
 
             log.info("Downloading file from %s" % name)
-            if delim is None:
-                one_path.get_contents_to_file(fp)  # cb=_callback
-            else:
-                _read_iteratively(one_path, fp, delim=delim)
+            _download_key(one_path, fp, delim)
@@ -1,9 +1,10 @@
 import sys
+import re
+import time
 import requests
 import logging
 import ssl
 import json
-import pkg_resources
 from requests.adapters import HTTPAdapter
 try:
     from requests.packages.urllib3.poolmanager import PoolManager
@@ -11,10 +12,40 @@ except ImportError:
     from urllib3.poolmanager import PoolManager
 from qds_sdk.retry import retry
 from qds_sdk.exception import *
+from qds_sdk.metrics import registry
 
 
 log = logging.getLogger("qds_connection")
 
+_user_agent = None
+
+# Connections kept open to QDS, i.e. the useful concurrency of batch calls
+POOL_MAXSIZE = 32
+
+# Numeric ids in a path, replaced so that metrics are recorded per endpoint
+_ID_RE = re.compile(r'(?<=/)\d+(?=/|$)')
+
+
+def _endpoint(path):
+    """
+    Returns:
+        `path` without its query string and with numeric ids replaced by
+        ":id", e.g. "commands/:id/results" for "commands/123/results"
+    """
+    return _ID_RE.sub(":id", path.split('?', 1)[0].strip('/'))
+
+
+def _get_user_agent():
+    """
+    pkg_resources is slow to import, so the version lookup is deferred until
+    the first connection is made and then cached for the process.
+    """
+    global _user_agent
+    if _user_agent is None:
+        import pkg_resources
+        _user_agent = 'qds-sdk-py-%s' % pkg_resources.get_distribution("qds-sdk").version
+    return _user_agent
+
 """
 see http://stackoverflow.com/questions/14102416/python-requests-requests-exceptions-sslerror-errno-8-ssl-c504-eof-occurred
 """
@@ -31,17 +62,20 @@ class MyAdapter(HTTPAdapter):
 
 class Connection:
 
-    def __init__(self, auth, base_url, skip_ssl_cert_check, reuse=True):
+    def __init__(self, auth, base_url, skip_ssl_cert_check, reuse=True, timeout=300):
         self.auth = auth
         self.base_url = base_url
         self.skip_ssl_cert_check = skip_ssl_cert_check
-        self._headers = {'User-Agent': 'qds-sdk-py-%s' % pkg_resources.get_distribution("qds-sdk").version,
+        self.timeout = timeout
+        self._headers = {'User-Agent': _get_user_agent(),
                          'Content-Type': 'application/json'}
 
         self.reuse = reuse
         if reuse:
             self.session = requests.Session()
-            self.session.mount('https://', MyAdapter())
+            # Sized for the thread pools of the batch calls (e.g. find_many)
+            self.session.mount('https://', MyAdapter(pool_maxsize=POOL_MAXSIZE))
+            self.session.mount('http://', HTTPAdapter(pool_maxsize=POOL_MAXSIZE))
 
     @retry((RetryWithDelay, requests.Timeout), tries=6, delay=30, backoff=2)
     def get_raw(self, path, params=None):
@@ -79,18 +113,37 @@ class Connection:
         log.info("Payload: %s" % json.dumps(data, indent=4))
         log.info("Params: %s" % params)
 
-        if req_type == 'GET':
-            r = x.get(url, timeout=300, **kwargs)
-        elif req_type == 'POST':
-            r = x.post(url, timeout=300, **kwargs)
-        elif req_type == 'PUT':
-            r = x.put(url, timeout=300, **kwargs)
-        elif req_type == 'DELETE':
-            r = x.delete(url, timeout=300, **kwargs)
-        else:
-            raise NotImplemented
-
-        self._handle_error(r)
+        endpoint = _endpoint(path)
+        labels = {"method": req_type, "endpoint": endpoint, "status": "error"}
+        start = time.time()
+        with registry.span("qds.request", {"http.method": req_type,
+                                           "http.url": url,
+                                           "qds.endpoint": endpoint}) as span:
+            try:
+                if req_type == 'GET':
+                    r = x.get(url, timeout=self.timeout, **kwargs)
+                elif req_type == 'POST':
+                    r = x.post(url, timeout=self.timeout, **kwargs)
+                elif req_type == 'PUT':
+                    r = x.put(url, timeout=self.timeout, **kwargs)
+                elif req_type == 'DELETE':
+                    r = x.delete(url, timeout=self.timeout, **kwargs)
+                else:
+                    raise NotImplemented
+                labels["status"] = str(r.status_code)
+                if span is not None:
+                    span.set_attribute("http.status_code", r.status_code)
+                registry.inc("qds_request_bytes_received_total",
+                             {"endpoint": endpoint}, len(r.content))
+            finally:
+                registry.inc("qds_requests_total", labels)
+                registry.observe("qds_request_duration_seconds",
+                                 time.time() - start, labels)
+                if 'data' in kwargs:
+                    registry.inc("qds_request_bytes_sent_total",
+                                 {"endpoint": endpoint}, len(kwargs['data']))
+
+            self._handle_error(r)
         return r
 
     def _api_call(self, req_type, path, data=None, params=None):
@@ -0,0 +1,304 @@
+"""
+The daemon module contains a long-lived server which runs qds.py invocations
+in a warm process, and the client used by qds.py to forward invocations to
+it over a Unix domain socket.
+
+The client side of this module only uses the standard library so that a
+forwarded invocation does not pay for importing the rest of the SDK.
+"""
+import os
+import io
+import sys
+import json
+import errno
+import socket
+import struct
+import logging
+import threading
+
+log = logging.getLogger("qds_daemon")
+
+DEFAULT_SOCKET_PATH = os.path.join("~", ".qds", "daemon.sock")
+
+# Every message on the socket is a frame: a one byte channel followed by a
+# four byte payload length and the payload.
+_FRAME_HEADER = struct.Struct("!cI")
+CHANNEL_REQUEST = b"r"
+CHANNEL_STDOUT = b"1"
+CHANNEL_STDERR = b"2"
+CHANNEL_EXIT = b"x"
+# Sent instead of running the invocation while the daemon runs another one
+CHANNEL_BUSY = b"b"
+
+# Only these environment variables are forwarded from the client, so that
+# the daemon resolves defaults exactly as the invoking shell would.
+_ENV_PREFIX = "QDS_"
+
+
+def socket_path(path=None):
+    """
+    Returns the path of the daemon socket. Can be overridden with the
+    QDS_DAEMON_SOCKET environment variable.
+    """
+    if path is None:
+        path = os.getenv("QDS_DAEMON_SOCKET", DEFAULT_SOCKET_PATH)
+    return os.path.expanduser(path)
+
+
+def _send_frame(sock, channel, payload):
+    sock.sendall(_FRAME_HEADER.pack(channel, len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_frame(sock):
+    header = _recv_exactly(sock, _FRAME_HEADER.size)
+    if header is None:
+        return None, None
+    channel, length = _FRAME_HEADER.unpack(header)
+    payload = _recv_exactly(sock, length) if length else b""
+    if payload is None:
+        return None, None
+    return channel, payload
+
+
+def _binary_stream(stream):
+    return getattr(stream, "buffer", stream)
+
+
+def forward(argv, path=None, stdout=None, stderr=None):
+    """
+    Run a qds.py invocation in the daemon, if one is listening.
+
+    Args:
+        `argv`: the qds.py arguments, without the program name
+
+        `path`: path of the daemon socket
+
+        `stdout`, `stderr`: binary streams which receive the output of the
+            invocation. Default to the process' own streams.
+
+    Returns:
+        The exit status of the invocation, or None if no daemon is running
+        or it is busy with another invocation
+    """
+    path = socket_path(path)
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        log.info("No daemon listening on %s" % path)
+        return None
+
+    stdout = stdout or _binary_stream(sys.stdout)
+    stderr = stderr or _binary_stream(sys.stderr)
+    outputs = {CHANNEL_STDOUT: stdout, CHANNEL_STDERR: stderr}
+
+    request = {
+        "argv": list(argv),
+        "cwd": os.getcwd(),
+        "env": dict((k, v) for k, v in os.environ.items()
+                    if k.startswith(_ENV_PREFIX)),
+    }
+    try:
+        _send_frame(sock, CHANNEL_REQUEST, json.dumps(request).encode("utf8"))
+        while True:
+            channel, payload = _recv_frame(sock)
+            if channel is None:
+                stderr.write(b"Connection to qds daemon closed unexpectedly\n")
+                return 3
+            if channel == CHANNEL_EXIT:
+                return int(payload.decode("utf8"))
+            if channel == CHANNEL_BUSY:
+                log.info("qds daemon on %s is busy" % path)
+                return None
+            outputs[channel].write(payload)
+            outputs[channel].flush()
+    finally:
+        sock.close()
+
+
+class _ChannelBuffer(io.RawIOBase):
+    """Binary stream which sends everything written to it as frames."""
+
+    def __init__(self, sock, channel):
+        io.RawIOBase.__init__(self)
+        self.sock = sock
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        if data:
+            _send_frame(self.sock, self.channel, data)
+        return len(data)
+
+
+class _ChannelStream(io.TextIOBase):
+    """
+    Text stream used in place of sys.stdout/sys.stderr while an invocation
+    runs in the daemon. Accepts both text and bytes, and exposes `buffer`
+    for code which writes encoded results directly.
+    """
+
+    encoding = "utf8"
+
+    def __init__(self, sock, channel):
+        io.TextIOBase.__init__(self)
+        self.buffer = _ChannelBuffer(sock, channel)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf8")
+        self.buffer.write(data)
+        return len(data)
+
+
+class QdsDaemon(object):
+    """
+    Serves qds.py invocations received on a Unix domain socket.
+
+    Invocations run one at a time in this process, so the Connection pool
+    held by Qubole.agent() stays warm across invocations. Standard streams
+    are process-wide, so an invocation received while another one runs is
+    turned away, and the client runs it in its own process instead of
+    waiting behind it.
+    """
+
+    def __init__(self, handler, path=None):
+        """
+        Args:
+            `handler`: callable which takes the qds.py arguments and returns
+                the exit status of the invocation
+
+            `path`: path of the socket to listen on
+        """
+        self.handler = handler
+        self.path = socket_path(path)
+        self.sock = None
+        self._busy = threading.Lock()
+
+    def bind(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                # Left behind by a daemon which did not shut down cleanly
+                os.unlink(self.path)
+            else:
+                raise RuntimeError("A qds daemon is already listening on %s" % self.path)
+            finally:
+                probe.close()
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen(16)
+        log.info("qds daemon listening on %s" % self.path)
+
+    def serve_forever(self):
+        if self.sock is None:
+            self.bind()
+        try:
+            while True:
+                try:
+                    conn, _ = self.sock.accept()
+                except socket.error as e:
+                    if e.args and e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                worker = threading.Thread(target=self._serve, args=(conn,))
+                worker.daemon = True
+                worker.start()
+        finally:
+            self.close()
+
+    def _serve(self, conn):
+        try:
+            self.handle(conn)
+        except Exception:
+            log.exception("Failed to serve request")
+        finally:
+            conn.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def handle(self, conn):
+        channel, payload = _recv_frame(conn)
+        if channel != CHANNEL_REQUEST:
+            return
+        request = json.loads(payload.decode("utf8"))
+        if not self._busy.acquire(False):
+            _send_frame(conn, CHANNEL_BUSY, b"")
+            return
+        try:
+            status = self._run(conn, request)
+        finally:
+            self._busy.release()
+        _send_frame(conn, CHANNEL_EXIT, str(status).encode("utf8"))
+
+    def _run(self, conn, request):
+        saved_env = dict((k, v) for k, v in os.environ.items()
+                         if k.startswith(_ENV_PREFIX))
+        saved_cwd = os.getcwd()
+        saved_streams = sys.stdout, sys.stderr
+        root = logging.getLogger()
+        saved_logging = root.handlers[:], root.level
+        self._set_env(request.get("env", {}))
+        sys.stdout = _ChannelStream(conn, CHANNEL_STDOUT)
+        sys.stderr = _ChannelStream(conn, CHANNEL_STDERR)
+        # Log records go to the client, at the level the invocation sets
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.handlers = [handler]
+        try:
+            os.chdir(request.get("cwd") or saved_cwd)
+            return self.handler(request["argv"]) or 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            sys.stderr.write("%s\n" % e.code)
+            return 1
+        finally:
+            root.handlers = saved_logging[0]
+            root.setLevel(saved_logging[1])
+            sys.stdout, sys.stderr = saved_streams
+            os.chdir(saved_cwd)
+            self._set_env(saved_env)
+
+    @staticmethod
+    def _set_env(env):
+        for key in [k for k in os.environ if k.startswith(_ENV_PREFIX)]:
+            if key not in env:
+                del os.environ[key]
+        os.environ.update(env)
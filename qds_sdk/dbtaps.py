@@ -121,7 +121,7 @@ class DbTapCmdLine:
 
     @staticmethod
     def view(args):
-        tap = DbTap.find(args.id)
+        tap = DbTap.find(args.id, fields=args.fields)
         if args.fields:
             tap.attributes = DbTapCmdLine.filter_fields(tap.attributes, args.fields)
         return json.dumps(tap.attributes, sort_keys=True, indent=4)
@@ -84,3 +84,16 @@ class MethodNotAllowed(ClientError):
     """An error raised when a method is not allowed."""
     # 405 Method Not Allowed
     pass
+
+
+class WaitTimeout(Exception):
+    """Raised when the state waited for is not reached in time."""
+    pass
+
+
+class ValidationError(Exception):
+    """Raised when a payload is found to be invalid before it is sent."""
+
+    def __init__(self, errors):
+        Exception.__init__(self, "; ".join(errors))
+        self.errors = errors
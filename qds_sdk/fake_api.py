@@ -0,0 +1,989 @@
+"""
+The fake_api module contains local stand-ins for the QDS REST API and for the
+S3 store holding command results. They are meant for benchmarking and
+offline testing of code written against the SDK, and implement just enough
+of both services for the SDK to work against them.
+
+Example:
+    with FakeS3Server() as s3, FakeQdsServer(s3=s3, latency=0.01) as api:
+        api.configure()     # points Qubole at the local servers
+        cmd = HiveCommand.run(query="show tables")
+        cmd.get_results()
+
+The servers can also be run standalone with `python -m qds_sdk.fake_api`.
+"""
+from __future__ import print_function
+
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+import datetime
+import itertools
+import threading
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qs, unquote
+
+log = logging.getLogger("qds_fake_api")
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive, so that pooled connections in the SDK are actually reused
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment; otherwise Nagle's algorithm and
+    # delayed ACKs add ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        parsed = urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in
+                      parse_qs(parsed.query, keep_blank_values=True).items())
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            status, headers, payload = self.server.app.handle(
+                method, unquote(parsed.path), params, body, self.headers)
+        except Exception as e:
+            log.exception("Failed to handle %s %s" % (method, self.path))
+            status, headers, payload = 500, {}, str(e).encode("utf8")
+
+        self.send_response(status)
+        headers.setdefault("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(payload)
+
+
+class _LocalServer(object):
+    """
+    Runs a threaded HTTP server on localhost in a background thread.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%s" % (self.host, self.port)
+
+    def start(self):
+        self._httpd = _ThreadingHTTPServer((self.host, self.port), _RequestHandler)
+        self._httpd.app = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        kwargs={"poll_interval": 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        log.info("%s listening on %s" % (self.__class__.__name__, self.url))
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, method, path, params, body, headers):
+        raise NotImplementedError
+
+
+class FakeS3Server(_LocalServer):
+    """
+    An in-memory store speaking the subset of the S3 protocol used by boto to
+    list and download command results. Requests are not authenticated.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        _LocalServer.__init__(self, host, port)
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, bucket, key, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf8")
+        with self._lock:
+            self.buckets.setdefault(bucket, {})[key] = data
+
+    def get_object(self, bucket, key):
+        return self.buckets.get(bucket, {}).get(key)
+
+    def delete_prefix(self, bucket, prefix):
+        with self._lock:
+            objects = self.buckets.get(bucket, {})
+            for key in [k for k in objects if k.startswith(prefix)]:
+                del objects[key]
+
+    def boto_connection(self):
+        """
+        Returns a boto S3Connection which talks to this server.
+        """
+        import boto
+        from boto.s3.connection import OrdinaryCallingFormat
+        return boto.connect_s3(aws_access_key_id="fake", aws_secret_access_key="fake",
+                               host=self.host, port=self.port, is_secure=False,
+                               calling_format=OrdinaryCallingFormat())
+
+    def handle(self, method, path, params, body, headers):
+        bucket, _, key = path.lstrip("/").partition("/")
+        if bucket not in self.buckets:
+            return self._error(404, "NoSuchBucket")
+        if not key:
+            if method == "GET":
+                return self._list(bucket, params)
+            if method == "HEAD":
+                return 200, {}, b""
+            return self._error(405, "MethodNotAllowed")
+
+        data = self.get_object(bucket, key)
+        if method == "PUT":
+            self.put_object(bucket, key, body)
+            return 200, {"ETag": self._etag(body)}, b""
+        if data is None:
+            return self._error(404, "NoSuchKey")
+        if method in ("GET", "HEAD"):
+            return 200, self._object_headers(data), data
+        return self._error(405, "MethodNotAllowed")
+
+    def _list(self, bucket, params):
+        prefix = params.get("prefix", "")
+        marker = params.get("marker", "")
+        max_keys = int(params.get("max-keys") or 1000)
+        keys = sorted(k for k in self.buckets[bucket]
+                      if k.startswith(prefix) and k > marker)
+        truncated = len(keys) > max_keys
+        keys = keys[:max_keys]
+        contents = []
+        for key in keys:
+            data = self.buckets[bucket][key]
+            contents.append(
+                "<Contents><Key>%s</Key><LastModified>%s</LastModified>"
+                "<ETag>%s</ETag><Size>%d</Size><StorageClass>STANDARD"
+                "</StorageClass></Contents>" %
+                (escape(key), "2015-01-01T00:00:00.000Z", escape(self._etag(data)), len(data)))
+        xml = ('<?xml version="1.0" encoding="UTF-8"?>'
+               '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+               '<Name>%s</Name><Prefix>%s</Prefix><Marker>%s</Marker>'
+               '<MaxKeys>%d</MaxKeys><IsTruncated>%s</IsTruncated>%s'
+               '</ListBucketResult>' %
+               (escape(bucket), escape(prefix), escape(marker), max_keys,
+                "true" if truncated else "false", "".join(contents)))
+        return 200, {"Content-Type": "application/xml"}, xml.encode("utf8")
+
+    @staticmethod
+    def _etag(data):
+        return '"%s"' % hashlib.md5(data).hexdigest()
+
+    def _object_headers(self, data):
+        return {"Content-Type": "application/octet-stream",
+                "Content-Length": str(len(data)),
+                "ETag": self._etag(data),
+                "Last-Modified": formatdate(0, usegmt=True)}
+
+    @staticmethod
+    def _error(status, code):
+        xml = ('<?xml version="1.0" encoding="UTF-8"?>'
+               '<Error><Code>%s</Code><Message>%s</Message></Error>' % (code, code))
+        return status, {"Content-Type": "application/xml"}, xml.encode("utf8")
+
+
+def _route(method, pattern):
+    def decorator(f):
+        f.route = (method, re.compile("^%s$" % pattern))
+        return f
+    return decorator
+
+
+class FakeQdsServer(_LocalServer):
+    """
+    An in-memory stand-in for the QDS REST API.
+
+    Commands move from "waiting" through "running" to "done" after they
+    have been polled `polls_to_done` times, and clusters reach their target
+    state after `polls_to_transition` polls, so that waiting loops in the
+    SDK terminate quickly. All behaviour below can be changed on a running
+    server by setting the attribute.
+
+    Kwargs:
+        `s3`: FakeS3Server which receives results larger than
+            `inline_result_limit` bytes
+
+        `latency`: seconds added to every API request
+
+        `error_rate`: probability with which a request fails with one of
+            `error_codes` (defaults to 449 and 503, which the SDK retries)
+
+        `result_size`: default size in bytes of the results of a command
+
+        `per_page`: default page size of list endpoints
+
+        `rerun_delay`: polls after a rerun during which a schedule instance
+            keeps its previous status, as while the rerun is queued
+
+        `api_token`: if set, requests with any other token are rejected
+
+        `seed`: seed for the random generator used for error injection and
+            for generated data
+    """
+
+    RESULTS_BUCKET = "qds-results"
+    DONE_STATES = ("done", "error", "cancelled")
+
+    def __init__(self, host="127.0.0.1", port=0, s3=None, latency=0,
+                 error_rate=0, error_codes=(449, 503), result_size=1024,
+                 inline_result_limit=20 * 1024 * 1024, result_file_size=8 * 1024 * 1024,
+                 log_size=1024, polls_to_done=2, polls_to_transition=2,
+                 per_page=10, report_rows_per_day=10, api_token=None, rerun_delay=0,
+                 seed=None):
+        _LocalServer.__init__(self, host, port)
+        self.s3 = s3
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.result_size = result_size
+        self.inline_result_limit = inline_result_limit
+        self.result_file_size = result_file_size
+        self.log_size = log_size
+        self.polls_to_done = polls_to_done
+        self.polls_to_transition = polls_to_transition
+        self.per_page = per_page
+        self.report_rows_per_day = report_rows_per_day
+        self.api_token = api_token
+        self.rerun_delay = rerun_delay
+        self.random = random.Random(seed)
+
+        # id -> record. Records are listed in the order of their ids, see
+        # _in_order
+        self.commands = {}
+        self.clusters = {}
+        self.schedules = {}
+        self.actions = {}
+        self.request_count = 0
+        self._ids = itertools.count(1)
+        self._polls = {}
+        # command id -> polls left before a rerun shows
+        self._reruns = {}
+        self._forced_errors = []
+        self._lock = threading.RLock()
+        self._routes = [getattr(self, name) for name in dir(self)
+                        if hasattr(getattr(self, name), "route")]
+
+    def configure(self, api_token="dummy_token", **kwargs):
+        """
+        Point Qubole at this server (and at its S3 store, if any).
+        """
+        from qds_sdk.qubole import Qubole
+        if self.s3 is not None:
+            kwargs.setdefault("s3_endpoint", self.s3.url)
+        Qubole.configure(api_token=api_token, api_url=self.url + "/api/", **kwargs)
+
+    # Seeding data
+
+    def _next_id(self):
+        return next(self._ids)
+
+    def add_command(self, **attributes):
+        with self._lock:
+            id = self._next_id()
+            command = {
+                "id": id,
+                "command_type": "HiveCommand",
+                "status": "waiting",
+                "created_at": _timestamp(),
+                "label": "default",
+                "num_result_dir": 1,
+                "meta_data": {"results_resource": "commands/%s/results" % id,
+                              "logs_resource": "commands/%s/logs" % id},
+            }
+            command.update(attributes)
+            command["id"] = id
+            self.commands[id] = command
+            self._polls[("command", id)] = 0
+            return command
+
+    def add_cluster(self, label, state="DOWN", **attributes):
+        with self._lock:
+            id = self._next_id()
+            labels = label if isinstance(label, list) else [label]
+            cluster = {"id": id, "label": labels, "state": state}
+            cluster.update(attributes)
+            self.clusters[id] = cluster
+            return cluster
+
+    def add_schedule(self, name, num_instances=0, instance_status="done", **attributes):
+        """
+        Adds a schedule with `num_instances` finished instances, each with a
+        corresponding action.
+        """
+        with self._lock:
+            id = self._next_id()
+            schedule = {
+                "id": id,
+                "name": name,
+                "status": "RUNNING",
+                "frequency": 1,
+                "time_unit": "days",
+                "start_time": "2015-01-01T00:00Z",
+                "command": {"query": "select 1"},
+                "command_type": "HiveCommand",
+            }
+            schedule.update(attributes)
+            self.schedules[id] = schedule
+            for sequence_id in range(1, num_instances + 1):
+                self.add_instance(id, sequence_id, instance_status)
+            return schedule
+
+    def add_instance(self, schedule_id, sequence_id, status="done"):
+        with self._lock:
+            schedule = self.schedules[schedule_id]
+            nominal = (datetime.datetime(2015, 1, 1) +
+                       datetime.timedelta(days=sequence_id - 1))
+            command = self.add_command(command_type=schedule["command_type"],
+                                       status=status,
+                                       template="generic",
+                                       periodic_job_id=schedule_id,
+                                       nominal_time=_timestamp(nominal))
+            action = {
+                "id": self._next_id(),
+                "sequence_id": sequence_id,
+                "periodic_job_id": schedule_id,
+                "status": status,
+                "nominal_time": command["nominal_time"],
+                "created_at": command["created_at"],
+                "command": command,
+            }
+            self.actions[action["id"]] = action
+            return action
+
+    def fail_next(self, status, count=1, method=None, path=None):
+        """
+        Make the next `count` requests fail with HTTP status `status`.
+        Only requests with the given method and whose path starts with
+        `path` (relative to the api version) are affected, if specified.
+        """
+        with self._lock:
+            self._forced_errors.append([status, count, method, path])
+
+    # Request handling
+
+    def handle(self, method, path, params, body, headers):
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        m = re.match(r"^/api/[^/]+/(.*)$", path)
+        if m is None:
+            return self._json(404, {"error": "not found"})
+        path = m.group(1).rstrip("/")
+
+        if self.api_token is not None and headers.get("X-AUTH-TOKEN") != self.api_token:
+            return self._json(401, {"error": {"error_code": 401,
+                                              "error_message": "Invalid Token"}})
+
+        status = self._injected_error(method, path)
+        if status is not None:
+            return self._json(status, {"error": {"error_code": status,
+                                                 "error_message": "Injected error"}})
+
+        data = None
+        if body:
+            data = json.loads(body.decode("utf8"))
+
+        for route in self._routes:
+            route_method, pattern = route.route
+            match = pattern.match(path)
+            if route_method == method and match is not None:
+                with self._lock:
+                    result = route(params, data, *match.groups())
+                if isinstance(result, tuple):
+                    return result
+                return self._json(200, result)
+        return self._json(404, {"error": {"error_code": 404,
+                                          "error_message": "No route for %s %s" % (method, path)}})
+
+    def _injected_error(self, method, path):
+        with self._lock:
+            for forced in self._forced_errors:
+                status, count, forced_method, prefix = forced
+                if forced_method not in (None, method):
+                    continue
+                if prefix is not None and not path.startswith(prefix):
+                    continue
+                forced[1] -= 1
+                if forced[1] <= 0:
+                    self._forced_errors.remove(forced)
+                return status
+            if self.error_rate and self.random.random() < self.error_rate:
+                return self.random.choice(self.error_codes)
+        return None
+
+    @staticmethod
+    def _json(status, obj):
+        return status, {"Content-Type": "application/json"}, json.dumps(obj).encode("utf8")
+
+    @staticmethod
+    def _text(text):
+        return 200, {"Content-Type": "text/plain"}, text.encode("utf8")
+
+    @staticmethod
+    def _select(items, params, filters=()):
+        """
+        Applies the `fields` parameter and equality filters on the fields
+        named in `filters`, like the API does for endpoints supporting them
+        """
+        for name in filters:
+            if params.get(name):
+                wanted = set(v.lower() for v in params[name].split(","))
+                items = [i for i in items if str(i.get(name)).lower() in wanted]
+        if params.get("fields"):
+            fields = params["fields"].split(",")
+            items = [dict((f, i[f]) for f in fields if f in i) for i in items]
+        return items
+
+    def _page(self, key, items, params, filters=()):
+        items = self._select(list(items), params, filters)
+        page = int(params.get("page") or 1)
+        per_page = int(params.get("per_page") or self.per_page)
+        start = (page - 1) * per_page
+        return {
+            key: items[start:start + per_page],
+            "paging_info": {
+                "per_page": per_page,
+                "previous_page": page - 1 if page > 1 else None,
+                "next_page": page + 1 if start + per_page < len(items) else None,
+            }
+        }
+
+    def _not_found(self, what):
+        return self._json(404, {"error": {"error_code": 404,
+                                          "error_message": "%s not found" % what}})
+
+    # Commands
+
+    def _poll_command(self, command):
+        key = ("command", command["id"])
+        polls_left = self._reruns.pop(command["id"], None)
+        if polls_left:
+            self._reruns[command["id"]] = polls_left - 1
+            return
+        if polls_left == 0:
+            command["status"] = "waiting"
+            self._polls[key] = 0
+        if command["status"] in self.DONE_STATES:
+            return
+        self._polls[key] = self._polls.get(key, 0) + 1
+        if self._polls[key] >= self.polls_to_done:
+            command["status"] = "done"
+        else:
+            command["status"] = "running"
+
+    def _command(self, id):
+        return self.commands.get(int(id)) if id.isdigit() else None
+
+    @_route("POST", r"commands")
+    def create_command(self, params, data):
+        data = dict(data or {})
+        data.setdefault("command_type", "HiveCommand")
+        return self.add_command(**data)
+
+    @_route("GET", r"commands")
+    def list_commands(self, params, data):
+        return self._page("commands", reversed(_in_order(self.commands)), params,
+                          filters=("status", "command_type", "label"))
+
+    @_route("GET", r"commands/(\w+)")
+    def show_command(self, params, data, id):
+        command = self._command(id)
+        if command is None:
+            return self._not_found("Command")
+        self._poll_command(command)
+        return command
+
+    @_route("PUT", r"commands/(\w+)")
+    def cancel_command(self, params, data, id):
+        command = self._command(id)
+        if command is None:
+            return self._not_found("Command")
+        if command["status"] in self.DONE_STATES:
+            return {"kill_succeeded": False, "result": "Command already finished"}
+        command["status"] = "cancelled"
+        return {"kill_succeeded": True, "result": "Command cancelled"}
+
+    @_route("GET", r"commands/(\w+)/logs")
+    def command_logs(self, params, data, id):
+        command = self._command(id)
+        if command is None:
+            return self._not_found("Command")
+        line = "INFO command %s: log line\n" % id
+        return self._text((line * (self.log_size // len(line) + 1))[:self.log_size])
+
+    @_route("GET", r"commands/(\w+)/jobs")
+    def command_jobs(self, params, data, id):
+        if self._command(id) is None:
+            return self._not_found("Command")
+        return self._text("[]")
+
+    @_route("GET", r"commands/(\w+)/results")
+    def command_results(self, params, data, id):
+        command = self._command(id)
+        if command is None:
+            return self._not_found("Command")
+        size = command.get("result_size", self.result_size)
+        inline = params.get("inline", "True").lower() not in ("false", "0")
+        if inline and size <= self.inline_result_limit:
+            return {"inline": True, "results": _fake_rows(size, "\t")}
+
+        # Results are written to S3 as a single result directory (matching
+        # num_result_dir) containing numbered files
+        prefix = "results/%s/" % id
+        if self.s3 is not None and not self.s3.get_object(self.RESULTS_BUCKET, prefix + "0/0"):
+            data = _fake_rows(size, chr(1)).encode("utf8")
+            self.s3.put_object(self.RESULTS_BUCKET, prefix + "0_$folder$", b"")
+            for n, start in enumerate(range(0, len(data) or 1, self.result_file_size)):
+                self.s3.put_object(self.RESULTS_BUCKET, "%s0/%d" % (prefix, n),
+                                   data[start:start + self.result_file_size])
+        return {"inline": False,
+                "result_location": ["s3://%s/%s" % (self.RESULTS_BUCKET, prefix)]}
+
+    # Clusters
+
+    def _cluster(self, id_label):
+        if id_label.isdigit() and int(id_label) in self.clusters:
+            return self.clusters[int(id_label)]
+        for cluster in _in_order(self.clusters):
+            if id_label in cluster["label"]:
+                return cluster
+        return None
+
+    def _poll_cluster(self, cluster):
+        target = cluster.get("_target_state")
+        if target is None:
+            return
+        key = ("cluster", cluster["id"])
+        self._polls[key] = self._polls.get(key, 0) + 1
+        if self._polls[key] >= self.polls_to_transition:
+            cluster["state"] = target
+            del cluster["_target_state"]
+
+    @staticmethod
+    def _public(cluster):
+        return dict((k, v) for k, v in cluster.items() if not k.startswith("_"))
+
+    @_route("GET", r"clusters")
+    def list_clusters(self, params, data):
+        clusters = self._select([self._public(c) for c in _in_order(self.clusters)],
+                                params, filters=("state",))
+        return [{"cluster": c} for c in clusters]
+
+    @_route("POST", r"clusters")
+    def create_cluster(self, params, data):
+        attributes = dict((data or {}).get("cluster", data or {}))
+        label = attributes.pop("label", ["default"])
+        return {"cluster": self._public(self.add_cluster(label, **attributes))}
+
+    @_route("PUT", r"clusters/reassign-label")
+    def reassign_label(self, params, data):
+        destination = self._cluster(str(data["destination_cluster"]))
+        if destination is None:
+            return self._not_found("Cluster")
+        for cluster in _in_order(self.clusters):
+            if data["label"] in cluster["label"]:
+                cluster["label"].remove(data["label"])
+        destination["label"].append(data["label"])
+        return {"cluster": self._public(destination)}
+
+    @_route("GET", r"clusters/(?!reassign-label$)([^/]+)")
+    def show_cluster(self, params, data, id_label):
+        cluster = self._cluster(id_label)
+        if cluster is None:
+            return self._not_found("Cluster")
+        self._poll_cluster(cluster)
+        return {"cluster": self._public(cluster)}
+
+    @_route("PUT", r"clusters/(?!reassign-label$)([^/]+)")
+    def update_cluster(self, params, data, id_label):
+        cluster = self._cluster(id_label)
+        if cluster is None:
+            return self._not_found("Cluster")
+        attributes = (data or {}).get("cluster", data or {})
+        _deep_update(cluster, attributes)
+        return {"cluster": self._public(cluster)}
+
+    @_route("DELETE", r"clusters/(?!reassign-label$)([^/]+)")
+    def delete_cluster(self, params, data, id_label):
+        cluster = self._cluster(id_label)
+        if cluster is None:
+            return self._not_found("Cluster")
+        del self.clusters[cluster["id"]]
+        return {"status": "success"}
+
+    @_route("POST", r"clusters/([^/]+)/clone")
+    def clone_cluster(self, params, data, id_label):
+        cluster = self._cluster(id_label)
+        if cluster is None:
+            return self._not_found("Cluster")
+        attributes = json.loads(json.dumps(self._public(cluster)))
+        attributes.pop("id")
+        attributes["state"] = "DOWN"
+        _deep_update(attributes, (data or {}).get("cluster", data or {}))
+        label = attributes.pop("label")
+        return {"cluster": self._public(self.add_cluster(label, **attributes))}
+
+    @_route("GET", r"clusters/([^/]+)/state")
+    def cluster_state(self, params, data, id_label):
+        cluster = self._cluster(id_label)
+        if cluster is None:
+            return self._not_found("Cluster")
+        self._poll_cluster(cluster)
+        return {"state": cluster["state"]}
+
+    @_route("PUT", r"clusters/([^/]+)/state")
+    def change_cluster_state(self, params, data, id_label):
+        cluster = self._cluster(id_label)
+        if cluster is None:
+            return self._not_found("Cluster")
+        transitions = {"start": ("PENDING", "UP"),
+                       "terminate": ("TERMINATING", "DOWN")}
+        if data.get("state") not in transitions:
+            return self._json(422, {"error": {"error_code": 422,
+                                              "error_message": "Invalid state"}})
+        intermediate, target = transitions[data["state"]]
+        if cluster["state"] != target:
+            cluster["state"] = intermediate
+            cluster["_target_state"] = target
+            self._polls[("cluster", cluster["id"])] = 0
+        return {"state": cluster["state"]}
+
+    def _node_command(self, id_label, data):
+        cluster = self._cluster(id_label)
+        if cluster is None:
+            return self._not_found("Cluster")
+        return self.add_command(command_type="ClusterManageCommand",
+                                cluster_id=cluster["id"],
+                                private_dns=(data or {}).get("private_dns"))
+
+    @_route("POST", r"clusters/([^/]+)/nodes")
+    def add_node(self, params, data, id_label):
+        return self._node_command(id_label, data)
+
+    @_route("DELETE", r"clusters/([^/]+)/nodes")
+    def remove_node(self, params, data, id_label):
+        return self._node_command(id_label, data)
+
+    @_route("PUT", r"clusters/([^/]+)/nodes")
+    def update_node(self, params, data, id_label):
+        return self._node_command(id_label, data)
+
+    # Scheduler
+
+    def _schedule(self, id):
+        return self.schedules.get(int(id)) if id.isdigit() else None
+
+    def _schedule_actions(self, schedule_id):
+        return [a for a in _in_order(self.actions) if a["periodic_job_id"] == schedule_id]
+
+    @_route("GET", r"scheduler")
+    def list_schedules(self, params, data):
+        schedules = _in_order(self.schedules)
+        if params.get("name"):
+            schedules = [s for s in schedules if s["name"] == params["name"]]
+        return self._page("schedules", schedules, params)
+
+    @_route("POST", r"scheduler")
+    def create_schedule(self, params, data):
+        data = dict(data or {})
+        return self.add_schedule(data.pop("name", None), **data)
+
+    @_route("GET", r"scheduler/(\w+)")
+    def show_schedule(self, params, data, id):
+        schedule = self._schedule(id)
+        if schedule is None:
+            return self._not_found("Schedule")
+        return schedule
+
+    @_route("PUT", r"scheduler/(\w+)")
+    def change_schedule_status(self, params, data, id):
+        schedule = self._schedule(id)
+        if schedule is None:
+            return self._not_found("Schedule")
+        states = {"suspend": "SUSPENDED", "resume": "RUNNING", "kill": "KILLED"}
+        schedule["status"] = states.get((data or {}).get("status"), schedule["status"])
+        return {"succeeded": True, "status": schedule["status"]}
+
+    @_route("GET", r"scheduler/(\w+)/actions(?:/(\w+))?")
+    def list_schedule_actions(self, params, data, id, sequence_id=None):
+        schedule = self._schedule(id)
+        if schedule is None:
+            return self._not_found("Schedule")
+        actions = self._schedule_actions(schedule["id"])
+        if sequence_id is not None:
+            actions = [a for a in actions if str(a["sequence_id"]) == sequence_id]
+        return self._page("actions", reversed(actions), params)
+
+    @_route("GET", r"scheduler/(\w+)/instances")
+    def list_schedule_instances(self, params, data, id):
+        schedule = self._schedule(id)
+        if schedule is None:
+            return self._not_found("Schedule")
+        actions = self._schedule_actions(schedule["id"])
+        return self._page("commands", [a["command"] for a in reversed(actions)], params)
+
+    @_route("POST", r"scheduler/(\w+)/instances/(\w+)/rerun")
+    def rerun_instance(self, params, data, id, instance_id):
+        schedule = self._schedule(id)
+        command = self._command(instance_id)
+        if schedule is None or command is None:
+            return self._not_found("Instance")
+        if self.rerun_delay:
+            self._reruns[command["id"]] = self.rerun_delay
+        else:
+            command["status"] = "waiting"
+            self._polls[("command", command["id"])] = 0
+        return {"status": "Rerun submitted for instance %s" % instance_id}
+
+    # Actions
+
+    def _action(self, id):
+        return self.actions.get(int(id)) if id.isdigit() else None
+
+    @_route("GET", r"actions")
+    def list_actions(self, params, data):
+        return self._page("actions", reversed(_in_order(self.actions)), params)
+
+    @_route("GET", r"actions/(\w+)")
+    def show_action(self, params, data, id):
+        action = self._action(id)
+        if action is None:
+            return self._not_found("Action")
+        if action["command"] is not None:
+            action["status"] = action["command"]["status"]
+        return action
+
+    @_route("PUT", r"actions/(\w+)/kill")
+    def kill_action(self, params, data, id):
+        action = self._action(id)
+        if action is None:
+            return self._not_found("Action")
+        action["status"] = "cancelled"
+        if action["command"] is not None:
+            action["command"]["status"] = "cancelled"
+        return {"kill_succeeded": True}
+
+    @_route("POST", r"actions/(\w+)/rerun")
+    def rerun_action(self, params, data, id):
+        action = self._action(id)
+        if action is None:
+            return self._not_found("Action")
+        command = action["command"]
+        if command is not None:
+            command["status"] = "waiting"
+            self._polls[("command", command["id"])] = 0
+        action["status"] = "waiting"
+        return {"status": "Action rerun submitted"}
+
+    # Reports
+
+    @_route("GET", r"reports")
+    def list_reports(self, params, data):
+        return {"reports": ["all_commands", "canonical_hive_commands"]}
+
+    def _report_days(self, params):
+        end = _parse_date(params.get("end_date")) or datetime.date.today()
+        start = _parse_date(params.get("start_date")) or end - datetime.timedelta(days=7)
+        day = start
+        while day < end:
+            yield day
+            day += datetime.timedelta(days=1)
+
+    def _report_rows(self, params):
+        rows = []
+        for day in self._report_days(params):
+            # Rows of a day are derived from the day alone, so that
+            # overlapping queries return identical rows
+            rnd = random.Random(day.toordinal())
+            for n in range(self.report_rows_per_day):
+                rows.append({
+                    "id": day.toordinal() * 10000 + n,
+                    "created_at": "%sT%02d:%02d:00Z" % (day.isoformat(), n % 24, rnd.randint(0, 59)),
+                    "submitted_by": "user%d@example.com" % rnd.randint(1, 5),
+                    "command_type": rnd.choice(["HiveCommand", "PrestoCommand", "SparkCommand"]),
+                    "command_summary": "select * from table_%d" % rnd.randint(1, 20),
+                    "status": rnd.choice(["done"] * 8 + ["error", "cancelled"]),
+                    "label": rnd.choice(["default", "etl", "adhoc"]),
+                    "cpu": rnd.randint(1, 100000),
+                    "fs_bytes_read": rnd.randint(0, 10 ** 10),
+                    "fs_bytes_written": rnd.randint(0, 10 ** 8),
+                    "runtime": rnd.randint(1, 3600),
+                })
+        return rows
+
+    @_route("GET", r"reports/all_commands")
+    def all_commands_report(self, params, data):
+        rows = self._report_rows(params)
+        sort_column = params.get("sort_column", "time")
+        if sort_column != "time":
+            rows.sort(key=lambda r: r[sort_column], reverse=True)
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 10)
+        days = list(self._report_days(params))
+        return {
+            "start_date": days[0].isoformat() if days else params.get("start_date"),
+            "end_date": (days[-1] + datetime.timedelta(days=1)).isoformat() if days else params.get("end_date"),
+            "sort_column": sort_column,
+            "commands": rows[offset:offset + limit],
+        }
+
+    @_route("GET", r"reports/canonical_hive_commands")
+    def canonical_hive_commands_report(self, params, data):
+        groups = {}
+        for row in self._report_rows(params):
+            if row["command_type"] != "HiveCommand":
+                continue
+            group = groups.setdefault(row["command_summary"], {
+                "canonical_query_id": len(groups) + 1, "frequency": 0, "cpu": 0,
+                "fs_bytes_read": 0, "fs_bytes_written": 0})
+            group["frequency"] += 1
+            for column in ("cpu", "fs_bytes_read", "fs_bytes_written"):
+                group[column] += row[column]
+        sort_column = params.get("sort_column", "frequency")
+        results = sorted(groups.values(),
+                         key=lambda g: (-g[sort_column], g["canonical_query_id"]))
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 10)
+        return {"sort_column": sort_column, "results": results[offset:offset + limit]}
+
+    # Accounts
+
+    @_route("GET", r"accounts/get_creds")
+    def get_creds(self, params, data):
+        return {"storage_access_key": "fake", "storage_secret_key": "fake",
+                "session_token": None}
+
+
+def _timestamp(dt=None):
+    return (dt or datetime.datetime.utcnow()).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+def _in_order(records):
+    """The values of a dictionary of id to record, by id"""
+    return [records[id] for id in sorted(records)]
+
+
+def _deep_update(target, source):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_update(target[key], value)
+        else:
+            target[key] = value
+
+
+def _fake_rows(size, delim):
+    """
+    Returns `size` characters of newline terminated rows with two columns.
+    """
+    rows = []
+    length = 0
+    for n in itertools.count():
+        row = "row%d%svalue%d\n" % (n, delim, n)
+        if length + len(row) > size:
+            break
+        rows.append(row)
+        length += len(row)
+    rows.append("x" * (size - length))
+    return "".join(rows)
+
+
+def main(args=None):
+    from argparse import ArgumentParser
+    argparser = ArgumentParser(prog="python -m qds_sdk.fake_api",
+                               description="Local stand-in for the QDS API and result store.")
+    argparser.add_argument("--port", type=int, default=8000, help="port of the API server")
+    argparser.add_argument("--s3-port", type=int, default=8001,
+                           help="port of the S3 server. 0 picks a free port")
+    argparser.add_argument("--latency", type=float, default=0,
+                           help="seconds added to every API request")
+    argparser.add_argument("--error-rate", type=float, default=0,
+                           help="fraction of API requests failing with 449/503")
+    argparser.add_argument("--result-size", type=int, default=1024,
+                           help="size in bytes of command results")
+    argparser.add_argument("--clusters", type=int, default=0,
+                           help="number of clusters to create")
+    argparser.add_argument("--schedules", type=int, default=0,
+                           help="number of schedules to create")
+    argparser.add_argument("--instances", type=int, default=0,
+                           help="number of instances per schedule")
+    argparser.add_argument("--seed", type=int, help="random seed")
+    arguments = argparser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+    s3 = FakeS3Server(port=arguments.s3_port).start()
+    server = FakeQdsServer(port=arguments.port, s3=s3, latency=arguments.latency,
+                           error_rate=arguments.error_rate,
+                           result_size=arguments.result_size, seed=arguments.seed)
+    for n in range(arguments.clusters):
+        server.add_cluster("cluster%d" % n)
+    for n in range(arguments.schedules):
+        server.add_schedule("schedule%d" % n, num_instances=arguments.instances)
+    server.start()
+    print("QDS API: %s/api/  (qds.py --url %s/api/)" % (server.url, server.url))
+    print("S3 endpoint: %s" % s3.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        s3.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""
+The metrics module keeps counters and latency histograms for the work the SDK
+does on behalf of its caller (REST requests, retries, polling and S3
+downloads) and records tracing spans around it.
+
+The process-wide registry is returned by `Qubole.metrics()`. Its contents can
+be rendered in the Prometheus text format with `PrometheusExporter`, and
+finished spans are handed to any span exporter added with
+`MetricsRegistry.add_exporter`.
+"""
+
+import os
+import json
+import time
+import random
+import threading
+import logging
+from contextlib import contextmanager
+
+log = logging.getLogger("qds_metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+                   60, 120, 300)
+POLL_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+THROUGHPUT_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(-4, 11))
+
+"""name: (type, help, histogram buckets) of the metrics recorded by the SDK"""
+METRICS = {
+    "qds_requests_total":
+        ("counter", "REST requests made to QDS by method, endpoint and status", None),
+    "qds_request_duration_seconds":
+        ("histogram", "Latency of REST requests made to QDS", LATENCY_BUCKETS),
+    "qds_request_retries_total":
+        ("counter", "REST requests retried after a transient error", None),
+    "qds_request_bytes_sent_total":
+        ("counter", "Bytes sent in REST request bodies", None),
+    "qds_request_bytes_received_total":
+        ("counter", "Bytes received in REST response bodies", None),
+    "qds_command_polls_total":
+        ("counter", "Status polls made while waiting for commands", None),
+    "qds_command_polls":
+        ("histogram", "Status polls made per command run", POLL_BUCKETS),
+    "qds_s3_download_bytes_total":
+        ("counter", "Bytes of command results downloaded from S3", None),
+    "qds_s3_download_duration_seconds":
+        ("histogram", "Time taken to download a result location from S3", LATENCY_BUCKETS),
+    "qds_s3_download_throughput_bytes":
+        ("histogram", "S3 download throughput in bytes per second", THROUGHPUT_BUCKETS),
+}
+
+
+def _label_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted(labels.items()))
+
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def value(self):
+        """Cumulative bucket counts, as in the Prometheus exposition format."""
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        cumulative.append((float("inf"), self.count))
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class Span(object):
+    """
+    A timed operation, modelled on OpenTelemetry spans. Spans started while
+    another one is active on the same thread become its children.
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.end_time = None
+        self.status = "ok"
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": int(self.start_time * 1e9),
+            "end_time_unix_nano": int(self.end_time * 1e9) if self.end_time is not None else None,
+            "attributes": self.attributes,
+            "status": {"code": self.status, "message": self.error},
+        }
+
+
+class MetricsRegistry(object):
+    """
+    Thread-safe store of counters and histograms keyed by metric name and
+    labels, and the dispatcher of finished spans to exporters.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._exporters = []
+        self._local = threading.local()
+
+    def inc(self, name, labels=None, value=1):
+        """
+        Increments the counter `name` for the given `labels` by `value`
+        """
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        """
+        Records `value` in the histogram `name` for the given `labels`
+        """
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                buckets = METRICS.get(name, (None, None, None))[2] or LATENCY_BUCKETS
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def value(self, name, labels=None):
+        """
+        Returns:
+            the value of counter `name`, or a dict with the count, sum and
+            buckets of histogram `name`, for exactly the given `labels`.
+            None if nothing was recorded.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name].get(key)
+            histogram = self._histograms.get(name, {}).get(key)
+            return histogram.value() if histogram is not None else None
+
+    def total(self, name, **labels):
+        """
+        Returns:
+            the sum of counter `name` (or the observation count of histogram
+            `name`) over all series matching the given labels
+        """
+        wanted = set(labels.items())
+        total = 0
+        with self._lock:
+            for key, value in self._counters.get(name, {}).items():
+                if wanted <= set(key):
+                    total += value
+            for key, histogram in self._histograms.get(name, {}).items():
+                if wanted <= set(key):
+                    total += histogram.count
+        return total
+
+    def collect(self):
+        """
+        Returns:
+            a list of (name, type, help, [(labels, value)]) tuples for every
+            metric recorded so far, sorted by name
+        """
+        metrics = []
+        with self._lock:
+            for name, series in self._counters.items():
+                samples = [(dict(k), v) for k, v in sorted(series.items())]
+                metrics.append((name, "counter", METRICS.get(name, (None, ""))[1], samples))
+            for name, series in self._histograms.items():
+                samples = [(dict(k), h.value()) for k, h in sorted(series.items())]
+                metrics.append((name, "histogram", METRICS.get(name, (None, ""))[1], samples))
+        return sorted(metrics, key=lambda metric: metric[0])
+
+    def reset(self):
+        """
+        Clears all recorded metrics
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def add_exporter(self, exporter):
+        """
+        Registers a span exporter. Its `export` method is called with every
+        span that finishes from now on.
+        """
+        with self._lock:
+            self._exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        with self._lock:
+            self._exporters.remove(exporter)
+
+    def current_span(self):
+        stack = getattr(self._local, "spans", None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name, attributes=None):
+        """
+        Context manager which times the enclosed block as a span named `name`.
+        The span is marked as failed if the block raises.
+        """
+        if not self.enabled or not self._exporters:
+            yield None
+            return
+        parent = self.current_span()
+        if parent is None:
+            span = Span(name, "%032x" % random.getrandbits(128), attributes=attributes)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+        stack = self._local.__dict__.setdefault("spans", [])
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = "%s: %s" % (e.__class__.__name__, e)
+            raise
+        finally:
+            stack.pop()
+            span.end_time = time.time()
+            self._export(span)
+
+    def _export(self, span):
+        with self._lock:
+            exporters = list(self._exporters)
+        for exporter in exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                log.exception("Span exporter %r failed" % exporter)
+
+
+"""The registry returned by Qubole.metrics()"""
+registry = MetricsRegistry()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                             for k, v in sorted(labels.items()))
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusExporter(object):
+    """
+    Renders a registry in the Prometheus text exposition format, e.g. to be
+    served by an application's /metrics endpoint or written for the
+    node_exporter textfile collector.
+    """
+
+    def __init__(self, metrics_registry=None):
+        self.registry = metrics_registry or registry
+
+    def render(self):
+        lines = []
+        for name, kind, help, samples in self.registry.collect():
+            if help:
+                lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                if kind == "counter":
+                    lines.append("%s%s %s" % (name, _format_labels(labels), _format_number(value)))
+                    continue
+                for bound, count in value["buckets"]:
+                    bucket_labels = dict(labels, le=_format_number(bound))
+                    lines.append("%s_bucket%s %d" % (name, _format_labels(bucket_labels), count))
+                lines.append("%s_sum%s %s" % (name, _format_labels(labels), _format_number(value["sum"])))
+                lines.append("%s_count%s %d" % (name, _format_labels(labels), value["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Atomically replaces the file at `path` with the rendered metrics
+        """
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.rename(tmp, path)
+
+
+class SpanExporter(object):
+    """
+    Base class of span exporters
+    """
+
+    def export(self, span):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class InMemorySpanExporter(SpanExporter):
+    """
+    Keeps finished spans in a list, mostly useful in tests
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def clear(self):
+        del self.spans[:]
+
+
+class JsonSpanExporter(SpanExporter):
+    """
+    Writes every finished span as a line of JSON to `fp`, in a layout close
+    to the OpenTelemetry protocol so it can be shipped by a log collector.
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), sort_keys=True)
+        with self._lock:
+            self.fp.write(line + "\n")
+            self.fp.flush()
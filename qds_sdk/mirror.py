@@ -0,0 +1,272 @@
+"""
+The mirror module keeps a local SQLite copy of the schedules, their actions
+and their instances, so that questions such as "which schedules failed
+today" are answered without paging through the scheduler API.
+
+Actions and instances are listed newest first by QDS. A sync only walks the
+pages down to the sync watermark of each list: the oldest record which was
+still running at the previous sync, or the newest record if none was.
+Everything older is stored and final, so it is not fetched again.
+"""
+
+from qds_sdk.qubole import Qubole
+from qds_sdk.scheduler import Scheduler
+from qds_sdk.actions import Action
+from qds_sdk.commands import command_class
+from qds_sdk import util
+from qds_sdk.util import parse_time
+from collections import namedtuple
+
+import six
+import json
+import time
+import sqlite3
+import logging
+
+log = logging.getLogger("qds_mirror")
+
+"""Statuses of actions which may still change"""
+PENDING_ACTION_STATUSES = ("submitted", "waiting", "running")
+
+"""Statuses of instances which will not change, as for Command.is_done"""
+DONE_COMMAND_STATUSES = ("done", "error", "cancelled")
+
+"""Records fetched by Mirror.sync and the secs it took"""
+SyncResult = namedtuple("SyncResult", ["schedules", "actions", "instances", "elapsed"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedules (
+    id INTEGER PRIMARY KEY, name TEXT, status TEXT, data TEXT);
+CREATE INDEX IF NOT EXISTS schedules_status ON schedules (status);
+CREATE INDEX IF NOT EXISTS schedules_name ON schedules (name);
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY, scheduler_id INTEGER, status TEXT, time REAL, data TEXT);
+CREATE INDEX IF NOT EXISTS actions_status ON actions (status, time);
+CREATE INDEX IF NOT EXISTS actions_scheduler ON actions (scheduler_id, time);
+CREATE TABLE IF NOT EXISTS instances (
+    id INTEGER PRIMARY KEY, scheduler_id INTEGER, status TEXT, time REAL, data TEXT);
+CREATE INDEX IF NOT EXISTS instances_status ON instances (status, time);
+CREATE INDEX IF NOT EXISTS instances_scheduler ON instances (scheduler_id, time);
+CREATE TABLE IF NOT EXISTS watermarks (
+    kind TEXT, scope INTEGER, id INTEGER, synced_at REAL, PRIMARY KEY (kind, scope));
+"""
+
+
+def _record_time(attributes):
+    """The nominal time of an action or instance, else its creation time"""
+    try:
+        return parse_time(attributes.get("nominal_time") or attributes.get("created_at"))
+    except ValueError:
+        return None
+
+
+def _walk(pages, watermark):
+    """
+    Returns the records of `pages` (see `util.iter_pages`), newest first,
+    down to the first page holding a record older than `watermark`.
+    """
+    records = []
+    for found in pages:
+        records.extend(found)
+        if watermark is not None and any(r["id"] < watermark for r in found):
+            break
+    return records
+
+
+class Mirror(object):
+    """
+    A local SQLite mirror of the scheduler. Call `sync` to bring it up to
+    date, then query it with `schedules`, `actions`, `instances` and
+    `failed_schedules`.
+    """
+
+    def __init__(self, path=":memory:", per_page=100, concurrency=4):
+        """
+        Args:
+            `path`: the SQLite database file, created if needed. The mirror
+                is kept in memory by default.
+
+        Kwargs:
+            `per_page`: number of records fetched per request
+
+            `concurrency`: number of schedules whose instances are fetched
+                in parallel
+        """
+        self.per_page = per_page
+        self.concurrency = concurrency
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def watermark(self, kind, scope=0):
+        row = self.db.execute("SELECT id FROM watermarks WHERE kind = ? AND scope = ?",
+                              (kind, scope)).fetchone()
+        return row[0] if row else None
+
+    def last_sync(self):
+        """
+        Returns:
+            the time of the last sync, None if the mirror was never synced
+        """
+        return self.db.execute("SELECT MAX(synced_at) FROM watermarks").fetchone()[0]
+
+    def sync(self):
+        """
+        Fetches the schedules, and the actions and instances newer than the
+        sync watermarks, and stores them.
+
+        Returns:
+            a SyncResult with the number of records of each kind fetched
+        """
+        start = time.time()
+        conn = Qubole.agent()
+        per_page = self.per_page
+        schedules = []
+        for found in util.iter_pages(
+                lambda page: conn.get("%s?page=%s&per_page=%s" %
+                                      (Scheduler.rest_entity_path, page, per_page)),
+                "schedules", per_page):
+            schedules.extend(found)
+
+        actions = _walk(util.iter_pages(
+            lambda page: conn.get(Action.rest_entity_path, {"page": page, "per_page": per_page}),
+            "actions", per_page), self.watermark("actions"))
+
+        watermarks = dict((s["id"], self.watermark("instances", s["id"])) for s in schedules)
+
+        def fetch_instances(schedule_id):
+            path = Scheduler.element_path(schedule_id) + "/instances"
+            return _walk(util.iter_pages(
+                lambda page: conn.get(path, {"page": page, "per_page": per_page}),
+                "commands", per_page), watermarks[schedule_id])
+
+        instances = {}
+        for schedule_id, found, error in util.run_concurrently(
+                fetch_instances, list(watermarks), self.concurrency):
+            if error is not None:
+                # The watermark is kept, so these are fetched at the next sync
+                log.warning("Could not fetch the instances of schedule %s: %s" %
+                            (schedule_id, error))
+            else:
+                instances[schedule_id] = found
+
+        synced_at = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO schedules VALUES (?, ?, ?, ?)",
+                [(s["id"], s.get("name"), s.get("status"), json.dumps(s))
+                 for s in schedules])
+            self.db.executemany(
+                "INSERT OR REPLACE INTO actions VALUES (?, ?, ?, ?, ?)",
+                [(a["id"], a.get("periodic_job_id", a.get("scheduler_id")), a.get("status"),
+                  _record_time(a), json.dumps(a)) for a in actions])
+            self._set_watermark("actions", 0, "status IN (%s)" %
+                                ", ".join("?" * len(PENDING_ACTION_STATUSES)),
+                                PENDING_ACTION_STATUSES, synced_at)
+            for schedule_id, found in instances.items():
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO instances VALUES (?, ?, ?, ?, ?)",
+                    [(c["id"], schedule_id, c.get("status"), _record_time(c), json.dumps(c))
+                     for c in found])
+                self._set_watermark("instances", schedule_id, "status NOT IN (%s)" %
+                                    ", ".join("?" * len(DONE_COMMAND_STATUSES)),
+                                    DONE_COMMAND_STATUSES, synced_at)
+
+        result = SyncResult(len(schedules), len(actions),
+                            sum(len(found) for found in instances.values()),
+                            time.time() - start)
+        log.info("Synced %d schedules, %d actions and %d instances in %.2fs" % result)
+        return result
+
+    def _set_watermark(self, kind, scope, pending, args, synced_at):
+        """
+        Sets the watermark of a list to its oldest record matching the
+        `pending` condition, else past its newest record.
+        """
+        where, scope_args = ("1", []) if kind == "actions" else \
+            ("scheduler_id = ?", [scope])
+        oldest = self.db.execute("SELECT MIN(id) FROM %s WHERE %s AND %s" % (kind, where, pending),
+                                 scope_args + list(args)).fetchone()[0]
+        if oldest is None:
+            newest = self.db.execute("SELECT MAX(id) FROM %s WHERE %s" % (kind, where),
+                                     scope_args).fetchone()[0]
+            oldest = newest + 1 if newest is not None else None
+        self.db.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)",
+                        (kind, scope, oldest, synced_at))
+
+    def _select(self, table, status, scheduler_id, start, end):
+        where, args = [], []
+        if status is not None:
+            statuses = [status] if isinstance(status, six.string_types) else list(status)
+            where.append("status IN (%s)" % ", ".join("?" * len(statuses)))
+            args.extend(statuses)
+        if scheduler_id is not None:
+            where.append("scheduler_id = ?")
+            args.append(int(scheduler_id))
+        if start is not None:
+            where.append("time >= ?")
+            args.append(parse_time(start))
+        if end is not None:
+            where.append("time < ?")
+            args.append(parse_time(end))
+        query = "SELECT data FROM %s" % table
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return [json.loads(row[0]) for row in
+                self.db.execute(query + " ORDER BY time DESC, id DESC", args)]
+
+    def schedules(self, status=None, name=None):
+        """
+        Returns:
+            the mirrored schedules, with the given `status` and `name` if
+            not None
+        """
+        where, args = [], []
+        if status is not None:
+            where.append("status = ?")
+            args.append(status)
+        if name is not None:
+            where.append("name = ?")
+            args.append(name)
+        query = "SELECT data FROM schedules"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        return [Scheduler(json.loads(row[0])) for row in
+                self.db.execute(query + " ORDER BY id", args)]
+
+    def actions(self, status=None, scheduler_id=None, start=None, end=None):
+        """
+        Returns:
+            the mirrored actions, newest first, with one of the statuses
+            `status` (a status or a list of them), of the schedule
+            `scheduler_id` and with a nominal time in [`start`, `end`).
+            Arguments left to None are not filtered on.
+        """
+        return [Action(a) for a in self._select("actions", status, scheduler_id, start, end)]
+
+    def instances(self, status=None, scheduler_id=None, start=None, end=None):
+        """
+        Returns:
+            the mirrored instances, newest first, filtered as by `actions`
+        """
+        return [command_class(c.get("command_type"))(c) for c in
+                self._select("instances", status, scheduler_id, start, end)]
+
+    def failed_schedules(self, start, end=None):
+        """
+        Returns:
+            the schedules with an action or an instance in error with a
+            nominal time in [`start`, `end`)
+        """
+        ids = set()
+        for table in ("actions", "instances"):
+            query = "SELECT DISTINCT scheduler_id FROM %s WHERE status = 'error' AND time >= ?" \
+                % table
+            args = [parse_time(start)]
+            if end is not None:
+                query += " AND time < ?"
+                args.append(parse_time(end))
+            ids.update(row[0] for row in self.db.execute(query, args))
+        return [s for s in self.schedules() if s.id in ids]
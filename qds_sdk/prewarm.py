@@ -0,0 +1,380 @@
+"""
+The prewarm module starts clusters shortly before commands are expected to
+run on them, and terminates the ones which are expected to stay idle, so that
+the first commands of the day do not wait for a cluster to come up.
+
+Demand for every cluster label is predicted from the upcoming runs of the
+schedules listed by QDS and from the times at which commands
+were submitted to the label in the past weeks. `simulate` replays recorded
+command history against the same policy, to tune it without touching any
+cluster.
+"""
+
+from qds_sdk.qubole import Qubole
+from qds_sdk.cluster import Cluster
+from qds_sdk.commands import Command
+from qds_sdk.scheduler import Scheduler
+from qds_sdk import util
+from qds_sdk.util import parse_time
+from collections import namedtuple, defaultdict
+
+import time
+import logging
+
+log = logging.getLogger("qds_prewarm")
+
+WEEK = 7 * 24 * 3600
+
+"""Length in secs of the time units of schedules. Months are taken as 30 days."""
+TIME_UNITS = {"minutes": 60, "hours": 3600, "days": 86400, "weeks": WEEK,
+              "months": 30 * 86400}
+
+"""Statuses of commands which still need their cluster"""
+RUNNING_STATUSES = ("waiting", "running")
+
+"""A cluster started or terminated by the Prewarmer, and why"""
+PrewarmDecision = namedtuple("PrewarmDecision", ["label", "action", "reason", "time"])
+
+"""
+The outcome of `simulate`: the decisions taken, the recorded commands which
+found their cluster up (`warm`) or had to wait for it (`cold`), the total
+secs commands waited and the total secs clusters were up.
+"""
+SimulationResult = namedtuple("SimulationResult", ["decisions", "warm", "cold",
+                                                   "wait_seconds", "cluster_seconds"])
+
+
+def schedule_label(schedule):
+    """
+    Returns:
+        the cluster label the commands of the schedule `schedule` (a dict of
+        its attributes) run on
+    """
+    command = schedule.get("command") or {}
+    return schedule.get("label") or command.get("label") or "default"
+
+
+def schedule_runs(schedule, start, end):
+    """
+    Returns:
+        the times in [`start`, `end`) at which the running schedule
+        `schedule` (a dict of its attributes) will start an instance
+    """
+    if str(schedule.get("status", "RUNNING")).upper() != "RUNNING":
+        return []
+    period = int(schedule.get("frequency") or 1) * \
+        TIME_UNITS.get(schedule.get("time_unit"), TIME_UNITS["days"])
+    first = parse_time(schedule.get("start_time"))
+    last = parse_time(schedule.get("end_time"))
+    if first is None:
+        return []
+    if last is not None:
+        end = min(end, last)
+    if start > first:
+        first += -(-(start - first) // period) * period
+    runs = []
+    while first < end:
+        runs.append(first)
+        first += period
+    return runs
+
+
+def _command_pages(fields, per_page):
+    """
+    Returns:
+        a generator of the pages of commands, newest first, with the
+        fields `fields`. See `util.iter_pages`.
+    """
+    conn = Qubole.agent()
+    return util.iter_pages(
+        lambda page: conn.get("%s?page=%s&per_page=%s" %
+                              (Command.rest_entity_path, page, per_page),
+                              params={"fields": ",".join(fields)}),
+        "commands", per_page)
+
+
+class DemandModel(object):
+    """
+    Predicts when commands will be submitted to each cluster label. Runs of
+    schedules are certain; otherwise the chance of a command in a window is
+    the fraction of the last `weeks` weeks in which a command was submitted
+    to the label at the same time of the week (in `bucket` secs slots).
+    """
+
+    def __init__(self, schedules=(), history=(), weeks=4, bucket=3600):
+        """
+        Args:
+            `schedules`: dicts of schedule attributes
+
+            `history`: (time, label) pairs of past commands
+        """
+        self.schedules = list(schedules)
+        self.weeks = weeks
+        self.bucket = bucket
+        # label -> set of bucket numbers with commands
+        self._buckets = defaultdict(set)
+        self.last_command = {}
+        for submitted, label in history:
+            self.add_command(submitted, label)
+
+    def add_command(self, submitted, label):
+        self._buckets[label].add(int(submitted // self.bucket))
+        if submitted > self.last_command.get(label, 0):
+            self.last_command[label] = submitted
+
+    def labels(self):
+        return set(self._buckets) | set(schedule_label(s) for s in self.schedules)
+
+    def scheduled(self, label, start, end):
+        """
+        Returns:
+            the sorted times of the schedule runs on `label` in [start, end)
+        """
+        runs = []
+        for schedule in self.schedules:
+            if schedule_label(schedule) == label:
+                runs.extend(schedule_runs(schedule, start, end))
+        return sorted(runs)
+
+    def demand(self, label, start, end):
+        """
+        Returns:
+            the chance, between 0 and 1, that a command is submitted to
+            `label` in [start, end)
+        """
+        if self.scheduled(label, start, end):
+            return 1.0
+        buckets = self._buckets.get(label)
+        if not buckets:
+            return 0.0
+        weeks_bucket = WEEK // self.bucket
+        best = 0
+        for slot in range(int(start // self.bucket), int((end - 1) // self.bucket) + 1):
+            seen = sum(1 for week in range(1, self.weeks + 1)
+                       if slot - week * weeks_bucket in buckets)
+            best = max(best, seen)
+        return best / float(self.weeks)
+
+
+class Prewarmer(object):
+    """
+    Starts the clusters of the labels expected to get commands within
+    `lead_time` secs, and terminates the clusters which had no command for
+    `idle_timeout` secs, have no command still running and are not expected
+    to get one in as long.
+    """
+
+    def __init__(self, model, lead_time=900, idle_timeout=3600, threshold=0.5,
+                 labels=None, concurrency=8, max_runtime=2 * 86400):
+        """
+        Args:
+            `model`: the DemandModel predicting commands
+
+        Kwargs:
+            `threshold`: least chance of a command for which a cluster is
+                started or kept up
+
+            `labels`: the labels managed, all those known to the model by
+                default
+
+            `max_runtime`: secs after their submission for which commands
+                are looked at to tell whether they still run
+        """
+        self.model = model
+        self.lead_time = lead_time
+        self.idle_timeout = idle_timeout
+        self.threshold = threshold
+        self.labels = labels
+        self.concurrency = concurrency
+        self.max_runtime = max_runtime
+
+    @classmethod
+    def from_qds(cls, history_days=28, per_page=500, **kwargs):
+        """
+        Builds the demand model from the schedules and the commands of the
+        last `history_days` days fetched from QDS.
+        """
+        conn = Qubole.agent()
+        schedules = []
+        for found in util.iter_pages(
+                lambda page: conn.get("%s?page=%s&per_page=%s" %
+                                      (Scheduler.rest_entity_path, page, per_page)),
+                "schedules", per_page):
+            schedules.extend(found)
+
+        since = time.time() - history_days * 86400
+        history = []
+        for found in _command_pages(["label", "created_at"], per_page):
+            for command in found:
+                created = parse_time(command.get("created_at"))
+                if created is not None and created >= since:
+                    history.append((created, command.get("label") or "default"))
+            # Commands are listed newest first
+            if any((parse_time(c.get("created_at")) or since) < since for c in found):
+                break
+        weeks = max(1, history_days // 7)
+        return cls(DemandModel(schedules, history, weeks=weeks), **kwargs)
+
+    def running_labels(self, now, per_page=100):
+        """
+        Returns:
+            the set of labels with a command submitted in the last
+            `max_runtime` secs which is still waiting or running. The
+            commands seen are added to the model, to keep its
+            `last_command` current.
+        """
+        since = now - self.max_runtime
+        labels = set()
+        for found in _command_pages(["label", "status", "created_at"], per_page):
+            for command in found:
+                label = command.get("label") or "default"
+                created = parse_time(command.get("created_at"))
+                if created is not None:
+                    self.model.add_command(created, label)
+                if command.get("status") in RUNNING_STATUSES:
+                    labels.add(label)
+            # Commands are listed newest first
+            if any((parse_time(c.get("created_at")) or since) < since for c in found):
+                break
+        return labels
+
+    def plan(self, states, now, running=()):
+        """
+        Args:
+            `states`: dictionary of label to the state of its cluster
+
+            `running`: the labels with a command still running, whose
+                clusters are never terminated
+
+        Returns:
+            a list of PrewarmDecision
+        """
+        decisions = []
+        for label in sorted(self.labels or self.model.labels()):
+            state = str(states.get(label) or "").upper()
+            if state == "DOWN":
+                demand = self.model.demand(label, now, now + self.lead_time)
+                if demand >= self.threshold:
+                    decisions.append(PrewarmDecision(
+                        label, "start", "%.0f%% chance of a command within %ds" %
+                        (demand * 100, self.lead_time), now))
+            elif state == "UP":
+                if label in running:
+                    continue
+                last = self.model.last_command.get(label)
+                if last is not None and now - last < self.idle_timeout:
+                    continue
+                demand = self.model.demand(label, now, now + self.idle_timeout)
+                if demand < self.threshold:
+                    decisions.append(PrewarmDecision(
+                        label, "terminate", "idle, %.0f%% chance of a command within %ds" %
+                        (demand * 100, self.idle_timeout), now))
+        return decisions
+
+    def run_once(self, now=None, dry_run=False):
+        """
+        Fetches the state of the clusters of the managed labels and, if any
+        is up, the recent commands, to tell the labels with commands still
+        running and when each label last got a command. Then starts and
+        terminates clusters as planned. With `dry_run` the decisions are
+        only returned.
+
+        Returns:
+            a list of PrewarmDecision
+        """
+        now = now or time.time()
+        labels = sorted(self.labels or self.model.labels())
+        states = {}
+        for label, status, error in util.run_concurrently(
+                Cluster.status, labels, self.concurrency):
+            if error is not None:
+                log.warning("Could not get the state of cluster %s: %s" % (label, error))
+            else:
+                states[label] = status["state"]
+        running = ()
+        if any(str(state).upper() == "UP" for state in states.values()):
+            running = self.running_labels(now)
+        decisions = self.plan(states, now, running)
+        if dry_run or not decisions:
+            return decisions
+        changes = {"start": Cluster.start, "terminate": Cluster.terminate}
+        for decision, response, error in util.run_concurrently(
+                lambda d: changes[d.action](d.label), decisions, self.concurrency):
+            if error is not None:
+                log.warning("Could not %s cluster %s: %s" % (decision.action, decision.label, error))
+            else:
+                log.info("%s cluster %s: %s" % (decision.action, decision.label, decision.reason))
+        return decisions
+
+
+def simulate(history, schedules=(), start=None, end=None, step=300, startup_time=600,
+             prewarm=True, weeks=4, **kwargs):
+    """
+    Replays the recorded commands in `history` against a Prewarmer which
+    learns from them as they are submitted, starting from no history.
+    Clusters are assumed to start on their own when a command is submitted
+    to them, taking `startup_time` secs, as in QDS.
+
+    Args:
+        `history`: (time, label) pairs of recorded commands
+
+        `schedules`: dicts of schedule attributes
+
+        `start`, `end`: the period simulated, that of `history` by default
+
+        `step`: secs between two runs of the Prewarmer
+
+        `prewarm`: if False, clusters are only terminated when idle, which
+            gives a baseline to compare with
+
+        `**kwargs`: passed to Prewarmer
+
+    Returns:
+        a SimulationResult
+    """
+    history = sorted(history)
+    if start is None:
+        start = history[0][0] if history else 0
+    if end is None:
+        end = history[-1][0] + step if history else start
+    if not prewarm:
+        kwargs["threshold"] = float("inf")
+    model = DemandModel(schedules, weeks=weeks)
+    prewarmer = Prewarmer(model, **kwargs)
+    # label -> time the cluster is (or will be) up from, None when down
+    up_since = {}
+    decisions = []
+    warm = cold = 0
+    wait_seconds = cluster_seconds = 0
+    index = 0
+    now = start
+    while now < end:
+        step_end = min(now + step, end)
+        while index < len(history) and history[index][0] < step_end:
+            submitted, label = history[index]
+            ready = up_since.get(label)
+            if ready is None:
+                cold += 1
+                wait_seconds += startup_time
+                up_since[label] = submitted + startup_time
+            elif ready > submitted:
+                cold += 1
+                wait_seconds += ready - submitted
+            else:
+                warm += 1
+            model.add_command(submitted, label)
+            index += 1
+        states = dict((label, "DOWN") for label in model.labels())
+        states.update((label, "UP") for label, ready in up_since.items() if ready is not None)
+        for decision in prewarmer.plan(states, step_end):
+            decisions.append(decision)
+            if decision.action == "start":
+                up_since[decision.label] = step_end + startup_time
+            else:
+                cluster_seconds += max(0, step_end - up_since[decision.label])
+                up_since[decision.label] = None
+        now = step_end
+    for ready in up_since.values():
+        if ready is not None:
+            cluster_seconds += max(0, end - ready)
+    return SimulationResult(decisions, warm, cold, wait_seconds, cluster_seconds)
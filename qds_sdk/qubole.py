@@ -28,11 +28,14 @@ class Qubole:
     base_url = None
     poll_interval = None
     skip_ssl_cert_check = None
+    s3_endpoint = None
+    timeout = 300
 
     @classmethod
     def configure(cls, api_token,
                   api_url="https://api.qubole.com/api/", version="v1.2",
-                  poll_interval=5, skip_ssl_cert_check=False):
+                  poll_interval=5, skip_ssl_cert_check=False,
+                  s3_endpoint=None, timeout=300):
         """
         Set parameters governing interaction with QDS
 
@@ -44,16 +47,29 @@ class Qubole:
             `version`: QDS REST api version
 
             `poll_interval`: interval in secs when polling QDS for events
+
+            `s3_endpoint`: base URL of an S3 compatible store to download
+                results from. configurable for testing only
+
+            `timeout`: secs to wait for a response to a REST request
         """
+        base_url = api_url.rstrip('/') + '/' + version
+        if (cls.api_token, cls.base_url, cls.skip_ssl_cert_check, cls.timeout) != \
+                (api_token, base_url, skip_ssl_cert_check, timeout):
+            # Keep the pooled connection when reconfigured with the same
+            # settings (e.g. by the daemon for every invocation)
+            cls.cached_agent = None
         cls._auth = QuboleAuth(api_token)
         cls.api_token = api_token
-        cls.base_url = api_url.rstrip('/') + '/' + version
+        cls.base_url = base_url
         if poll_interval < Qubole.MIN_POLL_INTERVAL:
             log.warn("Poll interval cannot be less than %s seconds. Setting it to %s seconds.\n" % (Qubole.MIN_POLL_INTERVAL, Qubole.MIN_POLL_INTERVAL))
             cls.poll_interval = Qubole.MIN_POLL_INTERVAL
         else:
             cls.poll_interval = poll_interval
         cls.skip_ssl_cert_check = skip_ssl_cert_check
+        cls.s3_endpoint = s3_endpoint
+        cls.timeout = timeout
 
     cached_agent = None
 
@@ -67,6 +83,17 @@ class Qubole:
             raise ConfigError("No API Token specified - please supply one via Qubole.configure()")
 
         if cls.cached_agent is None:
-            cls.cached_agent = Connection(cls._auth, cls.base_url, cls.skip_ssl_cert_check)
+            cls.cached_agent = Connection(cls._auth, cls.base_url, cls.skip_ssl_cert_check,
+                                          timeout=cls.timeout)
 
         return cls.cached_agent
+
+    @classmethod
+    def metrics(cls):
+        """
+        Returns:
+           the registry of request, polling and download metrics recorded by
+           the SDK in this process (see qds_sdk.metrics)
+        """
+        from qds_sdk.metrics import registry
+        return registry
@@ -0,0 +1,205 @@
+"""
+The reconcile module brings clusters in line with configurations kept as
+code. Desired configurations are loaded from a directory of JSON files, the
+current configurations of all the clusters are fetched in parallel, and the
+settings which differ are applied with bounded concurrency.
+"""
+
+from qds_sdk.cluster import Cluster, ClusterOutcome, _diff_payload, _make_minimal
+from qds_sdk.cluster_schema import validate_payload
+from qds_sdk.exception import ResourceNotFound, ValidationError
+from qds_sdk import util
+from collections import namedtuple
+
+import os
+import json
+import time
+import logging
+
+log = logging.getLogger("qds_reconcile")
+
+"""
+What Reconciler.plan decided to do with one cluster. `action` is one of
+"create", "update", "unchanged", "missing" (the cluster does not exist and
+creating clusters is not allowed) or "error" (its desired configuration is
+invalid or its current one could not be fetched). `changes` is the payload
+which will be sent.
+"""
+PlanItem = namedtuple("PlanItem", ["cluster", "action", "changes", "error"])
+
+APPLIED_ACTIONS = ("create", "update")
+
+
+def load_configs(directory):
+    """
+    Loads the desired cluster configurations from the *.json files in
+    `directory`. Each file holds a cluster payload, as built by
+    `ClusterInfoV13.minimal_payload` (or `ClusterInfo.minimal_payload`).
+    The cluster is identified by its first label, or by the name of the
+    file if the payload has no label.
+
+    Returns:
+        a dictionary of cluster label to payload
+    """
+    configs = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        with open(path) as f:
+            try:
+                payload = json.load(f)
+            except ValueError as e:
+                raise ValueError("Invalid cluster configuration %s: %s" % (path, e))
+        if not isinstance(payload, dict):
+            raise ValueError("Invalid cluster configuration %s: not an object" % path)
+        cluster = payload.get("cluster", payload)
+        if not isinstance(cluster, dict):
+            raise ValueError('Invalid cluster configuration %s: "cluster" is not an object' %
+                             path)
+        label = cluster.get("label")
+        if isinstance(label, list):
+            label = label[0] if label else None
+        if not label:
+            label = name[:-len(".json")]
+        if label in configs:
+            raise ValueError("Cluster %s is configured more than once, in %s" %
+                             (label, path))
+        configs[label] = _make_minimal(payload)
+    return configs
+
+
+class Reconciler(object):
+    """
+    Computes and applies the changes bringing clusters to their desired
+    configurations. The time taken by each stage is kept in `timings`.
+    """
+
+    def __init__(self, configs, concurrency=8, create_missing=False):
+        """
+        Args:
+            `configs`: dictionary of cluster id/label to desired payload
+
+        Kwargs:
+            `concurrency`: number of clusters fetched or changed in parallel
+
+            `create_missing`: create the configured clusters which do not
+                exist. They are only reported otherwise.
+        """
+        self.configs = configs
+        self.concurrency = concurrency
+        self.create_missing = create_missing
+        self.timings = {}
+
+    @classmethod
+    def from_directory(cls, directory, **kwargs):
+        """
+        Returns:
+            a Reconciler for the configurations in `directory`, see
+            `load_configs`
+        """
+        start = time.time()
+        reconciler = cls(load_configs(directory), **kwargs)
+        reconciler.timings["load"] = time.time() - start
+        return reconciler
+
+    def validate(self):
+        """
+        Returns:
+            a dictionary of cluster id/label to the ValidationError of each
+            invalid desired configuration
+        """
+        start = time.time()
+        invalid = {}
+        for label, desired in self.configs.items():
+            errors = validate_payload(desired, "update")
+            if errors:
+                invalid[label] = ValidationError(errors)
+        self.timings["validate"] = time.time() - start
+        return invalid
+
+    def fetch(self, labels=None):
+        """
+        Fetches the current configurations of the clusters in `labels`, all
+        the configured clusters by default.
+
+        Returns:
+            a dictionary of cluster id/label to its current configuration, or
+            to the exception raised while fetching it
+        """
+        start = time.time()
+        current = {}
+        for label, config, error in util.run_concurrently(
+                lambda label: Cluster.current_config(label, max_age=0),
+                self.configs if labels is None else labels, self.concurrency):
+            current[label] = error if error is not None else config
+        self.timings["fetch"] = time.time() - start
+        return current
+
+    def plan(self):
+        """
+        Validates the desired configurations, fetches the current ones and
+        compares them. Clusters with an invalid configuration are not
+        fetched.
+
+        Returns:
+            a list of PlanItem, one per configured cluster, by label
+        """
+        current = self.validate()
+        current.update(self.fetch([l for l in self.configs if l not in current]))
+        start = time.time()
+        plan = []
+        for label in sorted(self.configs):
+            desired = self.configs[label]
+            config = current[label]
+            if isinstance(config, ResourceNotFound):
+                errors = validate_payload(desired, "create") if self.create_missing else []
+                if errors:
+                    plan.append(PlanItem(label, "error", None, ValidationError(errors)))
+                else:
+                    action = "create" if self.create_missing else "missing"
+                    plan.append(PlanItem(label, action, desired, None))
+            elif isinstance(config, Exception):
+                plan.append(PlanItem(label, "error", None, config))
+            else:
+                changes = _diff_payload(desired, config)
+                plan.append(PlanItem(label, "update" if changes else "unchanged",
+                                     changes or None, None))
+        self.timings["plan"] = time.time() - start
+        return plan
+
+    def apply(self, plan=None, dry_run=False):
+        """
+        Applies the changes in `plan`, planning them first if no plan is
+        given. With `dry_run` the plan is only computed.
+
+        Returns:
+            a tuple of the plan and a dictionary of cluster id/label to the
+            ClusterOutcome of the clusters created or updated
+        """
+        if plan is None:
+            plan = self.plan()
+        changes = [item for item in plan if item.action in APPLIED_ACTIONS]
+        outcomes = {}
+        if dry_run:
+            return plan, outcomes
+
+        start = time.time()
+
+        def apply_one(item):
+            if item.action == "create":
+                log.info("Creating cluster %s" % item.cluster)
+                return Cluster.create(item.changes)
+            log.info("Updating cluster %s with %s" % (item.cluster, json.dumps(item.changes)))
+            return Cluster.update(item.cluster, item.changes)
+
+        for item in changes:
+            outcomes[item.cluster] = ClusterOutcome(item.cluster, None, None, None)
+        for item, response, error in util.run_concurrently(
+                apply_one, changes, self.concurrency):
+            if error is not None:
+                log.warning("Could not %s cluster %s: %s" % (item.action, item.cluster, error))
+            outcomes[item.cluster] = outcomes[item.cluster]._replace(
+                response=response, error=error)
+        self.timings["apply"] = time.time() - start
+        return plan, outcomes
@@ -3,8 +3,35 @@ The report module contains the definitions for retrieving various reports.
 """
 from qds_sdk.qubole import Qubole
 from qds_sdk.resource import Resource
+from qds_sdk.exception import ServerError, RetryWithDelay
+from qds_sdk import util
+from collections import deque
 import argparse
+import datetime
+import requests
+import time
+import hashlib
 import json
+import sys
+import os
+import logging
+
+log = logging.getLogger("qds_report")
+
+"""Key of the list of rows in the response of each report"""
+REPORT_ROWS = {"all_commands": "commands", "canonical_hive_commands": "results"}
+
+"""Statuses of commands which will not change, as for Command.is_done"""
+FINAL_STATUSES = ("done", "error", "cancelled")
+
+"""Errors after which a shard of a report is fetched again"""
+RETRIED_ERRORS = (ServerError, RetryWithDelay, requests.RequestException)
+
+"""
+Reports with one row per command, which can be fetched a date range at a
+time. The rows of the other reports aggregate the whole range.
+"""
+SHARDABLE_REPORTS = ("all_commands",)
 
 
 class ReportCmdLine:
@@ -72,6 +99,12 @@ class ReportCmdLine:
                 action="store_true", help="""Report only those queries which
                 are created by the current user. By default, all queries from
                 the current account are reported.""")
+        ac.add_argument("--all", dest="all_rows", action="store_true", default=False,
+                help="""Print every command of the date range, one json object
+                per line, fetching it a day at a time instead of a page.""")
+        ac.add_argument("--cache-dir", dest="cache_dir",
+                help="""With --all, directory in which the days which are
+                over are cached.""")
         ac.set_defaults(func=ReportCmdLine.all_commands)
 
 
@@ -122,6 +155,15 @@ class ReportCmdLine:
     def all_commands(args):
         data = vars(args)
         data.pop("func")    # We don't want to send this to the api
+        all_rows = data.pop("all_rows")
+        cache_dir = data.pop("cache_dir")
+        if all_rows:
+            for key in ("offset", "limit"):
+                data.pop(key, None)
+            client = ReportClient(cache_dir=cache_dir)
+            for row in client.iter_rows("all_commands", **data):
+                sys.stdout.write(json.dumps(row, sort_keys=True) + "\n")
+            return None
         result = Report.show("all_commands", data)
         return json.dumps(result, indent=4)
 
@@ -163,3 +205,204 @@ class Report(Resource):
         """
         conn = Qubole.agent()
         return conn.get(cls.rest_entity_path)
+
+
+def _date(value):
+    """Returns `value`, a date or a YYYY-MM-DD string, as a date"""
+    if value is None or isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _today():
+    return datetime.datetime.utcnow().date()
+
+
+def date_ranges(start_date, end_date, days=1):
+    """
+    Returns:
+        the [start, end) ranges of `days` days, as pairs of dates, covering
+        [`start_date`, `end_date`)
+    """
+    start, end = _date(start_date), _date(end_date)
+    step = datetime.timedelta(days=days)
+    ranges = []
+    while start < end:
+        ranges.append((start, min(start + step, end)))
+        start += step
+    return ranges
+
+
+def to_columns(rows, fields=None):
+    """
+    Converts report rows to columns, for aggregation.
+
+    Args:
+        `rows`: dicts, as returned by `ReportClient.rows`
+
+        `fields`: names of the columns, those of the first row by default
+
+    Returns:
+        a dictionary of field name to the list of its values
+    """
+    rows = rows if isinstance(rows, list) else list(rows)
+    return dict((field, [row.get(field) for row in rows])
+                for field in _fields(rows, fields))
+
+
+def _fields(rows, fields):
+    if fields is None:
+        return sorted(rows[0]) if rows else []
+    return list(fields)
+
+
+def to_dataframe(rows, fields=None):
+    """
+    Returns:
+        the report rows as a pandas DataFrame. pandas must be installed.
+    """
+    try:
+        import pandas
+    except ImportError:
+        raise ImportError("pandas is required to convert reports to DataFrames")
+    rows = rows if isinstance(rows, list) else list(rows)
+    fields = _fields(rows, fields)
+    return pandas.DataFrame(to_columns(rows, fields), columns=fields)
+
+
+class ReportClient(object):
+    """
+    Fetches every row of a report over a date range. Reports with a row per
+    command are sharded in ranges of `shard_days` days, fetched `concurrency`
+    at a time and returned in order; a shard failing with a server error or
+    a timeout is fetched again, up to `retries` times. Each range is paged
+    through `page_size` rows at a time. Ranges which are over, and whose
+    commands have all finished, cannot change, so they are cached in
+    `cache_dir` when one is given.
+    """
+
+    def __init__(self, cache_dir=None, page_size=1000, shard_days=1, concurrency=4,
+                 retries=3, retry_delay=5):
+        self.cache_dir = cache_dir
+        self.page_size = page_size
+        self.shard_days = shard_days
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    def iter_rows(self, report_name, start_date=None, end_date=None, **params):
+        """
+        Lazily yields the rows of the report `report_name` from `start_date`
+        (inclusive) to `end_date` (exclusive), dates or YYYY-MM-DD strings.
+        As for the API, the range defaults to the 7 days before today.
+
+        Args:
+            `**params`: other parameters of the report, e.g. sort_column
+        """
+        if report_name not in REPORT_ROWS:
+            raise ValueError("Unknown report %s" % report_name)
+        end = _date(end_date) or _today()
+        start = _date(start_date) or end - datetime.timedelta(days=7)
+        if report_name in SHARDABLE_REPORTS:
+            ranges = date_ranges(start, end, self.shard_days)
+        else:
+            ranges = [(start, end)]
+        if self.concurrency <= 1 or len(ranges) <= 1:
+            for range_start, range_end in ranges:
+                for row in self._shard(report_name, range_start, range_end, params):
+                    yield row
+            return
+
+        # Up to `concurrency` shards are fetched ahead of the one being read
+        pool = util.thread_pool(min(self.concurrency, len(ranges)))
+        pending = deque()
+        index = 0
+        try:
+            while index < len(ranges) or pending:
+                while index < len(ranges) and len(pending) < self.concurrency:
+                    range_start, range_end = ranges[index]
+                    pending.append(pool.apply_async(
+                        self._shard, (report_name, range_start, range_end, params)))
+                    index += 1
+                for row in pending.popleft().get():
+                    yield row
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def rows(self, report_name, start_date=None, end_date=None, **params):
+        """
+        Returns:
+            the list of the rows of the report, see `iter_rows`
+        """
+        return list(self.iter_rows(report_name, start_date, end_date, **params))
+
+    def columns(self, report_name, start_date=None, end_date=None, fields=None, **params):
+        """
+        Returns:
+            the rows of the report as columns, see `to_columns`
+        """
+        return to_columns(self.iter_rows(report_name, start_date, end_date, **params), fields)
+
+    def dataframe(self, report_name, start_date=None, end_date=None, fields=None, **params):
+        """
+        Returns:
+            the rows of the report as a pandas DataFrame
+        """
+        return to_dataframe(self.iter_rows(report_name, start_date, end_date, **params), fields)
+
+    def _shard(self, report_name, start, end, params):
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                return self._range_rows(report_name, start, end, params)
+            except RETRIED_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                log.warning("Could not fetch %s from %s to %s, retrying in %ds: %s" %
+                            (report_name, start, end, delay, e))
+                time.sleep(delay)
+                delay *= 2
+
+    def _range_rows(self, report_name, start, end, params):
+        path = self._cache_path(report_name, start, end, params)
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        rows = self._fetch(report_name, start, end, params)
+        # Commands still waiting or running will change, so the range is
+        # fetched again until they are all over
+        if path is not None and all(row.get("status", "done") in FINAL_STATUSES
+                                    for row in rows):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, "w") as f:
+                json.dump(rows, f)
+            os.rename(tmp, path)
+        return rows
+
+    def _fetch(self, report_name, start, end, params):
+        rows = []
+        while True:
+            data = dict(params, start_date=start.isoformat(), end_date=end.isoformat(),
+                        offset=len(rows), limit=self.page_size)
+            page = Report.show(report_name, data).get(REPORT_ROWS[report_name]) or []
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+
+    def _cache_path(self, report_name, start, end, params):
+        """
+        Returns:
+            the file caching the rows of the range, None if it is not to
+            be cached because it is not over. The rows depend on the
+            account and user as well as on `params`, so the API URL and
+            token are part of the key.
+        """
+        if self.cache_dir is None or end > _today():
+            return None
+        key = json.dumps([Qubole.base_url, Qubole.api_token, params], sort_keys=True)
+        key = hashlib.sha1(key.encode("utf8")).hexdigest()[:12]
+        return os.path.join(self.cache_dir, report_name, "%s-%s-%s.json" %
+                            (start.isoformat(), end.isoformat(), key))
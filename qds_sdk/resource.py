@@ -2,14 +2,42 @@
 qds_sdk.Resource represents a REST based resource with standard methods like
 create/find etc.
 """
-import inflection
 import json
-from six import add_metaclass
+import threading
+from six import add_metaclass, string_types
+from six.moves import intern
 from qds_sdk import util
 from qds_sdk.qubole import Qubole
 
+# Marks fields that a record does not have
+_MISSING = object()
 
-class ResourceMeta(type):
+_layout_lock = threading.Lock()
+
+# Short string values (statuses, types, labels etc.) repeat across records
+# and are interned so that they are shared
+_INTERN_MAX_LENGTH = 16
+
+
+class RecordMeta(type):
+    """
+    A metaclass for compact resource objects.
+    Gives every class empty __slots__, so that instances have no __dict__,
+    and its own layout mapping field names to positions in the value tuple
+    of its instances.
+    """
+
+    def __new__(mcs, name, bases, new_attrs):
+        new_attrs.setdefault('__slots__', ())
+        new_attrs['_layout'] = {}
+        # Field names in layout order, and the positions of fields holding
+        # short strings, which are interned
+        new_attrs['_order'] = ()
+        new_attrs['_shared_indices'] = ()
+        return type.__new__(mcs, name, bases, new_attrs)
+
+
+class ResourceMeta(RecordMeta):
     """
     A metaclass for Resource objects.
     Defines the path for the entity if one is not defined
@@ -29,10 +57,10 @@ class ResourceMeta(type):
         """
         if 'rest_entity_path' not in new_attrs:
             new_attrs['rest_entity_path'] = util.pluralize(util.underscore(name))
-        return type.__new__(mcs, name, bases, new_attrs)
+        return RecordMeta.__new__(mcs, name, bases, new_attrs)
 
 
-class ResourceMetaSingleton(type):
+class ResourceMetaSingleton(RecordMeta):
     """
     A metaclass for Singleton Resource objects.
     Defines the path for the entity if one is not defined
@@ -52,15 +80,149 @@ class ResourceMetaSingleton(type):
         """
         if 'rest_entity_path' not in new_attrs:
             new_attrs['rest_entity_path'] = util.underscore(name)
-        return type.__new__(mcs, name, bases, new_attrs)
+        return RecordMeta.__new__(mcs, name, bases, new_attrs)
+
+
+def query_params(fields=None, filters=None):
+    """
+    Returns:
+        the query parameters asking the API for only `fields` of the
+        resources matching `filters`, or None if neither is given. The
+        fields filtered on are asked for too, so that the filters can be
+        checked on whatever the API sends back.
+    """
+    params = {}
+    if filters:
+        for name, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                value = ",".join(str(v) for v in value)
+            params[name] = value
+    if fields:
+        params["fields"] = ",".join(list(fields) + [name for name in sorted(filters or ())
+                                                    if name not in fields])
+    return params or None
+
+
+def select_fields(attributes, fields):
+    """
+    Returns:
+        `attributes` with only the given `fields`, for APIs which ignore the
+        fields parameter. All of them if `fields` is empty.
+    """
+    if not fields:
+        return attributes
+    return dict((name, attributes[name]) for name in fields if name in attributes)
 
 
+def matches(attributes, filters):
+    """
+    Returns:
+        whether `attributes` has the values given in `filters`. A list of
+        values matches any of them, a field holding a list (such as the
+        labels of a cluster) matches if any of its elements does, and
+        strings match regardless of case. A field missing from `attributes`
+        does not match, as it cannot be checked.
+    """
+    if not filters:
+        return True
+    for name, wanted in filters.items():
+        if name not in attributes:
+            return False
+        if not isinstance(wanted, (list, tuple, set)):
+            wanted = (wanted,)
+        wanted = [_normalize(w) for w in wanted]
+        value = attributes[name]
+        values = value if isinstance(value, (list, tuple)) else (value,)
+        if not any(_normalize(v) in wanted for v in values):
+            return False
+    return True
+
+
+def _normalize(value):
+    if isinstance(value, string_types):
+        return value.lower()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Filters given on the command line are strings
+        return str(value)
+    return value
+
+
+@add_metaclass(RecordMeta)
 class BaseResource(object):
+    """
+    Holds the fields of a resource returned by the API.
+
+    Listings can return hundreds of thousands of objects, so instead of a
+    dict per object the field values are kept in a tuple laid out by the
+    class-wide `_layout`, with short strings shared between objects. The
+    `attributes` dict is only built when it is asked for.
+    """
+
+    __slots__ = ('_values', '_attributes')
 
     def __init__(self, attributes=None):
         if attributes is None:
             attributes = {}
-        self.attributes = attributes
+        self._attributes = None
+        self._values = self._pack(attributes)
+
+    @classmethod
+    def _pack(cls, attributes):
+        if tuple(attributes) != cls._order:
+            return cls._pack_fields(attributes)
+        # Fast path for records with the same fields as the layout
+        values = list(attributes.values())
+        for index in cls._shared_indices:
+            value = values[index]
+            if type(value) is str and len(value) <= _INTERN_MAX_LENGTH:
+                values[index] = intern(value)
+        return tuple(values)
+
+    @classmethod
+    def _pack_fields(cls, attributes):
+        layout = cls._layout
+        if any(name not in layout for name in attributes):
+            with _layout_lock:
+                for name in attributes:
+                    layout.setdefault(name, len(layout))
+                cls._order = tuple(sorted(layout, key=layout.get))
+        values = [_MISSING] * len(layout)
+        shared = []
+        for name, value in attributes.items():
+            index = layout[name]
+            if type(value) is str and len(value) <= _INTERN_MAX_LENGTH:
+                value = intern(value)
+                shared.append(index)
+            values[index] = value
+        if len(shared) > len(cls._shared_indices):
+            cls._shared_indices = tuple(sorted(shared))
+        return tuple(values)
+
+    def _to_dict(self):
+        if self._attributes is not None:
+            return self._attributes
+        values = self._values
+        attributes = {}
+        for name, index in sorted(list(self._layout.items()), key=lambda item: item[1]):
+            if index < len(values) and values[index] is not _MISSING:
+                attributes[name] = values[index]
+        return attributes
+
+    @property
+    def attributes(self):
+        """
+        The fields of the resource as a dict. Once accessed, the dict is
+        kept and changes made to it are reflected by the object.
+        """
+        if self._attributes is None:
+            self._attributes = self._to_dict()
+            self._values = None
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        self._attributes = attributes
+        self._values = None
 
     def __getattr__(self, name):
         """Retrieve the requested attribute if it exists.
@@ -74,13 +236,38 @@ class BaseResource(object):
         Raises:
             AttributeError: if no such attribute exists.
         """
-        try:
-            return self.attributes[name]
-        except KeyError:
+        if name in BaseResource.__slots__:
+            # Not initialized yet, e.g. while unpickling
+            raise AttributeError(name)
+        if self._attributes is not None:
+            try:
+                return self._attributes[name]
+            except KeyError:
+                raise AttributeError(name)
+        index = self._layout.get(name)
+        values = self._values
+        if index is None or index >= len(values) or values[index] is _MISSING:
             raise AttributeError(name)
+        return values[index]
+
+    def __setattr__(self, name, value):
+        # Anything else, even a name shadowing a method (such as the status
+        # of an Action), is a field
+        if name in BaseResource.__slots__ or \
+                isinstance(getattr(type(self), name, None), property):
+            object.__setattr__(self, name, value)
+        else:
+            self.attributes[name] = value
+
+    def __getstate__(self):
+        return self._to_dict()
+
+    def __setstate__(self, state):
+        self._attributes = None
+        self._values = self._pack(state)
 
     def __str__(self):
-        return json.dumps(self.attributes)
+        return json.dumps(self._to_dict())
 
 
 class Resource(BaseResource):
@@ -93,10 +280,76 @@ class Resource(BaseResource):
         return "%s/%s" % (cls.rest_entity_path, str(id))
 
     @classmethod
-    def find(cls, id, **kwargs):
+    def find(cls, id, fields=None, **kwargs):
+        """
+        Fetches the resource with this id
+
+        Args:
+            `id`: id of the resource
+
+            `fields`: names of the fields to return. The API is asked to
+                send only these, and they are selected locally if it
+                sends more.
+        """
         conn = Qubole.agent()
         if id is not None:
-            return cls(conn.get(cls.element_path(id)))
+            params = query_params(fields)
+            return cls(select_fields(conn.get(cls.element_path(id), params), fields))
+
+    @classmethod
+    def find_many(cls, ids, concurrency=8, fields=None, cache=None, stream=False):
+        """
+        Fetches many resources at once, with up to `concurrency` requests
+        in flight over the pooled connection. Duplicate ids are fetched
+        once, and an id that cannot be fetched does not abort the batch:
+        the exception raised for it is returned in place of the resource.
+
+        Args:
+            `ids`: ids of the resources
+
+            `concurrency`: number of requests made in parallel
+
+            `fields`: names of the fields to return (see `find`)
+
+            `cache`: dict-like object mapping ids to resources. Ids found in
+                it are not fetched, and fetched resources are added to it
+                unless only some `fields` were asked for.
+
+            `stream`: if True, return a generator of (id, resource or
+                exception) pairs yielded as the requests complete
+
+        Returns:
+            dict mapping every id to its resource or to the exception raised
+            when fetching it
+        """
+        outcomes = cls._find_many(ids, concurrency, fields, cache)
+        if stream:
+            return outcomes
+        return dict(outcomes)
+
+    @classmethod
+    def _find_many(cls, ids, concurrency, fields, cache):
+        pending = []
+        seen = set()
+        for id in ids:
+            key = str(id)
+            if key in seen:
+                continue
+            seen.add(key)
+            resource = cache.get(id) if cache is not None else None
+            if resource is not None:
+                yield id, resource
+            else:
+                pending.append(id)
+
+        for id, resource, error in util.run_concurrently(
+                lambda id: cls.find(id, fields=fields), pending, concurrency):
+            if error is not None:
+                yield id, error
+                continue
+            if cache is not None and not fields:
+                cache[id] = resource
+            yield id, resource
 
     @classmethod
     def create(cls, **kwargs):
@@ -108,7 +361,22 @@ class Resource(BaseResource):
         return self.__class__.element_path(self.id)
 
     @classmethod
-    def list(cls, page = None, per_page = None):
+    def list(cls, page = None, per_page = None, fields=None, **filters):
+        """
+        Lists resources of this type
+
+        Args:
+            `page`, `per_page`: page of the listing to fetch
+
+            `fields`: names of the fields to return
+
+            `**filters`: only return resources whose field has this value
+                (or one of these values, if a list is given)
+
+        The fields and filters are sent to the API, which trims and filters
+        the listing where it supports them. The same is done locally for
+        anything it sends back anyway.
+        """
         conn = Qubole.agent()
         url_path = cls.rest_entity_path
         page_attr = []
@@ -123,10 +391,12 @@ class Resource(BaseResource):
         # (e.g. {nezha_data_sources:[], page:1, prev_page:nil, next_page:2}),
         # Convert Object classname to plural and add '_' to fetch object-list
         # from result. (NezhaDataSource -> nezha_data_sources)
-        resource_json = conn.get(url_path)
+        import inflection
+        resource_json = conn.get(url_path, query_params(fields, filters))
         resource_list = []
         for s in resource_json[inflection.pluralize(inflection.underscore(cls.__name__))]:
-            resource_list.append(cls(s))
+            if matches(s, filters):
+                resource_list.append(cls(select_fields(s, fields)))
         return resource_list
 
     @classmethod
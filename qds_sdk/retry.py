@@ -1,6 +1,7 @@
 import time
 import logging
 from functools import wraps
+from qds_sdk.metrics import registry
 
 log = logging.getLogger("retry")
 
@@ -16,6 +17,9 @@ def retry(ExceptionToCheck, tries=4, delay=3, backoff=2):
                 except ExceptionToCheck as e:
                     msg = "%s, Retrying in %d seconds..." % (e.__class__.__name__, mdelay)
                     log.info(msg)
+                    registry.inc("qds_request_retries_total",
+                                 {"function": f.__name__,
+                                  "exception": e.__class__.__name__})
                     time.sleep(mdelay)
                     mtries -= 1
                     mdelay *= backoff
@@ -1,11 +1,33 @@
 import json
+import sys
+import time
+import threading
+import logging
 
 from qds_sdk.qubole import Qubole
-from qds_sdk.resource import Resource
+from qds_sdk.resource import Resource, query_params, select_fields
+from qds_sdk.exception import WaitTimeout
+from qds_sdk import util
+from qds_sdk.util import parse_time
+from collections import deque, namedtuple
 from argparse import ArgumentParser
 from qds_sdk.commands import *
 from qds_sdk.actions import *
 
+log = logging.getLogger("qds_scheduler")
+
+"""The result of rerunning one instance with Scheduler.backfill"""
+BackfillOutcome = namedtuple("BackfillOutcome", ["instance", "response", "status", "error"])
+
+"""
+The progress of Scheduler.backfill: `done` of the `total` instances have
+been rerun ("rerun" stage) or are done running ("wait" stage), after
+`elapsed` secs, at `throughput` instances per sec.
+"""
+BackfillProgress = namedtuple("BackfillProgress", ["stage", "done", "total",
+                                                   "elapsed", "throughput"])
+
+
 class SchedulerCmdLine:
     """
     qds_sdk.ScheduleCmdLine is the interface used by qds.py.
@@ -92,6 +114,10 @@ class SchedulerCmdLine:
                                     help="Number of items per page")
         list_instances.add_argument("--page", dest="page",
                                     help="Page Number")
+        list_instances.add_argument("--all", dest="all", action="store_true",
+                                    default=False,
+                                    help="Print all instances, one json object"
+                                         " per line, walking every page")
         list_instances.set_defaults(func=SchedulerCmdLine.list_instances)
 
         rerun = subparsers.add_parser("rerun",
@@ -99,6 +125,31 @@ class SchedulerCmdLine:
         rerun.add_argument("id", help="Numeric id or name of the schedule")
         rerun.add_argument("instance_id", help="Numeric id of the instance")
         rerun.set_defaults(func=SchedulerCmdLine.rerun)
+
+        backfill = subparsers.add_parser("backfill",
+                                         help="Rerun the instances of a schedule"
+                                              " with given statuses or nominal times")
+        backfill.add_argument("id", help="Numeric id or name of the schedule")
+        backfill.add_argument("--status", dest="statuses", action="append",
+                              help="Status of the instances to rerun, may be given"
+                                   " more than once. Default: error")
+        backfill.add_argument("--from", dest="start",
+                              help="Rerun the instances with a nominal time from"
+                                   " this one, e.g. 2015-01-31 or 2015-01-31T10:00Z")
+        backfill.add_argument("--to", dest="end",
+                              help="Rerun the instances with a nominal time before this one")
+        backfill.add_argument("--concurrency", dest="concurrency", type=int, default=4,
+                              help="Number of reruns requested in parallel. Default: 4")
+        backfill.add_argument("--rate", dest="rate", type=float,
+                              help="Most reruns requested per second")
+        backfill.add_argument("--wait", dest="wait", action="store_true", default=False,
+                              help="Wait until the reruns are done")
+        backfill.add_argument("--timeout", dest="timeout", type=float,
+                              help="Secs to wait for, with --wait")
+        backfill.add_argument("--dry-run", dest="dry_run", action="store_true",
+                              default=False,
+                              help="Only print the instances which would be rerun")
+        backfill.set_defaults(func=SchedulerCmdLine.backfill)
         return argparser
 
     @staticmethod
@@ -131,7 +182,7 @@ class SchedulerCmdLine:
 
     @staticmethod
     def view(args):
-        schedule = Scheduler.find(args.id)
+        schedule = Scheduler.find(args.id, fields=args.fields)
         if args.fields:
             schedule.attributes = SchedulerCmdLine.filter_fields(schedule.attributes, args.fields)
         return json.dumps(schedule.attributes, sort_keys=True, indent=4)
@@ -173,6 +224,11 @@ class SchedulerCmdLine:
     @staticmethod
     def list_instances(args):
         schedule = Scheduler.find(args.id)
+        if args.all:
+            per_page = int(args.per_page) if args.per_page else 100
+            for cmd in schedule.iter_instances(per_page=per_page, fields=args.fields):
+                sys.stdout.write(json.dumps(cmd.attributes, sort_keys=True) + "\n")
+            return None
         cmdlist = schedule.list_instances(args.page, args.per_page)
         if args.fields:
             for cmd in cmdlist:
@@ -185,6 +241,27 @@ class SchedulerCmdLine:
         schedule = Scheduler.find(args.id)
         return schedule.rerun(args.instance_id)
 
+    @staticmethod
+    def backfill(args):
+        schedule = Scheduler.find(args.id)
+
+        def progress(p):
+            sys.stderr.write("%s: %d/%d instances, %.1f/s\n" %
+                             (p.stage, p.done, p.total, p.throughput or 0))
+
+        outcomes = schedule.backfill(statuses=args.statuses or ["error"],
+                                     start=args.start, end=args.end,
+                                     concurrency=args.concurrency, rate=args.rate,
+                                     wait=args.wait, timeout=args.timeout,
+                                     progress=progress, dry_run=args.dry_run)
+        report = [{"instance": o.instance.id,
+                   "nominal_time": o.instance.attributes.get("nominal_time"),
+                   "status": o.status,
+                   "error": None if o.error is None else str(o.error)}
+                  for o in outcomes]
+        sys.stdout.write(json.dumps(report, sort_keys=True, indent=4) + "\n")
+        return 1 if any(o.error is not None for o in outcomes) else 0
+
 
 class Scheduler(Resource):
     """
@@ -195,6 +272,13 @@ class Scheduler(Resource):
 
     rest_entity_path = "scheduler"
 
+    """Suggested max_age of the index of schedule names of find_by_name"""
+    NAME_INDEX_TTL = 300
+    # (base_url, api_token) -> (time built, name -> attributes)
+    _name_index = {}
+    _name_index_lock = threading.Lock()
+    _name_scan_lock = threading.Lock()
+
     @staticmethod
     def list(page = None, per_page = None):
         conn = Qubole.agent()
@@ -214,14 +298,76 @@ class Scheduler(Resource):
             schedlist.append(Scheduler(s))
         return schedlist
 
-    @staticmethod
-    def find_by_name(name):
+    @classmethod
+    def find_by_name(cls, name, max_age=None):
+        """
+        Returns the schedule named `name`, or None if there is none.
+
+        By default the name is looked up with a single filtered request.
+        When many names are looked up, `max_age` (e.g. `NAME_INDEX_TTL`)
+        serves them from an index of all the schedules, built with a
+        paginated scan and rebuilt once older than `max_age` secs, so the
+        schedules returned may be up to `max_age` secs stale. A name
+        missing from the index is looked up as by default.
+        """
+        if name is None:
+            return None
+        conn = Qubole.agent()
+        key = (conn.base_url, Qubole.api_token)
+        if max_age:
+            attributes = cls._indexed(key, name, max_age)
+            if attributes is not None:
+                return cls(attributes)
+
+        schedjson = conn.get(cls.rest_entity_path, params={"name": name})
+        if not schedjson["schedules"]:
+            return None
+        attributes = schedjson["schedules"][0]
+        with cls._name_index_lock:
+            if key in cls._name_index:
+                cls._name_index[key][1][name] = attributes
+        return cls(attributes)
+
+    @classmethod
+    def _indexed(cls, key, name, max_age):
+        """
+        Returns:
+            the attributes of the schedule named `name` in the index of
+            `key`, rebuilt first if older than `max_age` secs
+        """
+        def fresh():
+            with cls._name_index_lock:
+                built, index = cls._name_index.get(key, (None, None))
+            return index if built is not None and time.time() - built < max_age else None
+
+        index = fresh()
+        if index is None:
+            # One scan at a time; lookups in a fresh index are not held up
+            with cls._name_scan_lock:
+                index = fresh()
+                if index is None:
+                    built, index = time.time(), cls._scan_names()
+                    with cls._name_index_lock:
+                        cls._name_index[key] = (built, index)
+        return index.get(name)
+
+    @classmethod
+    def _scan_names(cls, per_page=100):
+        """
+        Returns:
+            a dictionary of name to attributes of every schedule
+        """
         conn = Qubole.agent()
-        if name is not None:
-            schedjson = conn.get(Scheduler.rest_entity_path, params={"name":name})
-            if schedjson["schedules"]:
-                return Scheduler(schedjson["schedules"][0])
-        return None
+        index = {}
+        pages = util.iter_pages(
+            lambda page: conn.get("%s?page=%s&per_page=%s" %
+                                  (cls.rest_entity_path, page, per_page)),
+            "schedules", per_page)
+        for found in pages:
+            for attributes in found:
+                if attributes.get("name") is not None:
+                    index.setdefault(attributes["name"], attributes)
+        return index
 
     def suspend(self):
         conn = Qubole.agent()
@@ -259,23 +405,171 @@ class Scheduler(Resource):
     def list_instances(self, page=None, per_page=None):
         conn = Qubole.agent()
         url_path = self.element_path(self.id) + "/" + "instances"
-        page_attr = []
+        params = {}
         if page is not None:
-            page_attr.append("page=%s" % page)
+            params['page'] = page
         if per_page is not None:
-            page_attr.append("per_page=%s" % per_page)
-        if page_attr:
-            url_path = "%s/instances?%s" % (self.element_path(args.id), "&".join(page_attr))
-        #Todo Page numbers are thrown away right now
-        cmdjson = conn.get(url_path)
-        cmdlist = []
-        for cmd in cmdjson["commands"]:
-            cmdclass = globals()[cmd["command_type"]]
-            onecmd = cmdclass(cmd)
-            cmdlist.append(onecmd)
-        return cmdlist
+            params['per_page'] = per_page
+
+        cmdjson = conn.get(url_path, params)
+        return [command_class(cmd.get("command_type"))(cmd) for cmd in cmdjson["commands"]]
+
+    def iter_instances(self, per_page=100, prefetch=2, fields=None):
+        """
+        Lazily yields every instance of this schedule, walking all the pages
+        of instances. The pages after the one being read are fetched in the
+        background.
+
+        Args:
+            `per_page`: number of instances fetched per request
+
+            `prefetch`: number of pages read ahead. 0 fetches every page
+                only once the previous one has been read.
+
+            `fields`: names of the fields to return, see `Resource.find`.
+                Instances are returned as Command objects if their
+                command_type is not among them.
+        """
+        conn = Qubole.agent()
+        url_path = self.element_path(self.id) + "/instances"
+        extra = query_params(fields) or {}
+
+        def fetch(page):
+            params = {"page": page, "per_page": per_page}
+            params.update(extra)
+            return conn.get(url_path, params)
+
+        pool = util.thread_pool(prefetch) if prefetch else None
+        pending = deque()
+        next_page = 1
+        try:
+            while True:
+                if pool is None:
+                    cmdjson = fetch(next_page)
+                    next_page += 1
+                else:
+                    while len(pending) <= prefetch:
+                        pending.append(pool.apply_async(fetch, (next_page,)))
+                        next_page += 1
+                    cmdjson = pending.popleft().get()
+                commands = cmdjson.get("commands") or []
+                for cmd in commands:
+                    yield command_class(cmd.get("command_type"))(select_fields(cmd, fields))
+                paging_info = cmdjson.get("paging_info") or {}
+                if "next_page" in paging_info:
+                    # The server may return fewer than `per_page` instances
+                    # per page, so only paging_info tells the last page
+                    if paging_info["next_page"] is None or not commands:
+                        return
+                elif len(commands) < per_page:
+                    return
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
 
     def rerun(self, instance_id):
         conn = Qubole.agent()
-        url_path = self.element_path(id) + "/instances/" + instance_id + "/rerun"
+        url_path = self.element_path(self.id) + "/instances/" + str(instance_id) + "/rerun"
         return conn.post(url_path)['status']
+
+    def select_instances(self, statuses=None, start=None, end=None, per_page=100):
+        """
+        Lazily yields the instances of this schedule with one of the
+        `statuses` (all by default) and a nominal time in [`start`, `end`).
+        Times are timestamps or strings such as "2015-01-31" or
+        "2015-01-31T10:00Z".
+        """
+        start = parse_time(start)
+        end = parse_time(end)
+        for cmd in self.iter_instances(per_page=per_page):
+            if statuses and cmd.attributes.get("status") not in statuses:
+                continue
+            if start is not None or end is not None:
+                nominal = parse_time(cmd.attributes.get("nominal_time") or
+                                     cmd.attributes.get("created_at"))
+                if nominal is None or (start is not None and nominal < start) or \
+                        (end is not None and nominal >= end):
+                    continue
+            yield cmd
+
+    def backfill(self, statuses=None, start=None, end=None, concurrency=4, rate=None,
+                 wait=False, timeout=None, interval=None, progress=None, dry_run=False):
+        """
+        Reruns the instances selected as by `select_instances`.
+
+        Args:
+            `concurrency`: number of reruns requested in parallel
+
+            `rate`: most reruns requested per second
+
+            `wait`: wait until the rerun commands are done, polling them
+                in batches
+
+            `timeout`: secs to wait for, with `wait`
+
+            `interval`: secs between two rounds of polls, with `wait`
+
+            `progress`: called with a BackfillProgress after every rerun
+                and every round of polls
+
+            `dry_run`: only select the instances
+
+        Returns:
+            a list of BackfillOutcome, one per instance selected
+        """
+        instances = list(self.select_instances(statuses, start, end))
+        outcomes = [BackfillOutcome(i, None, i.attributes.get("status"), None)
+                    for i in instances]
+        if dry_run or not instances:
+            return outcomes
+
+        began = time.time()
+
+        def report(stage, done):
+            if progress is not None:
+                elapsed = time.time() - began
+                progress(BackfillProgress(stage, done, len(instances), elapsed,
+                                          done / elapsed if elapsed else None))
+
+        limiter = util.RateLimiter(rate)
+
+        def rerun(index):
+            limiter.wait()
+            return self.rerun(instances[index].id)
+
+        done = 0
+        for index, response, error in util.run_concurrently(
+                rerun, range(len(instances)), concurrency):
+            if error is not None:
+                log.warning("Could not rerun instance %s: %s" % (instances[index].id, error))
+            outcomes[index] = outcomes[index]._replace(response=response, error=error,
+                                                       status=None if error is None else
+                                                       outcomes[index].status)
+            done += 1
+            report("rerun", done)
+
+        if wait:
+            waiting = dict((o.instance.id, index) for index, o in enumerate(outcomes)
+                           if o.error is None)
+            # The rerun response names no command, and the instance shows
+            # its old status until the rerun starts
+            previous = dict((id, instances[index].attributes.get("status"))
+                            for id, index in waiting.items())
+            commands = Command.wait_many(list(waiting), concurrency, timeout, interval,
+                                         lambda done, total: report("wait", done),
+                                         previous)
+            for id, index in waiting.items():
+                cmd = commands.get(id)
+                if isinstance(cmd, Exception):
+                    outcomes[index] = outcomes[index]._replace(error=cmd)
+                    continue
+                if cmd is None:
+                    outcomes[index] = outcomes[index]._replace(error=WaitTimeout(
+                        "Instance %s was not rerun within %s seconds" % (id, timeout)))
+                    continue
+                outcomes[index] = outcomes[index]._replace(status=cmd.status)
+                if not Command.is_done(cmd.status):
+                    outcomes[index] = outcomes[index]._replace(error=WaitTimeout(
+                        "Instance %s was not done within %s seconds" % (id, timeout)))
+        return outcomes
@@ -1,5 +1,8 @@
 import re
+import time
+import calendar
 import optparse
+import threading
 
 
 class OptionParsingError(RuntimeError):
@@ -21,6 +24,134 @@ class GentleOptionParser(optparse.OptionParser):
         raise OptionParsingExit(status, msg)
 
 
+class lazy_class_property(object):
+    """
+    Class-level property which is computed on first access and then cached
+    on the class. Used to defer building option parsers until they are
+    actually needed, so that importing a module stays cheap.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.__doc__ = builder.__doc__
+        self.__name__ = builder.__name__
+
+    def __get__(self, obj, cls):
+        if cls is None:
+            cls = type(obj)
+        value = self.builder(cls)
+        setattr(cls, self.__name__, value)
+        return value
+
+
+def thread_pool(size):
+    """
+    Returns:
+        a pool of `size` threads, for calls sharing the pooled connection
+        to QDS
+    """
+    # Only threads are used, so importing the pool is cheap
+    from multiprocessing.pool import ThreadPool
+    return ThreadPool(max(1, size))
+
+
+def run_concurrently(func, items, concurrency, pool=None):
+    """
+    Calls `func` on every item of `items` from a pool of `concurrency`
+    threads, or from `pool` if one is given (it is left running).
+
+    Returns:
+        a generator of (item, result, exception) tuples in the order the
+        calls finish; exception is None if the call succeeded. Closing the
+        generator early stops the remaining calls.
+    """
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    items = list(items)
+    if not items:
+        return
+    own_pool = pool is None
+    if own_pool:
+        pool = thread_pool(min(concurrency, len(items)))
+    try:
+        for outcome in pool.imap_unordered(call, items):
+            yield outcome
+    finally:
+        if own_pool:
+            pool.terminate()
+            pool.join()
+
+
+def iter_pages(fetch, key, per_page):
+    """
+    Returns:
+        a generator of the records of every page of a paginated listing,
+        one list per page. `fetch(page)` returns the response for a page,
+        with its records under `key`. The `paging_info` of the response
+        tells which page is the last when present, as the server may cap
+        `per_page`; otherwise the first short page is the last.
+    """
+    page = 1
+    while page is not None:
+        response = fetch(page)
+        records = response.get(key) or []
+        yield records
+        paging_info = response.get("paging_info") or {}
+        if "next_page" in paging_info:
+            page = paging_info["next_page"] if records else None
+        else:
+            page = page + 1 if len(records) >= per_page else None
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls made from many threads so that no more than `rate`
+    start in any second. A `rate` of None does not limit calls.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the next call is allowed
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def parse_time(value):
+    """
+    Returns:
+        the UTC timestamp, in secs since the epoch, given by a time string
+        of the API such as "2015-01-01T00:00Z" or "2015-01-01T00:00:00Z".
+        Numbers are returned as they are, and None if `value` is empty.
+    """
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    value = value.rstrip("Z").split(".")[0].split("+")[0]
+    for format in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value, format))
+        except ValueError:
+            continue
+    raise ValueError("Unknown time format: %s" % value)
+
+
 # Patterns blatently stolen from Rails' Inflector
 PLURALIZE_PATTERNS = [
     (r'(quiz)$', r'\1zes'),
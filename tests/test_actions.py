@@ -1,6 +1,8 @@
 from __future__ import print_function
 import sys
 import os
+import shutil
+import tempfile
 
 if sys.version_info > (2, 7, 0):
     import unittest
@@ -12,6 +14,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../bin'))
 import qds
 from qds_sdk.connection import Connection
 from qds_sdk.resource import BaseResource
+from qds_sdk.actions import Action
+from qds_sdk.commands import HiveCommand
+from qds_sdk.exception import ServerError
 from test_base import print_command
 from test_base import QdsCliTestCase
 
@@ -70,7 +75,7 @@ class TestActionCheck(QdsCliTestCase):
         Connection._api_call = Mock(return_value={'id': 1, 'sequence_id': 2})
         qds.main()
         Connection._api_call.assert_called_with("GET", "actions/123",
-                                                params=None)
+                                                params={'fields': 'id,sequence_id'})
 
     def test_rerun(self):
         sys.argv = ['qds.py', 'action', 'rerun', '123']
@@ -112,5 +117,153 @@ class TestActionCheck(QdsCliTestCase):
              call("GET", "commands/123/results", params={'inline': True})])
 
 
+class TestActionStreaming(QdsCliTestCase):
+    def setUp(self):
+        super(TestActionStreaming, self).setUp()
+        self.actions = [
+            {"id": 123, "status": "waiting", "command": None},
+            {"id": 123, "status": "running",
+             "command": {"id": 7, "command_type": "HiveCommand", "status": "running",
+                         "meta_data": {"results_resource": "commands/7/results"}}}]
+        self.commands = [{"id": 7, "command_type": "HiveCommand", "status": "running"},
+                         {"id": 7, "command_type": "HiveCommand", "status": "done"}]
+        self.logs = ["", "line 1\n", "line 1\nline 2\n"]
+
+        def api_call(method, path, data=None, params=None):
+            if path == "actions/123":
+                return self.actions.pop(0) if len(self.actions) > 1 else self.actions[0]
+            if path == "commands/7":
+                return self.commands.pop(0) if len(self.commands) > 1 else self.commands[0]
+            if path == "commands/7/results":
+                return {"results": "a\tb\n", "inline": True}
+            raise AssertionError(path)
+        Connection._api_call = Mock(side_effect=api_call)
+        Connection._api_call_raw = Mock(side_effect=lambda method, path, params=None: Mock(
+            text=self.logs.pop(0) if len(self.logs) > 1 else self.logs[0]))
+
+    def test_iter_logs(self):
+        with patch("time.sleep") as sleep:
+            action = Action.find(123)
+            chunks = list(action.iter_logs(interval=5))
+        # The log is fetched once more after the command is done
+        self.assertEqual(chunks, ["line 1\n", "line 2\n"])
+        sleep.assert_called_with(5)
+        Connection._api_call_raw.assert_called_with("GET", "commands/7/logs", params=None)
+        self.assertEqual(Connection._api_call_raw.call_count, 3)
+
+    def test_iter_logs_no_command(self):
+        self.actions = [{"id": 123, "status": "cancelled", "command": None}]
+        self.assertEqual(list(Action.find(123).iter_logs()), [])
+        self.assertEqual(list(Action.find(123).iter_results()), [])
+        Connection._api_call_raw.assert_not_called()
+
+    def test_iter_results(self):
+        self.actions.pop(0)
+        self.assertEqual(b"".join(Action.find(123).iter_results()), b"a\tb\n")
+
+    def test_iter_results_close(self):
+        def get_results(fp, inline=True, delim=None, fetch=True):
+            for i in range(100):
+                fp.write(b"%d\n" % i)
+        self.actions.pop(0)
+        with patch.object(HiveCommand, "get_results", side_effect=get_results):
+            chunks = Action.find(123).iter_results()
+            self.assertEqual(next(chunks), b"0\n")
+            chunks.close()
+
+    def test_cli(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "results.tsv")
+            self.actions.pop(0)
+            sys.argv = ['qds.py', 'action', 'results', '123', '--output', path]
+            print_command()
+            qds.main()
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"a\tb\n")
+        finally:
+            shutil.rmtree(directory)
+
+        sys.argv = ['qds.py', 'action', 'logs', '123', '--follow']
+        print_command()
+        with patch("time.sleep"):
+            qds.main()
+        self.assertEqual(Connection._api_call_raw.call_count, 3)
+
+
+class TestActionBulk(QdsCliTestCase):
+    def setUp(self):
+        super(TestActionBulk, self).setUp()
+        self.actions = [
+            {"id": 4, "periodic_job_id": 1, "status": "error", "nominal_time": "2015-01-04T00:00Z"},
+            {"id": 3, "periodic_job_id": 2, "status": "error", "nominal_time": "2015-01-03T00:00Z"},
+            {"id": 2, "periodic_job_id": 1, "status": "done", "nominal_time": "2015-01-02T00:00Z"},
+            {"id": 1, "periodic_job_id": 1, "status": "error", "nominal_time": "2015-01-01T00:00Z"}]
+
+        def api_call(method, path, data=None, params=None):
+            if path == "actions":
+                page, per_page = int(params["page"]), int(params["per_page"])
+                return {"actions": self.actions[(page - 1) * per_page:page * per_page]}
+            if path == "actions/3/rerun":
+                raise ServerError(Mock(status_code=500, url=path))
+            return {"status": "ok"}
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def test_select(self):
+        self.assertEqual([a.id for a in Action.select(["error"], per_page=3)], [4, 3, 1])
+        self.assertEqual([a.id for a in Action.select(scheduler_id=1, start="2015-01-02")],
+                         [4, 2])
+        self.assertEqual([a.id for a in Action.select(["error"], end="2015-01-03")], [1])
+
+    def test_select_capped_per_page(self):
+        # The server returns at most 2 actions per page, with paging_info
+        def api_call(method, path, data=None, params=None):
+            page = int(params["page"])
+            return {"actions": self.actions[(page - 1) * 2:page * 2],
+                    "paging_info": {"next_page": page + 1 if page < 2 else None}}
+        Connection._api_call = Mock(side_effect=api_call)
+        self.assertEqual([a.id for a in Action.select(["error"])], [4, 3, 1])
+        self.assertEqual(Connection._api_call.call_count, 2)
+
+    def test_rerun_many(self):
+        outcomes = Action.rerun_many([4, 3, 1], concurrency=2, rate=100)
+        self.assertEqual([(o.action, o.response) for o in outcomes],
+                         [(4, {"status": "ok"}), (3, None), (1, {"status": "ok"})])
+        self.assertIsInstance(outcomes[1].error, ServerError)
+        Connection._api_call.assert_any_call("POST", "actions/1/rerun", None)
+
+    def test_kill_many(self):
+        outcomes = Action.kill_many(["3", "4"])
+        self.assertEqual([o.error for o in outcomes], [None, None])
+        Connection._api_call.assert_any_call("PUT", "actions/3/kill", None)
+        Connection._api_call.assert_any_call("PUT", "actions/4/kill", None)
+
+    def test_cli(self):
+        sys.argv = ['qds.py', 'action', 'bulk-rerun', '--status', 'error', '--schedule', '1']
+        print_command()
+        self.assertEqual(qds.main(), 0)
+        Connection._api_call.assert_any_call("POST", "actions/4/rerun", None)
+        Connection._api_call.assert_any_call("POST", "actions/1/rerun", None)
+        self.assertEqual(Connection._api_call.call_count, 3)
+
+        sys.argv = ['qds.py', 'action', 'bulk-rerun', '3', '4']
+        print_command()
+        self.assertEqual(qds.main(), 1)
+
+        sys.argv = ['qds.py', 'action', 'bulk-kill', '--status', 'error', '--dry-run']
+        print_command()
+        Connection._api_call.reset_mock()
+        qds.main()
+        for args, kwargs in Connection._api_call.call_args_list:
+            self.assertEqual(args[0], "GET")
+
+    def test_cli_arguments(self):
+        for argv in (['bulk-kill'], ['bulk-kill', '3', '--status', 'error']):
+            sys.argv = ['qds.py', 'action'] + argv
+            print_command()
+            self.assertEqual(qds.run(sys.argv[1:]), 2)
+        Connection._api_call.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
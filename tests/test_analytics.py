@@ -0,0 +1,127 @@
+from __future__ import print_function
+import sys
+import os
+import shutil
+import tempfile
+import datetime
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from mock import Mock
+from qds_sdk.qubole import Qubole
+from qds_sdk.connection import Connection
+from qds_sdk.analytics import CommandStore, percentile
+from test_base import QdsCliTestCase
+
+ROWS = [
+    {"id": 1, "created_at": "2015-01-01T01:00:00Z", "command_type": "HiveCommand",
+     "status": "done", "label": "etl", "command_summary": "select a", "runtime": 10,
+     "fs_bytes_read": 100, "cpu": 1},
+    {"id": 2, "created_at": "2015-01-01T02:00:00Z", "command_type": "HiveCommand",
+     "status": "error", "label": "etl", "command_summary": "select b", "runtime": 30,
+     "fs_bytes_read": 500, "cpu": 2},
+    {"id": 3, "created_at": "2015-01-02T01:00:00Z", "command_type": "HiveCommand",
+     "status": "done", "label": "adhoc", "command_summary": "select a", "runtime": 20,
+     "fs_bytes_read": 450, "cpu": 3},
+    {"id": 4, "created_at": "2015-01-02T02:00:00Z", "command_type": "PrestoCommand",
+     "status": "done", "label": "adhoc", "command_summary": "select c", "runtime": 5,
+     "fs_bytes_read": 50},
+]
+
+
+class TestCommandStore(unittest.TestCase):
+    def setUp(self):
+        self.store = CommandStore()
+        self.store.ingest(ROWS)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertEqual(percentile([10, 20], 95), 19.5)
+        self.assertIsNone(percentile([], 50))
+
+    def test_ingest(self):
+        self.assertEqual(self.store.ingest(ROWS[2:] + [dict(ROWS[0], id=5)]), 1)
+        self.assertEqual(len(self.store), 5)
+        self.assertEqual(self.store.column("label"), ["etl", "etl", "adhoc", "adhoc", "etl"])
+        self.assertEqual(self.store.values["label"], ["etl", "adhoc"])
+
+    def test_percentiles(self):
+        self.assertEqual(self.store.percentiles("runtime"), {
+            "HiveCommand": [20, 29], "PrestoCommand": [5, 5]})
+        self.assertEqual(self.store.percentiles("runtime", by="label", q=(50,),
+                                                where={"status": "done"}),
+                         {"adhoc": [12.5], "etl": [10]})
+        # Missing values are left out
+        self.assertEqual(self.store.percentiles("cpu")["PrestoCommand"], [None, None])
+
+    def test_top(self):
+        self.assertEqual(self.store.top("fs_bytes_read", n=2),
+                         [("select a", 550), ("select b", 500)])
+        self.assertEqual(self.store.top("fs_bytes_read", where={"label": ["etl"]}),
+                         [("select b", 500), ("select a", 100)])
+
+    def test_failure_rate(self):
+        self.assertEqual(self.store.failure_rate(), {"adhoc": 0, "etl": 0.5})
+
+    def test_save_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.assertEqual(len(CommandStore.load(directory)), 0)
+            self.store.save(os.path.join(directory, "store"))
+            store = CommandStore.load(os.path.join(directory, "store"))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.column("runtime"), [10, 30, 20, 5])
+        self.assertEqual(store.failure_rate(), self.store.failure_rate())
+        self.assertEqual(store.ingest(ROWS), 0)
+
+
+class TestCommandStoreSync(QdsCliTestCase):
+    def setUp(self):
+        super(TestCommandStoreSync, self).setUp()
+        Qubole.configure(api_token="dummy_token")
+
+        def api_call(method, path, data=None, params=None):
+            return {"commands": [r for r in ROWS
+                                 if params["start_date"] <= r["created_at"][:10] <
+                                 params["end_date"]][params["offset"]:]}
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def test_sync(self):
+        store = CommandStore()
+        self.assertEqual(store.sync(end_date="2015-01-02", days=3), 2)
+        Connection._api_call.assert_called_with("GET", "reports/all_commands", params={
+            "start_date": "2015-01-01", "end_date": "2015-01-02", "offset": 0, "limit": 1000})
+        Connection._api_call.reset_mock()
+        # From the day of the newest command
+        self.assertEqual(store.sync(end_date=datetime.date(2015, 1, 3)), 2)
+        self.assertEqual(Connection._api_call.call_count, 2)
+        self.assertEqual(store.column("id"), [1, 2, 3, 4])
+
+    def test_sync_unfinished(self):
+        ROWS[1].update(status="running", runtime=7)
+        try:
+            store = CommandStore()
+            store.sync(end_date="2015-01-03", days=2)
+            self.assertEqual(store.failure_rate()["etl"], 0)
+            # The command failed after the first sync
+            ROWS[1].update(status="error", runtime=30)
+            Connection._api_call.reset_mock()
+            self.assertEqual(store.sync(end_date="2015-01-03"), 1)
+        finally:
+            ROWS[1].update(status="error", runtime=30)
+        # From the day of the command which had not finished
+        Connection._api_call.assert_any_call("GET", "reports/all_commands", params={
+            "start_date": "2015-01-01", "end_date": "2015-01-02", "offset": 0, "limit": 1000})
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.column("status")[1], "error")
+        self.assertEqual(store.column("runtime")[1], 30)
+        self.assertEqual(store.failure_rate()["etl"], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
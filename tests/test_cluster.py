@@ -5,11 +5,14 @@ if sys.version_info > (2, 7, 0):
     import unittest
 else:
     import unittest2 as unittest
-from mock import Mock
+from mock import Mock, patch
 import tempfile
 sys.path.append(os.path.join(os.path.dirname(__file__), '../bin'))
 import qds
 from qds_sdk.connection import Connection
+from qds_sdk.qubole import Qubole
+from qds_sdk.cluster import Cluster, ClusterInfo, ClusterInfoV13
+from qds_sdk.exception import ResourceNotFound, WaitTimeout
 from test_base import print_command
 from test_base import QdsCliTestCase
 
@@ -42,28 +45,45 @@ class TestClusterList(QdsCliTestCase):
         print_command()
         Connection._api_call = Mock(return_value=[])
         qds.main()
-        Connection._api_call.assert_called_with("GET", "clusters", params=None)
+        Connection._api_call.assert_called_with("GET", "clusters", params={'state': 'up'})
 
     def test_state_down(self):
         sys.argv = ['qds.py', 'cluster', 'list', '--state', 'down']
         print_command()
         Connection._api_call = Mock(return_value=[])
         qds.main()
-        Connection._api_call.assert_called_with("GET", "clusters", params=None)
+        Connection._api_call.assert_called_with("GET", "clusters", params={'state': 'down'})
 
     def test_state_pending(self):
         sys.argv = ['qds.py', 'cluster', 'list', '--state', 'pending']
         print_command()
         Connection._api_call = Mock(return_value=[])
         qds.main()
-        Connection._api_call.assert_called_with("GET", "clusters", params=None)
+        Connection._api_call.assert_called_with("GET", "clusters", params={'state': 'pending'})
 
     def test_state_terminating(self):
         sys.argv = ['qds.py', 'cluster', 'list', '--state', 'terminating']
         print_command()
         Connection._api_call = Mock(return_value=[])
         qds.main()
-        Connection._api_call.assert_called_with("GET", "clusters", params=None)
+        Connection._api_call.assert_called_with("GET", "clusters", params={'state': 'terminating'})
+
+    def test_state_filtered_locally(self):
+        Connection._api_call = Mock(return_value=[
+            {"cluster": {"id": 1, "state": "UP"}},
+            {"cluster": {"id": 2, "state": "DOWN"}}])
+        self.assertEqual(Cluster.list(state="up"), [{"cluster": {"id": 1, "state": "UP"}}])
+
+    def test_fields(self):
+        sys.argv = ['qds.py', 'cluster', 'list', '--fields', 'id', 'label']
+        print_command()
+        Connection._api_call = Mock(return_value=[
+            {"cluster": {"id": 1, "label": ["default"], "state": "UP"}}])
+        qds.main()
+        Connection._api_call.assert_called_with("GET", "clusters",
+                                                params={'fields': 'id,label'})
+        self.assertEqual(Cluster.list(fields=["id", "label"]),
+                         [{"cluster": {"id": 1, "label": ["default"]}}])
 
     def test_state_invalid(self):
         sys.argv = ['qds.py', 'cluster', 'list', '--state', 'invalid']
@@ -2197,5 +2217,255 @@ class TestClusterManageCommands(QdsCliTestCase):
         with self.assertRaises(SystemExit):
             qds.main()
 
+class TestClusterWatch(QdsCliTestCase):
+    def setUp(self):
+        super(TestClusterWatch, self).setUp()
+        self.states = {"etl": ["DOWN", "PENDING", "PENDING", "UP"],
+                       "adhoc": ["UP"]}
+
+        def api_call(method, path, params=None):
+            label = path.split("/")[1]
+            if label not in self.states:
+                raise ResourceNotFound(Mock(text="not found"))
+            states = self.states[label]
+            return {"state": states.pop(0) if len(states) > 1 else states[0]}
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def test_watch(self):
+        events = list(Cluster.watch(["etl", "adhoc", "etl"], states=["up"],
+                                    interval=0.001))
+        self.assertEqual([(e.cluster, e.previous, e.state) for e in events
+                          if e.cluster == "etl"],
+                         [("etl", None, "DOWN"), ("etl", "DOWN", "PENDING"),
+                          ("etl", "PENDING", "UP")])
+        self.assertEqual([(e.cluster, e.previous, e.state) for e in events
+                          if e.cluster == "adhoc"], [("adhoc", None, "UP")])
+        self.assertEqual(Connection._api_call.call_count, 5)
+
+    def test_watch_timeout(self):
+        events = list(Cluster.watch(["adhoc"], timeout=0.05, interval=0.001,
+                                    max_interval=0.01))
+        self.assertEqual(len(events), 1)
+        self.assertTrue(Connection._api_call.call_count > 2)
+
+    def test_wait_until(self):
+        event = Cluster.wait_until("etl", "up", interval=0.001)
+        self.assertEqual((event.previous, event.state), ("PENDING", "UP"))
+
+    def test_wait_until_timeout(self):
+        with self.assertRaises(WaitTimeout):
+            Cluster.wait_until("adhoc", "down", timeout=0.02, interval=0.001)
+
+    def test_wait_until_not_found(self):
+        with self.assertRaises(ResourceNotFound):
+            Cluster.wait_until("missing", "up", interval=0.001)
+
+
+class TestClusterStartTerminateMany(QdsCliTestCase):
+    def setUp(self):
+        super(TestClusterStartTerminateMany, self).setUp()
+        self.states = {"etl": "DOWN", "adhoc": "DOWN", "1": "UP", "2": "DOWN"}
+
+        def api_call(method, path, params=None):
+            if path == "clusters":
+                return [{"cluster": {"id": 1, "state": "UP"}},
+                        {"cluster": {"id": 2, "state": "DOWN"}}]
+            label = path.split("/")[1]
+            if label not in self.states:
+                raise ResourceNotFound(Mock(text="not found"))
+            if method == "PUT":
+                self.states[label] = "UP" if params == "start" else "DOWN"
+                return {"state": "PENDING"}
+            return {"state": self.states[label]}
+        Connection._api_call = Mock(side_effect=lambda method, path, data=None, params=None:
+                                    api_call(method, path, (data or {}).get("state")))
+
+    def test_start_many(self):
+        outcomes = Cluster.start_many(["etl", "adhoc", "missing"], wait=True,
+                                      timeout=5, concurrency=2)
+        self.assertEqual(outcomes["etl"].response, {"state": "PENDING"})
+        self.assertEqual(outcomes["etl"].state, "UP")
+        self.assertIsNone(outcomes["adhoc"].error)
+        self.assertIsInstance(outcomes["missing"].error, ResourceNotFound)
+        self.assertIsNone(outcomes["missing"].state)
+
+    def test_terminate_many_filters(self):
+        outcomes = Cluster.terminate_many(state="up")
+        self.assertEqual(list(outcomes), ["1"])
+        Connection._api_call.assert_any_call("GET", "clusters",
+                                             params={"state": "up", "fields": "id,state"})
+        Connection._api_call.assert_called_with("PUT", "clusters/1/state",
+                                                {"state": "terminate"})
+        self.assertIsNone(outcomes["1"].state)
+
+    def test_terminate_many_unchecked_filter(self):
+        # The API ignores the label filter and only returns the id
+        Connection._api_call = Mock(return_value=[{"cluster": {"id": 1}},
+                                                  {"cluster": {"id": 2}}])
+        with self.assertRaises(ValueError):
+            Cluster.terminate_many(label="etl")
+        Connection._api_call.assert_called_once_with(
+            "GET", "clusters", params={"label": "etl", "fields": "id,label"})
+        sys.argv = ['qds.py', 'cluster', 'terminate_many', '--filter', 'label=etl']
+        print_command()
+        self.assertEqual(qds.run(sys.argv[1:]), 1)
+        self.assertEqual(Connection._api_call.call_count, 2)
+
+    def test_cli(self):
+        sys.argv = ['qds.py', 'cluster', 'terminate_many', 'etl', 'missing']
+        print_command()
+        self.assertEqual(qds.main(), 1)
+        Connection._api_call.assert_any_call("PUT", "clusters/etl/state",
+                                             {"state": "terminate"})
+
+    def test_cli_requires_selection(self):
+        sys.argv = ['qds.py', 'cluster', 'start_many', '--wait']
+        print_command()
+        with self.assertRaises(SystemExit):
+            qds.main()
+
+    def test_cli_filter(self):
+        sys.argv = ['qds.py', 'cluster', 'start_many', '--filter', 'state=down']
+        print_command()
+        self.assertEqual(qds.main(), 0)
+        Connection._api_call.assert_called_with("PUT", "clusters/2/state",
+                                                {"state": "start"})
+
+
+class TestClusterUpdateDiff(QdsCliTestCase):
+    def setUp(self):
+        super(TestClusterUpdateDiff, self).setUp()
+        Cluster._config_cache.clear()
+        self.current = {"id": 1, "label": ["etl"], "state": "DOWN",
+                        "ec2_settings": {"compute_validated": True,
+                                         "aws_region": "us-east-1"},
+                        "node_configuration": {"master_instance_type": "m1.large",
+                                               "slave_instance_type": "m1.xlarge",
+                                               "max_nodes": 4,
+                                               "stable_spot_instance_settings": {
+                                                   "allow_fallback": True}}}
+        Connection._api_call = Mock(side_effect=lambda method, path, data=None, params=None:
+                                    self.current if method == "GET" else {"id": 1})
+
+    def desired(self, **node_configuration):
+        cluster_info = ClusterInfoV13(["etl"])
+        cluster_info.set_cluster_info(aws_region="us-east-1",
+                                      master_instance_type="m1.large",
+                                      slave_instance_type="m1.xlarge",
+                                      **node_configuration)
+        return cluster_info
+
+    def test_no_changes(self):
+        self.assertIsNone(Cluster.update_diff("etl", self.desired(max_nodes=4)))
+        self.assertIsNone(Cluster.update_diff("etl", self.desired()))
+        Connection._api_call.assert_called_once_with("GET", "clusters/etl", params=None)
+
+    def test_changes(self):
+        Cluster.update_diff("etl", self.desired(max_nodes=8, initial_nodes=2))
+        Connection._api_call.assert_called_with(
+            "PUT", "clusters/etl",
+            {"node_configuration": {"max_nodes": 8, "initial_nodes": 2}})
+
+    def test_cache(self):
+        Cluster.diff("etl", {"ec2_settings": {"aws_region": "us-west-2"}})
+        Cluster.diff("etl", {"ec2_settings": {"aws_region": "us-west-2"}})
+        self.assertEqual(Connection._api_call.call_count, 1)
+        Cluster.diff("etl", {}, max_age=0)
+        self.assertEqual(Connection._api_call.call_count, 2)
+        Cluster.update_diff("etl", {"ec2_settings": {"aws_region": "us-west-2"}})
+        Cluster.diff("etl", {})
+        self.assertEqual(Connection._api_call.call_count, 4)
+
+    def test_cache_invalidation(self):
+        Qubole.configure(api_token="dummy_token")
+        Cluster.current_config("etl")
+        Cluster.current_config(1)
+        Qubole.configure(api_token="other_token")
+        Cluster.current_config("etl")
+        self.assertEqual(Connection._api_call.call_count, 3)
+        Qubole.configure(api_token="dummy_token")
+        Cluster.update(1, {"node_configuration": {"max_nodes": 8}})
+        self.assertEqual(list(Cluster._config_cache),
+                         [(Qubole.base_url, "other_token", "etl")])
+        Cluster.current_config("etl")
+        Cluster.delete("etl")
+        self.assertEqual(list(Cluster._config_cache),
+                         [(Qubole.base_url, "other_token", "etl")])
+
+    def test_v12_payload(self):
+        self.current = {"cluster": {"id": 1, "label": ["etl"],
+                                    "hadoop_settings": {"max_nodes": 4}}}
+        cluster_info = ClusterInfo(["etl"], "key", "secret")
+        cluster_info.set_hadoop_settings(max_nodes=4)
+        self.assertEqual(Cluster.diff("etl", cluster_info),
+                         {"cluster": {"ec2_settings": {"compute_access_key": "key",
+                                                       "compute_secret_key": "secret"}}})
+
+
+class TestClusterNodeMany(QdsCliTestCase):
+    def setUp(self):
+        super(TestClusterNodeMany, self).setUp()
+        self.polls = {}
+
+        def api_call(method, path, data=None, params=None):
+            if path.startswith("commands/"):
+                id = int(path.split("/")[1])
+                self.polls[id] = self.polls.get(id, 0) + 1
+                return {"id": id, "status": "done" if self.polls[id] > 1 else "running"}
+            if path.split("/")[1] == "missing":
+                raise ResourceNotFound(Mock(text="not found"))
+            id = 100 + len([c for c in Connection._api_call.call_args_list
+                            if c[0][1].endswith("/nodes")])
+            return {"id": id, "status": "waiting"}
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def test_add_nodes(self):
+        outcomes = Cluster.add_nodes({"etl": 2, "missing": 1}, concurrency=2)
+        self.assertEqual(len(outcomes), 3)
+        self.assertEqual(sorted(o.response["id"] for o in outcomes[:2]), [101, 102])
+        self.assertEqual(outcomes[0].status, "waiting")
+        self.assertIsInstance(outcomes[2].error, ResourceNotFound)
+        Connection._api_call.assert_any_call("POST", "clusters/etl/nodes",
+                                             {"parameters": {}})
+
+    @patch("time.sleep")
+    def test_remove_nodes_wait(self, sleep):
+        outcomes = Cluster.remove_nodes({"etl": ["ip-1", "ip-2"]}, wait=True, interval=1)
+        self.assertEqual([o.node for o in outcomes], ["ip-1", "ip-2"])
+        self.assertEqual([o.status for o in outcomes], ["done", "done"])
+        self.assertEqual(sleep.call_count, 1)
+        Connection._api_call.assert_any_call("DELETE", "clusters/etl/nodes",
+                                             {"private_dns": "ip-2", "parameters": {}})
+
+    @patch("time.sleep")
+    def test_update_nodes_timeout(self, sleep):
+        outcomes = Cluster.update_nodes({"etl": ["ip-1"]}, "replace", wait=True,
+                                        timeout=0.5, interval=1)
+        self.assertEqual(outcomes[0].status, "running")
+        self.assertIsInstance(outcomes[0].error, WaitTimeout)
+        Connection._api_call.assert_any_call("PUT", "clusters/etl/nodes",
+                                             {"command": "replace", "private_dns": "ip-1",
+                                              "parameters": {}})
+
+    @patch("time.sleep")
+    def test_rate(self, sleep):
+        Cluster.add_nodes({"etl": 3}, concurrency=1, rate=2)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertTrue(all(0.4 < c[0][0] <= 1 for c in sleep.call_args_list))
+
+    def test_cli(self):
+        sys.argv = ['qds.py', 'cluster', 'remove_nodes', '--label', 'etl',
+                    '--private_dns', 'ip-1', 'ip-2', '--rate', '100']
+        print_command()
+        self.assertEqual(qds.main(), 0)
+        self.assertEqual(Connection._api_call.call_count, 2)
+
+    def test_cli_count(self):
+        sys.argv = ['qds.py', 'cluster', 'add_nodes', '--id', '1', '--count', '0']
+        print_command()
+        with self.assertRaises(SystemExit):
+            qds.main()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,124 @@
+from __future__ import print_function
+import sys
+import os
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from mock import Mock
+sys.path.append(os.path.join(os.path.dirname(__file__), '../bin'))
+import qds
+from qds_sdk.connection import Connection
+from qds_sdk.cluster import Cluster, ClusterInfo, ClusterInfoV13
+from qds_sdk.cluster_schema import validate_payload
+from qds_sdk.exception import ValidationError
+from test_base import print_command
+from test_base import QdsCliTestCase
+
+
+class TestValidatePayload(unittest.TestCase):
+    def test_valid(self):
+        cluster_info = ClusterInfoV13(["etl"])
+        cluster_info.set_cluster_info(aws_region="us-east-1", initial_nodes=2, max_nodes=10,
+                                      slave_request_type="hybrid",
+                                      maximum_spot_instance_percentage=50,
+                                      ebs_volume_count=2, ebs_volume_type="gp2",
+                                      ebs_volume_size=2000, enable_presto=True,
+                                      custom_ec2_tags='{"team": "data"}')
+        self.assertEqual(Cluster.validate(cluster_info, "create"), [])
+
+    def test_all_errors(self):
+        errors = validate_payload({
+            "label": [],
+            "disallow_cluster_termination": "yes",
+            "ec2_settings": {"aws_region": "mars-1"},
+            "hadoop_settings": {"custom_ec2_tags": {"team": 1}, "unknown": 1},
+            "node_configuration": {"initial_nodes": 5, "max_nodes": 2,
+                                   "slave_request_type": "ondemand",
+                                   "fallback_to_ondemand": True,
+                                   "spot_instance_settings": {
+                                       "maximum_spot_instance_percentage": 120},
+                                   "ebs_volume_count": True,
+                                   "ebs_volume_size": 2000},
+            "presto_settings": {"enable_presto": 1}}, "create")
+        self.assertEqual(sorted(errors), sorted([
+            "label must be a non-empty list of labels, not []",
+            "disallow_cluster_termination must be a boolean, not 'yes'",
+            "ec2_settings.aws_region must be one of us-east-1, us-west-2, ap-northeast-1, "
+            "sa-east-1, eu-west-1, ap-southeast-1, us-west-1, not 'mars-1'",
+            "hadoop_settings.custom_ec2_tags.team must be a string, not 1",
+            "node_configuration.spot_instance_settings.maximum_spot_instance_percentage "
+            "must be at most 100, not 120",
+            "node_configuration.ebs_volume_count must be an integer, not True",
+            "node_configuration.initial_nodes (5) cannot be more than max_nodes (2)",
+            "node_configuration.spot_instance_settings are only valid when "
+            "slave_request_type is spot or hybrid",
+            "node_configuration.spot_instance_settings.maximum_spot_instance_percentage "
+            "is only valid when slave_request_type is hybrid",
+            "node_configuration.fallback_to_ondemand is only valid when "
+            "slave_request_type is spot",
+            "node_configuration.ebs_volume_size must be between 1 and 1024 GB for "
+            "standard volumes, not 2000",
+            "presto_settings.enable_presto must be a boolean, not 1"]))
+
+    def test_v12(self):
+        cluster_info = ClusterInfo("etl", "key", "secret")
+        cluster_info.set_hadoop_settings(initial_nodes=3, max_nodes=2)
+        self.assertEqual(Cluster.validate(cluster_info), [
+            "cluster.hadoop_settings.initial_nodes (3) cannot be more than max_nodes (2)"])
+
+    def test_ebs_type_unknown(self):
+        # The volume type of an existing cluster is not in the payload
+        payload = {"node_configuration": {"ebs_volume_size": 2000}}
+        self.assertEqual(validate_payload(payload, "update"), [])
+        self.assertEqual(validate_payload(payload, "clone"), [])
+        self.assertEqual(validate_payload(dict(payload, label=["etl"]), "create"), [
+            "node_configuration.ebs_volume_size must be between 1 and 1024 GB for "
+            "standard volumes, not 2000"])
+
+    def test_label_required(self):
+        self.assertEqual(validate_payload({}, "update"), [])
+        self.assertEqual(validate_payload({}, "create"),
+                         ["label is required to create a cluster"])
+        self.assertEqual(validate_payload({"cluster": {}}, "create"),
+                         ["label is required to create a cluster"])
+
+
+class TestClusterValidation(QdsCliTestCase):
+    def setUp(self):
+        super(TestClusterValidation, self).setUp()
+        Connection._api_call = Mock(return_value={})
+
+    def test_create(self):
+        with self.assertRaises(ValidationError) as context:
+            Cluster.create({"node_configuration": {"max_nodes": 0}}, validate=True)
+        self.assertEqual(context.exception.errors, [
+            "node_configuration.max_nodes must be at least 1, not 0",
+            "label is required to create a cluster"])
+        Connection._api_call.assert_not_called()
+        Cluster.create({"node_configuration": {"max_nodes": 0}})
+        Connection._api_call.assert_called_once_with(
+            "POST", "clusters", {"node_configuration": {"max_nodes": 0}})
+
+    def test_cli(self):
+        sys.argv = ['qds.py', '--version', 'v1.3', 'cluster', 'update', '123',
+                    '--initial-nodes', '5', '--max-nodes', '2']
+        print_command()
+        with self.assertRaises(ValidationError):
+            qds.main()
+        self.assertEqual(qds.run(sys.argv[1:]), 1)
+        Connection._api_call.assert_not_called()
+
+    def test_cli_ebs_size_on_update(self):
+        sys.argv = ['qds.py', '--version', 'v1.3', 'cluster', 'update', '123',
+                    '--ebs-volume-size', '2000']
+        print_command()
+        qds.main()
+        Connection._api_call.assert_called_once_with(
+            "PUT", "clusters/123", {"node_configuration": {"ebs_volume_size": 2000}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,7 @@ from tempfile import NamedTemporaryFile
 sys.path.append(os.path.join(os.path.dirname(__file__), '../bin'))
 import qds
 import qds_sdk
+import qds_sdk.commands
 from qds_sdk.connection import Connection
 from test_base import print_command
 from test_base import QdsCliTestCase
@@ -1293,5 +1294,56 @@ class TestDbTapQueryCommand(QdsCliTestCase):
                                                  'can_notify': False})
 
 
+class PluginCommand(qds_sdk.commands.Command):
+    pass
+
+
+class TestCommandClassRegistry(unittest.TestCase):
+    def setUp(self):
+        self.saved = (dict(qds_sdk.commands._command_classes),
+                      qds_sdk.commands._builtin_classes_loaded)
+
+    def tearDown(self):
+        qds_sdk.commands._command_classes.clear()
+        qds_sdk.commands._command_classes.update(self.saved[0])
+        qds_sdk.commands._builtin_classes_loaded = self.saved[1]
+
+    def test_builtin(self):
+        from qds_sdk.commands import command_class, HiveCommand, DbexportCommand, Command
+        self.assertIs(command_class("HiveCommand"), HiveCommand)
+        self.assertIs(command_class("DbexportCommand"), DbexportCommand)
+        self.assertIs(command_class("SomeNewCommand"), Command)
+        self.assertIs(command_class(None), Command)
+
+    def test_register(self):
+        from qds_sdk.commands import command_class, register_command_class
+        register_command_class("PluginCommand", PluginCommand)
+        register_command_class("HiveCommand", PluginCommand)
+        self.assertIs(command_class("PluginCommand"), PluginCommand)
+        self.assertIs(command_class("HiveCommand"), PluginCommand)
+        with self.assertRaises(TypeError):
+            register_command_class("DictCommand", dict)
+
+    def test_lazy_loading(self):
+        from qds_sdk.commands import command_class, register_command_class, Command
+        register_command_class("LazyCommand", "test_command:PluginCommand")
+        register_command_class("BrokenCommand", "no_such_module:PluginCommand")
+        register_command_class("NotCommand", "collections:deque")
+        self.assertEqual(qds_sdk.commands._command_classes["LazyCommand"],
+                         "test_command:PluginCommand")
+        self.assertEqual(command_class("LazyCommand").__name__, "PluginCommand")
+        self.assertIs(command_class("BrokenCommand"), Command)
+        self.assertIs(command_class("NotCommand"), Command)
+
+    def test_action_command(self):
+        from qds_sdk.actions import Action
+        from qds_sdk.commands import Command, SparkCommand
+        action = Action({"id": 1, "command": {"id": 2, "command_type": "SparkCommand"}})
+        self.assertIsInstance(action.getcommand(), SparkCommand)
+        action = Action({"id": 1, "command": {"id": 2, "command_type": "SomeNewCommand"}})
+        self.assertIs(type(action.getcommand()), Command)
+        self.assertIsNone(Action({"id": 1, "command": None}).getcommand())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,171 @@
+from __future__ import print_function
+import sys
+import os
+import io
+import shutil
+import tempfile
+import threading
+import logging
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+from mock import Mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../bin'))
+import qds
+from qds_sdk.connection import Connection
+from qds_sdk.daemon import QdsDaemon, forward
+from test_base import QdsCliTestCase
+
+
+class DaemonTestCase(QdsCliTestCase):
+    def setUp(self):
+        super(DaemonTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "qds.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def start(self, handler, requests=1):
+        daemon = self.daemon = QdsDaemon(handler, self.path)
+        daemon.bind()
+
+        def serve():
+            for i in range(requests):
+                conn, _ = daemon.sock.accept()
+                try:
+                    daemon.handle(conn)
+                finally:
+                    conn.close()
+            daemon.close()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def forward(self, argv):
+        out, err = io.BytesIO(), io.BytesIO()
+        status = forward(argv, self.path, stdout=out, stderr=err)
+        return status, out.getvalue(), err.getvalue()
+
+
+class TestDaemonForward(DaemonTestCase):
+    def test_no_daemon(self):
+        self.assertIsNone(forward(["hivecmd", "check", "1"], self.path))
+
+    def test_stale_socket(self):
+        open(self.path, "w").close()
+        self.assertIsNone(forward(["hivecmd", "check", "1"], self.path))
+
+    def test_streams_and_status(self):
+        def handler(argv):
+            sys.stdout.write(" ".join(argv))
+            sys.stdout.buffer.write(b"\n")
+            sys.stderr.write("warning\n")
+            return 7
+
+        thread = self.start(handler)
+        status, out, err = self.forward(["a", "b"])
+        thread.join(5)
+        self.assertEqual(status, 7)
+        self.assertEqual(out, b"a b\n")
+        self.assertEqual(err, b"warning\n")
+
+    def test_system_exit(self):
+        def handler(argv):
+            sys.exit(2)
+
+        thread = self.start(handler)
+        status, out, err = self.forward([])
+        thread.join(5)
+        self.assertEqual(status, 2)
+
+    def test_forwards_environment(self):
+        os.environ['QDS_API_URL'] = 'https://example.com/api'
+
+        def handler(argv):
+            print(os.environ.get('QDS_API_URL'))
+            print(os.getcwd())
+
+        thread = self.start(handler)
+        try:
+            status, out, err = self.forward([])
+        finally:
+            del os.environ['QDS_API_URL']
+        thread.join(5)
+        self.assertEqual(status, 0)
+        self.assertEqual(out.decode("utf8").split(),
+                         ['https://example.com/api', os.getcwd()])
+
+    def test_busy(self):
+        handler = Mock(return_value=0)
+        thread = self.start(handler)
+        # As if another invocation was running
+        self.daemon._busy.acquire()
+        try:
+            self.assertIsNone(self.forward(["hivecmd", "check", "1"])[0])
+        finally:
+            self.daemon._busy.release()
+        thread.join(5)
+        handler.assert_not_called()
+
+    def test_already_running(self):
+        # The probe made by the second daemon is served as an empty request
+        thread = self.start(lambda argv: 0, requests=2)
+        with self.assertRaises(RuntimeError):
+            QdsDaemon(lambda argv: 0, self.path).bind()
+        self.assertEqual(self.forward([])[0], 0)
+        thread.join(5)
+
+
+class TestDaemonRunsCli(DaemonTestCase):
+    def test_check(self):
+        Connection._api_call = Mock(return_value={"id": 123})
+        thread = self.start(qds.run, requests=2)
+        status, out, err = self.forward(['hivecmd', 'check', '123'])
+        self.assertEqual(status, 0)
+        self.assertEqual(out, b'{"id": 123}\n')
+        status, out, err = self.forward(['hivecmd', 'check'])
+        thread.join(5)
+        self.assertEqual(status, 1)
+        self.assertIn(b"expecting single argument command id", err)
+        Connection._api_call.assert_called_once_with("GET", "commands/123",
+                                                     params=None)
+
+    def test_results_twice(self):
+        def api_call(method, path, data=None, params=None):
+            if path == "actions/1":
+                return {"id": 1, "command": {
+                    "id": 5, "command_type": "HiveCommand",
+                    "meta_data": {"results_resource": "commands/5/results"}}}
+            return {"inline": True, "results": "a\tb\n"}
+        Connection._api_call = Mock(side_effect=api_call)
+        thread = self.start(qds.run, requests=2)
+        # Output streams are resolved anew for every invocation
+        for i in range(2):
+            status, out, err = self.forward(['action', 'results', '1'])
+            self.assertEqual((status, out, err), (0, b"a\tb\n", b""))
+        thread.join(5)
+
+    def test_logging(self):
+        def api_call(method, path, data=None, params=None):
+            logging.getLogger("qds_connection").info("[%s] %s" % (method, path))
+            return {"id": 123}
+        Connection._api_call = Mock(side_effect=api_call)
+        root = logging.getLogger()
+        handlers, level = root.handlers[:], root.level
+        thread = self.start(qds.run, requests=2)
+        status, out, err = self.forward(['-v', 'hivecmd', 'check', '123'])
+        self.assertIn(b"INFO:qds_connection:[GET] commands/123", err)
+        status, out, err = self.forward(['hivecmd', 'check', '123'])
+        self.assertEqual(err, b"")
+        thread.join(5)
+        self.assertEqual((root.handlers, root.level), (handlers, level))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+from __future__ import print_function
+import sys
+import os
+import io
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from qds_sdk.connection import Connection
+from qds_sdk.qubole import Qubole
+from qds_sdk.fake_api import FakeQdsServer, FakeS3Server
+from qds_sdk.commands import Command, HiveCommand
+from qds_sdk.cluster import Cluster, ClusterInfoV13
+from qds_sdk.scheduler import Scheduler
+from qds_sdk.actions import Action
+from qds_sdk.report import Report
+from qds_sdk.exception import ResourceNotFound, RetryWithDelay, UnauthorizedAccess
+
+# Other tests replace these with mocks; these tests talk to a real server.
+_api_call = Connection._api_call
+_api_call_raw = Connection._api_call_raw
+
+
+class FakeApiTestCase(unittest.TestCase):
+    def setUp(self):
+        Connection._api_call = _api_call
+        Connection._api_call_raw = _api_call_raw
+        self.s3 = FakeS3Server().start()
+        self.api = FakeQdsServer(s3=self.s3, seed=1).start()
+        self.api.configure()
+
+    def tearDown(self):
+        self.api.stop()
+        self.s3.stop()
+
+
+class TestFakeCommands(FakeApiTestCase):
+    def test_lifecycle(self):
+        cmd = HiveCommand.create(query="show tables")
+        self.assertEqual(cmd.status, "waiting")
+        self.assertEqual(HiveCommand.find(cmd.id).status, "running")
+        self.assertEqual(HiveCommand.find(cmd.id).status, "done")
+        self.assertIn("log line", HiveCommand.get_log_id(cmd.id))
+
+    def test_cancel(self):
+        cmd = HiveCommand.create(query="show tables")
+        self.assertTrue(HiveCommand.cancel_id(cmd.id)["kill_succeeded"])
+        self.assertEqual(HiveCommand.find(cmd.id).status, "cancelled")
+
+    def test_not_found(self):
+        with self.assertRaises(ResourceNotFound):
+            HiveCommand.find(1000)
+
+    def test_inline_results(self):
+        cmd = HiveCommand.create(query="show tables", result_size=100)
+        out = io.BytesIO()
+        HiveCommand.find(cmd.id).get_results(out)
+        self.assertEqual(len(out.getvalue()), 100)
+        self.assertTrue(out.getvalue().startswith(b"row0\tvalue0\n"))
+
+    def test_s3_results(self):
+        self.api.inline_result_limit = 10
+        self.api.result_file_size = 300
+        cmd = HiveCommand.create(query="show tables", result_size=1000)
+        out = io.TextIOWrapper(io.BytesIO())
+        HiveCommand.find(cmd.id).get_results(out, delim=",")
+        out.flush()
+        data = out.buffer.getvalue()
+        self.assertEqual(len(data), 1000)
+        self.assertTrue(data.startswith(b"row0,value0\nrow1,value1\n"))
+        self.assertEqual(len(self.s3.buckets[FakeQdsServer.RESULTS_BUCKET]), 5)
+
+    def test_pushdown(self):
+        self.api.add_command(query="a", status="done")
+        self.api.add_command(query="b", status="error")
+        commands = Command.list(status="done", fields=["query"])
+        self.assertEqual([c.attributes for c in commands], [{"query": "a"}])
+
+    def test_pagination(self):
+        for i in range(5):
+            self.api.add_command(query="select %d" % i)
+        page = Qubole.agent().get("commands", {"page": 2, "per_page": 2})
+        self.assertEqual([c["query"] for c in page["commands"]],
+                         ["select 2", "select 1"])
+        self.assertEqual(page["paging_info"]["next_page"], 3)
+        self.assertEqual(page["paging_info"]["previous_page"], 1)
+
+
+class TestFakeClusters(FakeApiTestCase):
+    def test_start_terminate(self):
+        self.api.add_cluster("etl")
+        self.assertEqual(Cluster.list(state="down")[0]["cluster"]["label"], ["etl"])
+        self.assertEqual(Cluster.start("etl")["state"], "PENDING")
+        self.assertEqual(Cluster.status("etl")["state"], "PENDING")
+        self.assertEqual(Cluster.status("etl")["state"], "UP")
+        Cluster.terminate("etl")
+        Cluster.status("etl")
+        self.assertEqual(Cluster.status("etl")["state"], "DOWN")
+
+    def test_pushdown(self):
+        self.api.add_cluster("etl", state="UP")
+        self.api.add_cluster("adhoc")
+        self.assertEqual(Cluster.list(state="up", fields=["label"]),
+                         [{"cluster": {"label": ["etl"]}}])
+        self.assertEqual([c["cluster"]["label"] for c in Cluster.list(label="etl")],
+                         [["etl"]])
+
+    def test_terminate_many_by_label(self):
+        for label in ("etl", "adhoc", "default"):
+            self.api.add_cluster(label, state="UP")
+        outcomes = Cluster.terminate_many(label="etl")
+        self.assertEqual(len(outcomes), 1)
+        self.assertEqual(sorted(c["cluster"]["state"] for c in Cluster.list()),
+                         ["TERMINATING", "UP", "UP"])
+        self.assertEqual(Cluster.status("etl")["state"], "TERMINATING")
+
+    def test_update_diff_v13(self):
+        self.api.configure(version="v1.3")
+        self.api.add_cluster("etl", node_configuration={"max_nodes": 2})
+
+        def desired():
+            info = ClusterInfoV13(["etl"])
+            info.set_cluster_info(max_nodes=5, node_bootstrap_file="bootstrap.sh")
+            return info
+        self.assertEqual(Cluster.diff("etl", desired(), max_age=0), {
+            "node_bootstrap_file": "bootstrap.sh",
+            "node_configuration": {"max_nodes": 5,
+                                   "stable_spot_instance_settings": {"allow_fallback": True}}})
+        self.assertIsNotNone(Cluster.update_diff("etl", desired()))
+        self.assertIsNone(Cluster.update_diff("etl", desired()))
+        self.assertEqual(Cluster.diff("etl", desired(), max_age=0), {})
+
+    def test_create_update_delete(self):
+        cluster = Cluster.create({"cluster": {"label": ["adhoc"],
+                                              "hadoop_settings": {"max_nodes": 2}}})
+        Cluster.update("adhoc", {"hadoop_settings": {"initial_nodes": 1}})
+        shown = Cluster.show("adhoc")["cluster"]
+        self.assertEqual(shown["hadoop_settings"], {"max_nodes": 2, "initial_nodes": 1})
+        Cluster.delete(cluster["cluster"]["id"])
+        self.assertEqual(Cluster.list(), [])
+
+
+class TestFakeScheduler(FakeApiTestCase):
+    def test_schedule_instances_and_actions(self):
+        schedule = self.api.add_schedule("daily", num_instances=3)
+        self.assertEqual(Scheduler.find_by_name("daily").id, schedule["id"])
+        instances = Scheduler.find(schedule["id"]).list_instances()
+        self.assertEqual(len(instances), 3)
+        self.assertIsInstance(instances[0], HiveCommand)
+        actions = Action.list()
+        self.assertEqual(len(actions), 3)
+        self.assertEqual(Action.find(actions[0].id).status(), "done")
+
+    def test_backfill_delayed_rerun(self):
+        self.api.rerun_delay = 2
+        schedule = self.api.add_schedule("daily", num_instances=2, instance_status="error")
+        outcomes = Scheduler.find(schedule["id"]).backfill(["error"], wait=True,
+                                                           interval=0.01, timeout=10)
+        self.assertEqual([(o.status, o.error) for o in outcomes], [("done", None)] * 2)
+
+
+class TestFakeReports(FakeApiTestCase):
+    def test_all_commands(self):
+        self.api.report_rows_per_day = 4
+        data = {"start_date": "2015-01-01", "end_date": "2015-01-03", "limit": 100}
+        report = Report.show("all_commands", data)
+        self.assertEqual(len(report["commands"]), 8)
+        self.assertEqual(report, Report.show("all_commands", data))
+
+
+class TestFakeErrors(FakeApiTestCase):
+    def test_fail_next(self):
+        self.api.add_cluster("etl")
+        self.api.fail_next(503, method="PUT", path="clusters")
+        with self.assertRaises(RetryWithDelay):
+            Cluster.start("etl")
+        self.assertEqual(Cluster.start("etl")["state"], "PENDING")
+
+    def test_token(self):
+        self.api.api_token = "secret"
+        with self.assertRaises(UnauthorizedAccess):
+            Cluster.list()
+        self.api.configure(api_token="secret")
+        self.assertEqual(Cluster.list(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
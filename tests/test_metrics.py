@@ -0,0 +1,173 @@
+from __future__ import print_function
+import sys
+import os
+import io
+import json
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+from mock import patch
+
+from qds_sdk.connection import Connection, _endpoint
+from qds_sdk.qubole import Qubole
+from qds_sdk.metrics import (MetricsRegistry, PrometheusExporter,
+                             InMemorySpanExporter, JsonSpanExporter)
+from qds_sdk.fake_api import FakeQdsServer, FakeS3Server
+from qds_sdk.commands import HiveCommand
+from qds_sdk.cluster import Cluster
+from qds_sdk.exception import ResourceNotFound
+
+# Other tests replace these with mocks; these tests talk to a real server.
+_api_call = Connection._api_call
+_api_call_raw = Connection._api_call_raw
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counters(self):
+        self.registry.inc("qds_requests_total", {"method": "GET", "status": "200"})
+        self.registry.inc("qds_requests_total", {"status": "200", "method": "GET"}, 2)
+        self.registry.inc("qds_requests_total", {"method": "PUT", "status": "200"})
+        self.assertEqual(self.registry.value("qds_requests_total",
+                                             {"method": "GET", "status": "200"}), 3)
+        self.assertEqual(self.registry.total("qds_requests_total"), 4)
+        self.assertEqual(self.registry.total("qds_requests_total", method="PUT"), 1)
+        self.assertIsNone(self.registry.value("qds_requests_total"))
+
+    def test_histograms(self):
+        for value in (0.001, 0.2, 0.3, 1000):
+            self.registry.observe("qds_request_duration_seconds", value)
+        histogram = self.registry.value("qds_request_duration_seconds")
+        self.assertEqual(histogram["count"], 4)
+        self.assertAlmostEqual(histogram["sum"], 1000.501)
+        buckets = dict(histogram["buckets"])
+        self.assertEqual(buckets[0.005], 1)
+        self.assertEqual(buckets[0.25], 2)
+        self.assertEqual(buckets[0.5], 3)
+        self.assertEqual(buckets[300], 3)
+        self.assertEqual(buckets[float("inf")], 4)
+
+    def test_disabled(self):
+        self.registry.enabled = False
+        self.registry.inc("qds_requests_total")
+        self.assertEqual(self.registry.collect(), [])
+
+    def test_prometheus(self):
+        self.registry.inc("qds_requests_total", {"endpoint": "commands/:id", "status": "200"})
+        self.registry.observe("qds_command_polls", 3, {"command_type": "HiveCommand"})
+        text = PrometheusExporter(self.registry).render()
+        self.assertIn("# TYPE qds_requests_total counter\n"
+                      'qds_requests_total{endpoint="commands/:id",status="200"} 1\n', text)
+        self.assertIn('qds_command_polls_bucket{command_type="HiveCommand",le="2"} 0\n'
+                      'qds_command_polls_bucket{command_type="HiveCommand",le="5"} 1\n', text)
+        self.assertIn('qds_command_polls_bucket{command_type="HiveCommand",le="+Inf"} 1\n'
+                      'qds_command_polls_sum{command_type="HiveCommand"} 3.0\n'
+                      'qds_command_polls_count{command_type="HiveCommand"} 1\n', text)
+
+    def test_spans(self):
+        exporter = InMemorySpanExporter()
+        self.registry.add_exporter(exporter)
+        with self.registry.span("outer", {"a": 1}) as outer:
+            with self.assertRaises(ValueError):
+                with self.registry.span("inner"):
+                    raise ValueError("boom")
+        inner, outer = exporter.spans
+        self.assertEqual(inner.parent_id, outer.span_id)
+        self.assertEqual(inner.trace_id, outer.trace_id)
+        self.assertEqual(inner.status, "error")
+        self.assertEqual(inner.error, "ValueError: boom")
+        self.assertEqual(outer.status, "ok")
+        self.assertEqual(outer.attributes, {"a": 1})
+        self.assertTrue(outer.duration >= inner.duration)
+
+    def test_no_exporters(self):
+        with self.registry.span("outer") as span:
+            self.assertIsNone(span)
+
+    def test_json_exporter(self):
+        out = io.StringIO() if sys.version_info >= (3, 0, 0) else io.BytesIO()
+        self.registry.add_exporter(JsonSpanExporter(out))
+        with self.registry.span("qds.request", {"http.method": "GET"}):
+            pass
+        span = json.loads(out.getvalue())
+        self.assertEqual(span["name"], "qds.request")
+        self.assertEqual(span["status"], {"code": "ok", "message": None})
+        self.assertIsNone(span["parent_span_id"])
+        self.assertTrue(span["end_time_unix_nano"] >= span["start_time_unix_nano"])
+
+    def test_endpoint(self):
+        self.assertEqual(_endpoint("commands/123/results"), "commands/:id/results")
+        self.assertEqual(_endpoint("/clusters/etl/state"), "clusters/etl/state")
+        self.assertEqual(_endpoint("scheduler/12?page=2"), "scheduler/:id")
+
+
+class TestSdkMetrics(unittest.TestCase):
+    def setUp(self):
+        Connection._api_call = _api_call
+        Connection._api_call_raw = _api_call_raw
+        self.s3 = FakeS3Server().start()
+        self.api = FakeQdsServer(s3=self.s3, seed=1).start()
+        self.api.configure()
+        self.metrics = Qubole.metrics()
+        self.metrics.reset()
+        self.spans = InMemorySpanExporter()
+        self.metrics.add_exporter(self.spans)
+
+    def tearDown(self):
+        self.metrics.remove_exporter(self.spans)
+        self.metrics.reset()
+        self.api.stop()
+        self.s3.stop()
+
+    def test_requests(self):
+        self.api.add_cluster("etl")
+        Cluster.status("etl")
+        with self.assertRaises(ResourceNotFound):
+            HiveCommand.find(1000)
+        self.assertEqual(self.metrics.value("qds_requests_total", {
+            "method": "GET", "endpoint": "clusters/etl/state", "status": "200"}), 1)
+        self.assertEqual(self.metrics.value("qds_requests_total", {
+            "method": "GET", "endpoint": "commands/:id", "status": "404"}), 1)
+        self.assertEqual(self.metrics.total("qds_request_duration_seconds"), 2)
+        self.assertTrue(self.metrics.total("qds_request_bytes_received_total") > 0)
+        self.assertEqual([s.attributes["http.status_code"] for s in self.spans.spans],
+                         [200, 404])
+
+    @patch("time.sleep")
+    def test_retries(self, sleep):
+        self.api.fail_next(503, count=2, method="GET", path="commands")
+        self.api.add_command(status="done")
+        HiveCommand.find(1)
+        self.assertEqual(self.metrics.total("qds_request_retries_total",
+                                            exception="RetryWithDelay"), 2)
+        self.assertEqual(self.metrics.total("qds_requests_total", status="503"), 2)
+
+    @patch("time.sleep")
+    def test_command_polls(self, sleep):
+        self.api.polls_to_done = 3
+        HiveCommand.run(query="show tables")
+        labels = {"command_type": "HiveCommand"}
+        self.assertEqual(self.metrics.value("qds_command_polls_total", labels), 3)
+        self.assertEqual(self.metrics.value("qds_command_polls", labels)["sum"], 3)
+        run = self.spans.spans[-1]
+        self.assertEqual(run.name, "qds.command.run")
+        self.assertEqual(run.attributes["qds.polls"], 3)
+        self.assertTrue(all(s.parent_id == run.span_id for s in self.spans.spans[:-1]))
+
+    def test_s3_download(self):
+        self.api.inline_result_limit = 10
+        self.api.result_file_size = 300
+        cmd = HiveCommand(self.api.add_command(status="done", result_size=1000))
+        cmd.get_results(io.BytesIO())
+        self.assertEqual(self.metrics.value("qds_s3_download_bytes_total"), 1000)
+        self.assertEqual(self.metrics.total("qds_s3_download_throughput_bytes"), 4)
+        self.assertEqual(len([s for s in self.spans.spans
+                              if s.name == "qds.s3.download"]), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
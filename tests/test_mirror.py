@@ -0,0 +1,140 @@
+from __future__ import print_function
+import sys
+import os
+import shutil
+import tempfile
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from mock import Mock
+from qds_sdk.qubole import Qubole
+from qds_sdk.connection import Connection
+from qds_sdk.commands import HiveCommand
+from qds_sdk.mirror import Mirror
+from test_base import QdsCliTestCase
+
+
+class TestMirror(QdsCliTestCase):
+    def setUp(self):
+        super(TestMirror, self).setUp()
+        Qubole.configure(api_token="dummy_token")
+        self.schedules = [{"id": 1, "name": "etl", "status": "RUNNING"},
+                          {"id": 2, "name": "report", "status": "SUSPENDED"}]
+        # Newest first, as listed by QDS
+        self.actions = [
+            {"id": 6, "periodic_job_id": 1, "status": "running",
+             "nominal_time": "2015-01-03T00:00Z"},
+            {"id": 5, "periodic_job_id": 2, "status": "error",
+             "nominal_time": "2015-01-03T00:00Z"},
+            {"id": 4, "periodic_job_id": 1, "status": "done",
+             "nominal_time": "2015-01-02T00:00Z"},
+            {"id": 3, "periodic_job_id": 2, "status": "done",
+             "nominal_time": "2015-01-02T00:00Z"},
+            {"id": 2, "periodic_job_id": 1, "status": "error",
+             "nominal_time": "2015-01-01T00:00Z"},
+            {"id": 1, "periodic_job_id": 2, "status": "done",
+             "nominal_time": "2015-01-01T00:00Z"}]
+        self.instances = {
+            1: [{"id": 12, "command_type": "HiveCommand", "status": "running",
+                 "nominal_time": "2015-01-03T00:00Z"},
+                {"id": 11, "command_type": "HiveCommand", "status": "error",
+                 "nominal_time": "2015-01-01T00:00Z"}],
+            2: [{"id": 21, "command_type": "HiveCommand", "status": "done",
+                 "nominal_time": "2015-01-02T00:00Z"}]}
+
+        def page(records, params):
+            page, per_page = int(params["page"]), int(params["per_page"])
+            return records[(page - 1) * per_page:page * per_page]
+
+        def api_call(method, path, data=None, params=None):
+            if path.startswith("scheduler?"):
+                params = dict(p.split("=") for p in path.split("?")[1].split("&"))
+                return {"schedules": page(self.schedules, params)}
+            if path == "actions":
+                return {"actions": page(self.actions, params)}
+            schedule_id = int(path.split("/")[1])
+            return {"commands": page(self.instances[schedule_id], params)}
+        Connection._api_call = Mock(side_effect=api_call)
+        self.mirror = Mirror(per_page=2)
+
+    def tearDown(self):
+        self.mirror.close()
+
+    def test_sync(self):
+        result = self.mirror.sync()
+        self.assertEqual(result[:3], (2, 6, 3))
+        self.assertIsNotNone(self.mirror.last_sync())
+        # The oldest running action and instance, or past the newest ones
+        self.assertEqual(self.mirror.watermark("actions"), 6)
+        self.assertEqual(self.mirror.watermark("instances", 1), 12)
+        self.assertEqual(self.mirror.watermark("instances", 2), 22)
+
+    def test_capped_per_page(self):
+        # The server returns one record per page, with paging_info
+        def api_call(method, path, data=None, params=None):
+            if path.startswith("scheduler?"):
+                params = dict(p.split("=") for p in path.split("?")[1].split("&"))
+                key, records = "schedules", self.schedules
+            elif path == "actions":
+                key, records = "actions", self.actions
+            else:
+                key, records = "commands", self.instances[int(path.split("/")[1])]
+            page = int(params["page"])
+            return {key: records[page - 1:page],
+                    "paging_info": {"next_page": page + 1 if page < len(records) else None}}
+        Connection._api_call = Mock(side_effect=api_call)
+        self.assertEqual(self.mirror.sync()[:3], (2, 6, 3))
+
+    def test_incremental_sync(self):
+        self.mirror.sync()
+        Connection._api_call.reset_mock()
+        self.actions[0]["status"] = "done"
+        self.actions.insert(0, {"id": 7, "periodic_job_id": 1, "status": "error",
+                                "nominal_time": "2015-01-04T00:00Z"})
+        result = self.mirror.sync()
+        # Only the pages down to the running action are fetched again
+        self.assertEqual(result.actions, 4)
+        Connection._api_call.assert_any_call("GET", "actions",
+                                             params={"page": 2, "per_page": 2})
+        self.assertEqual([c[0][1] for c in Connection._api_call.call_args_list].count("actions"),
+                         2)
+        self.assertEqual(self.mirror.watermark("actions"), 8)
+        self.assertEqual([a.id for a in self.mirror.actions(status="error")], [7, 5, 2])
+        self.assertEqual([a.id for a in self.mirror.actions(status="running")], [])
+
+    def test_queries(self):
+        self.mirror.sync()
+        Connection._api_call.reset_mock()
+        self.assertEqual([a.id for a in self.mirror.actions(scheduler_id=1)], [6, 4, 2])
+        self.assertEqual([a.id for a in self.mirror.actions(
+            status=["done", "error"], start="2015-01-02", end="2015-01-03")], [4, 3])
+        instances = self.mirror.instances(status="error")
+        self.assertEqual([i.id for i in instances], [11])
+        self.assertIsInstance(instances[0], HiveCommand)
+        self.assertEqual([s.id for s in self.mirror.schedules(status="RUNNING")], [1])
+        self.assertEqual([s.name for s in self.mirror.failed_schedules("2015-01-01")],
+                         ["etl", "report"])
+        self.assertEqual([s.name for s in self.mirror.failed_schedules("2015-01-02")],
+                         ["report"])
+        Connection._api_call.assert_not_called()
+
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "mirror.db")
+        try:
+            mirror = Mirror(path, per_page=2)
+            mirror.sync()
+            mirror.close()
+            mirror = Mirror(path, per_page=2)
+            self.assertEqual(mirror.watermark("actions"), 6)
+            self.assertEqual(len(mirror.actions()), 6)
+            mirror.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -100,7 +100,7 @@ class TestNezhaCube(QdsCliTestCase):
             'name':'dummycubes', 'id':'1', 'table_name':'2'})
         qds.main()
         Connection._api_call.assert_called_with(
-            "GET", "nezha_cubes/123", params=None)
+            "GET", "nezha_cubes/123", params={'fields': 'id,table_name'})
 
     def test_view_neg(self):
         sys.argv = ['qds.py', 'nezha', 'view', 'cubes']
@@ -0,0 +1,183 @@
+from __future__ import print_function
+import sys
+import os
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from mock import Mock, patch
+from qds_sdk.qubole import Qubole
+from qds_sdk.connection import Connection
+from qds_sdk.prewarm import (DemandModel, Prewarmer, PrewarmDecision, parse_time,
+                             schedule_runs, simulate, WEEK)
+from test_base import QdsCliTestCase
+
+HOUR = 3600
+DAY = 24 * HOUR
+# A Monday, 00:00 UTC
+MONDAY = parse_time("2015-01-05T00:00Z")
+
+
+def mornings(weeks, label="etl", hour=8):
+    """A command at `hour` every weekday of `weeks` weeks"""
+    return [(MONDAY + week * WEEK + day * DAY + hour * HOUR + 600, label)
+            for week in range(weeks) for day in range(5)]
+
+
+class TestDemandModel(unittest.TestCase):
+    def test_parse_time(self):
+        self.assertEqual(parse_time("2015-01-05T00:00Z"), 1420416000)
+        self.assertEqual(parse_time("2015-01-05T00:00:30Z"), 1420416030)
+        self.assertEqual(parse_time("2015-01-05T00:00:30.123+00:00"), 1420416030)
+        self.assertIsNone(parse_time(None))
+        with self.assertRaises(ValueError):
+            parse_time("yesterday")
+
+    def test_schedule_runs(self):
+        schedule = {"status": "RUNNING", "frequency": 6, "time_unit": "hours",
+                    "start_time": "2015-01-05T00:00Z", "end_time": "2015-01-06T00:00Z"}
+        self.assertEqual(schedule_runs(schedule, MONDAY + 1, MONDAY + 2 * DAY),
+                         [MONDAY + 6 * HOUR, MONDAY + 12 * HOUR, MONDAY + 18 * HOUR])
+        schedule["status"] = "SUSPENDED"
+        self.assertEqual(schedule_runs(schedule, MONDAY, MONDAY + DAY), [])
+
+    def test_demand(self):
+        model = DemandModel(history=mornings(3), weeks=4)
+        week4 = MONDAY + 3 * WEEK
+        self.assertEqual(model.demand("etl", week4 + 8 * HOUR, week4 + 9 * HOUR), 0.75)
+        self.assertEqual(model.demand("etl", week4 + 12 * HOUR, week4 + 13 * HOUR), 0)
+        self.assertEqual(model.demand("adhoc", week4, week4 + DAY), 0)
+
+    def test_scheduled_demand(self):
+        model = DemandModel(schedules=[{"command": {"label": "nightly"}, "time_unit": "days",
+                                        "start_time": "2015-01-01T02:00Z"}])
+        self.assertEqual(model.labels(), set(["nightly"]))
+        self.assertEqual(model.demand("nightly", MONDAY + HOUR, MONDAY + 2 * HOUR), 0)
+        self.assertEqual(model.demand("nightly", MONDAY + HOUR, MONDAY + 3 * HOUR), 1)
+
+
+class TestPrewarmer(QdsCliTestCase):
+    def setUp(self):
+        super(TestPrewarmer, self).setUp()
+        Qubole.configure(api_token="dummy_token")
+        self.model = DemandModel(history=mornings(4) + mornings(4, "adhoc", 14))
+        self.now = MONDAY + 4 * WEEK + 8 * HOUR - 600
+
+    def test_plan(self):
+        prewarmer = Prewarmer(self.model, lead_time=900, idle_timeout=3600)
+        decisions = prewarmer.plan({"etl": "DOWN", "adhoc": "UP"}, self.now)
+        self.assertEqual([(d.label, d.action) for d in decisions],
+                         [("adhoc", "terminate"), ("etl", "start")])
+        self.assertEqual(prewarmer.plan({"etl": "UP", "adhoc": "DOWN"}, self.now), [])
+
+    def test_long_running_command(self):
+        # Submitted 2h ago, still running: its cluster is not idle
+        states = {"etl": "DOWN", "adhoc": "UP"}
+        commands = [{"label": "adhoc", "status": "running",
+                     "created_at": "2015-02-02T05:50:00Z"},
+                    {"label": "etl", "status": "done", "created_at": "2015-02-02T05:00:00Z"}]
+
+        def api_call(method, path, data=None, params=None):
+            if path.startswith("commands"):
+                return {"commands": commands}
+            return {"state": states[path.split("/")[1]]}
+        Connection._api_call = Mock(side_effect=api_call)
+        prewarmer = Prewarmer(self.model, labels=["adhoc"])
+        self.assertEqual(prewarmer.running_labels(self.now), set(["adhoc"]))
+        self.assertEqual(prewarmer.run_once(now=self.now), [])
+        Connection._api_call.assert_any_call("GET", "commands?page=1&per_page=100",
+                                             params={"fields": "label,status,created_at"})
+        self.assertEqual(prewarmer.plan({"adhoc": "UP"}, self.now, running=["adhoc"]), [])
+        commands[0]["status"] = "done"
+        self.assertEqual([d.action for d in prewarmer.run_once(now=self.now)], ["terminate"])
+
+    def test_last_command(self):
+        # A command submitted between two runs keeps its cluster up
+        commands = []
+        Connection._api_call = Mock(side_effect=lambda method, path, data=None, params=None:
+                                    {"commands": commands} if path.startswith("commands")
+                                    else {"state": "UP"})
+        prewarmer = Prewarmer(self.model, labels=["adhoc"])
+        self.assertEqual([d.action for d in prewarmer.run_once(now=self.now, dry_run=True)],
+                         ["terminate"])
+        commands.append({"label": "adhoc", "status": "done",
+                         "created_at": "2015-02-02T07:40:00Z"})
+        self.assertEqual(prewarmer.run_once(now=self.now, dry_run=True), [])
+        self.assertEqual(self.model.last_command["adhoc"], self.now - 600)
+
+    def test_run_once(self):
+        states = {"etl": "DOWN", "adhoc": "DOWN"}
+        Connection._api_call = Mock(side_effect=lambda method, path, data=None, params=None:
+                                    {"state": states[path.split("/")[1]]})
+        decisions = Prewarmer(self.model).run_once(now=self.now)
+        self.assertEqual(decisions, [PrewarmDecision("etl", "start", decisions[0].reason,
+                                                     self.now)])
+        Connection._api_call.assert_any_call("PUT", "clusters/etl/state", {"state": "start"})
+        self.assertEqual(Connection._api_call.call_count, 3)
+
+    def test_from_qds(self):
+        now = parse_time("2015-01-29T00:00Z")
+
+        def api_call(method, path, data=None, params=None):
+            if path.startswith("scheduler"):
+                return {"schedules": [{"id": 1, "label": "nightly",
+                                       "start_time": "2015-01-01T02:00Z"}]}
+            if "page=1&" in path:
+                return {"commands": [
+                    {"id": 2, "label": "etl", "created_at": "2015-01-28T08:10:00Z"},
+                    {"id": 1, "created_at": "2015-01-27T08:10:00Z"}]}
+            return {"commands": [{"id": 0, "created_at": "2014-01-01T00:00:00Z"}]}
+        Connection._api_call = Mock(side_effect=api_call)
+        with patch("time.time", return_value=now):
+            prewarmer = Prewarmer.from_qds(history_days=7, per_page=2)
+        self.assertEqual(prewarmer.model.labels(), set(["nightly", "etl", "default"]))
+        self.assertEqual(prewarmer.model.weeks, 1)
+        Connection._api_call.assert_any_call("GET", "commands?page=2&per_page=2",
+                                             params={"fields": "label,created_at"})
+        self.assertEqual(Connection._api_call.call_count, 3)
+
+    def test_from_qds_capped_per_page(self):
+        # The server returns one record per page, with paging_info
+        now = parse_time("2015-01-29T00:00Z")
+        records = {"scheduler": [{"id": 1, "label": "nightly"}, {"id": 2, "label": "hourly"}],
+                   "commands": [{"id": 2, "label": "etl", "created_at": "2015-01-28T08:10:00Z"},
+                                {"id": 1, "label": "bi", "created_at": "2015-01-27T08:10:00Z"}]}
+
+        def api_call(method, path, data=None, params=None):
+            entity = path.split("?")[0]
+            page = int(path.split("page=")[1].split("&")[0])
+            key = "schedules" if entity == "scheduler" else entity
+            return {key: records[entity][page - 1:page],
+                    "paging_info": {"next_page": page + 1 if page < 2 else None}}
+        Connection._api_call = Mock(side_effect=api_call)
+        with patch("time.time", return_value=now):
+            prewarmer = Prewarmer.from_qds(history_days=7, per_page=100)
+        self.assertEqual(prewarmer.model.labels(), set(["nightly", "hourly", "etl", "bi"]))
+        self.assertEqual(Connection._api_call.call_count, 4)
+
+    def test_dry_run(self):
+        Connection._api_call = Mock(return_value={"state": "DOWN"})
+        decisions = Prewarmer(self.model, labels=["etl"]).run_once(now=self.now, dry_run=True)
+        self.assertEqual([d.action for d in decisions], ["start"])
+        Connection._api_call.assert_called_once_with("GET", "clusters/etl/state", params=None)
+
+
+class TestSimulate(unittest.TestCase):
+    def test_simulate(self):
+        history = mornings(6)
+        baseline = simulate(history, prewarm=False, idle_timeout=2 * HOUR)
+        result = simulate(history, idle_timeout=2 * HOUR)
+        self.assertEqual(baseline.warm, 0)
+        self.assertEqual(baseline.cold, 30)
+        self.assertEqual(baseline.wait_seconds, 30 * 600)
+        # Commands are expected once seen in half of the last 4 weeks
+        self.assertEqual(result.cold, 10)
+        self.assertEqual(result.warm, 20)
+        self.assertTrue(result.cluster_seconds > baseline.cluster_seconds)
+        self.assertEqual(set(d.action for d in result.decisions), set(["start", "terminate"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
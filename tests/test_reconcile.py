@@ -0,0 +1,144 @@
+from __future__ import print_function
+import sys
+import os
+import json
+import shutil
+import tempfile
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from mock import Mock
+sys.path.append(os.path.join(os.path.dirname(__file__), '../bin'))
+import qds
+from qds_sdk.qubole import Qubole
+from qds_sdk.connection import Connection
+from qds_sdk.cluster import Cluster
+from qds_sdk.reconcile import Reconciler, PlanItem, load_configs
+from qds_sdk.exception import ResourceNotFound, ServerError
+from test_base import print_command
+from test_base import QdsCliTestCase
+
+
+class TestReconcile(QdsCliTestCase):
+    def setUp(self):
+        super(TestReconcile, self).setUp()
+        Qubole.configure(api_token='dummy_token')
+        Cluster._config_cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.clusters = {
+            "etl": {"id": 1, "label": ["etl"],
+                    "node_configuration": {"max_nodes": 4, "initial_nodes": 1}},
+            "adhoc": {"id": 2, "label": ["adhoc"],
+                      "ec2_settings": {"aws_region": "us-east-1"}},
+        }
+
+        def api_call(method, path, data=None, params=None):
+            label = path.split("/")[1] if "/" in path else None
+            if label == "broken":
+                raise ServerError(Mock(status_code=500))
+            if method == "GET":
+                if label not in self.clusters:
+                    raise ResourceNotFound(Mock(status_code=404))
+                return self.clusters[label]
+            return {"id": 3}
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, payload):
+        with open(os.path.join(self.directory, name), "w") as f:
+            json.dump(payload, f)
+
+    def test_load_configs(self):
+        self.write("a.json", {"label": ["etl", "daily"], "node_configuration":
+                              {"max_nodes": 4, "slave_instance_type": None}})
+        self.write("adhoc.json", {"ec2_settings": {}})
+        self.write("README", {})
+        self.assertEqual(load_configs(self.directory),
+                         {"etl": {"label": ["etl", "daily"],
+                                  "node_configuration": {"max_nodes": 4}},
+                          "adhoc": {}})
+        self.write("b.json", {"label": "etl"})
+        with self.assertRaises(ValueError):
+            load_configs(self.directory)
+
+    def test_load_configs_invalid_cluster(self):
+        self.write("etl.json", {"cluster": ["etl"]})
+        with self.assertRaises(ValueError) as context:
+            load_configs(self.directory)
+        self.assertIn("etl.json", str(context.exception))
+
+    def test_plan(self):
+        reconciler = Reconciler({
+            "etl": {"node_configuration": {"max_nodes": 8, "initial_nodes": 1}},
+            "adhoc": {"ec2_settings": {"aws_region": "us-east-1"}},
+            "new": {"label": ["new"]},
+            "broken": {}}, concurrency=2)
+        plan = dict((item.cluster, item) for item in reconciler.plan())
+        self.assertEqual(plan["etl"], PlanItem("etl", "update",
+                                               {"node_configuration": {"max_nodes": 8}}, None))
+        self.assertEqual(plan["adhoc"].action, "unchanged")
+        self.assertEqual(plan["new"].action, "missing")
+        self.assertEqual(plan["broken"].action, "error")
+        self.assertIsInstance(plan["broken"].error, ServerError)
+        self.assertEqual(sorted(reconciler.timings), ["fetch", "plan", "validate"])
+
+    def test_apply(self):
+        reconciler = Reconciler({
+            "etl": {"node_configuration": {"max_nodes": 8}},
+            "adhoc": {"ec2_settings": {"aws_region": "us-east-1"}},
+            "new": {"label": ["new"]}}, create_missing=True)
+        plan, outcomes = reconciler.apply()
+        self.assertEqual(sorted(outcomes), ["etl", "new"])
+        self.assertEqual(outcomes["new"].response, {"id": 3})
+        Connection._api_call.assert_any_call("PUT", "clusters/etl",
+                                             {"node_configuration": {"max_nodes": 8}})
+        Connection._api_call.assert_any_call("POST", "clusters", {"label": ["new"]})
+        self.assertEqual(Connection._api_call.call_count, 5)
+
+    def test_invalid(self):
+        reconciler = Reconciler({
+            "etl": {"node_configuration": {"max_nodes": "8"}},
+            "new": {"ec2_settings": {}}}, create_missing=True)
+        plan = reconciler.plan()
+        self.assertEqual([item.action for item in plan], ["error", "error"])
+        self.assertEqual(plan[0].error.errors,
+                         ["node_configuration.max_nodes must be an integer, not '8'"])
+        self.assertEqual(plan[1].error.errors, ["label is required to create a cluster"])
+        Connection._api_call.assert_called_once_with("GET", "clusters/new", params=None)
+
+    def test_dry_run(self):
+        reconciler = Reconciler({"etl": {"node_configuration": {"max_nodes": 8}}})
+        plan, outcomes = reconciler.apply(dry_run=True)
+        self.assertEqual(plan[0].action, "update")
+        self.assertEqual(outcomes, {})
+        Connection._api_call.assert_called_once_with("GET", "clusters/etl", params=None)
+
+    def test_cli(self):
+        self.write("etl.json", {"label": ["etl"], "node_configuration": {"max_nodes": 8}})
+        sys.argv = ['qds.py', 'cluster', 'reconcile', self.directory]
+        print_command()
+        self.assertEqual(qds.main(), 0)
+        Connection._api_call.assert_called_with("PUT", "clusters/etl",
+                                                {"node_configuration": {"max_nodes": 8}})
+
+    def test_cli_invalid(self):
+        self.write("etl.json", {"cluster": "etl"})
+        sys.argv = ['qds.py', 'cluster', 'reconcile', self.directory]
+        print_command()
+        self.assertEqual(qds.main(), 1)
+        self.assertEqual(Connection._api_call.call_count, 0)
+
+    def test_cli_dry_run(self):
+        self.write("broken.json", {})
+        sys.argv = ['qds.py', 'cluster', 'reconcile', '--dry-run', self.directory]
+        print_command()
+        self.assertEqual(qds.main(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,11 +6,17 @@ if sys.version_info > (2, 7, 0):
     import unittest
 else:
     import unittest2 as unittest
-from mock import Mock
+from mock import Mock, patch
+import datetime
+import shutil
+import tempfile
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../bin'))
 import qds
 from qds_sdk.connection import Connection
+from qds_sdk.qubole import Qubole
+from qds_sdk.exception import ServerError
+from qds_sdk.report import ReportClient, date_ranges, to_columns
 from test_base import print_command
 from test_base import QdsCliTestCase
 
@@ -222,5 +228,152 @@ class TestReportAllCommands(QdsCliTestCase):
             "GET", "reports/all_commands", params={'by_user': True})
 
 
+class TestReportClient(QdsCliTestCase):
+    def setUp(self):
+        super(TestReportClient, self).setUp()
+        Qubole.configure(api_token="dummy_token")
+        self.directory = tempfile.mkdtemp()
+
+        def api_call(method, path, data=None, params=None):
+            if path == "reports/canonical_hive_commands":
+                return {"results": [{"canonical_query_id": 1, "frequency": 3}]}
+            day = params["start_date"]
+            rows = [{"id": "%s-%d" % (day, n), "created_at": day, "cpu": n}
+                    for n in range(3)]
+            return {"commands": rows[params["offset"]:params["offset"] + params["limit"]]}
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_date_ranges(self):
+        self.assertEqual(date_ranges("2015-01-30", "2015-02-02", days=2), [
+            (datetime.date(2015, 1, 30), datetime.date(2015, 2, 1)),
+            (datetime.date(2015, 2, 1), datetime.date(2015, 2, 2))])
+        self.assertEqual(date_ranges("2015-01-30", "2015-01-30"), [])
+
+    def test_rows(self):
+        client = ReportClient(page_size=2)
+        rows = client.rows("all_commands", "2015-01-01", "2015-01-03", sort_column="cpu")
+        self.assertEqual([r["id"] for r in rows], ["2015-01-01-0", "2015-01-01-1",
+                                                   "2015-01-01-2", "2015-01-02-0",
+                                                   "2015-01-02-1", "2015-01-02-2"])
+        Connection._api_call.assert_any_call("GET", "reports/all_commands", params={
+            "start_date": "2015-01-02", "end_date": "2015-01-03", "offset": 2, "limit": 2,
+            "sort_column": "cpu"})
+        self.assertEqual(Connection._api_call.call_count, 4)
+
+    def test_concurrent_shards(self):
+        client = ReportClient(concurrency=3)
+        rows = client.rows("all_commands", "2015-01-01", "2015-01-11")
+        # In date order whatever the order the shards were fetched in
+        self.assertEqual([r["created_at"] for r in rows][::3],
+                         ["2015-01-%02d" % day for day in range(1, 11)])
+        self.assertEqual(Connection._api_call.call_count, 10)
+
+    def test_shard_retry(self):
+        api_call = Connection._api_call.side_effect
+        failures = {"2015-01-02": 2, "2015-01-03": 4}
+
+        def flaky_api_call(method, path, data=None, params=None):
+            if failures.get(params["start_date"]):
+                failures[params["start_date"]] -= 1
+                raise ServerError(Mock(status_code=503, text="unavailable"))
+            return api_call(method, path, data, params)
+        Connection._api_call = Mock(side_effect=flaky_api_call)
+
+        client = ReportClient(retries=2)
+        with patch("time.sleep") as sleep:
+            self.assertEqual(len(client.rows("all_commands", "2015-01-01", "2015-01-03")), 6)
+            sleep.assert_any_call(5)
+            sleep.assert_any_call(10)
+            with self.assertRaises(ServerError):
+                client.rows("all_commands", "2015-01-03", "2015-01-04")
+
+    def test_timeout(self):
+        Qubole.configure(api_token="dummy_token", timeout=30)
+        try:
+            self.assertEqual(Qubole.agent().timeout, 30)
+        finally:
+            Qubole.configure(api_token="dummy_token")
+        self.assertEqual(Qubole.agent().timeout, 300)
+
+    def test_unsharded(self):
+        rows = ReportClient().rows("canonical_hive_commands", "2015-01-01", "2015-01-03")
+        self.assertEqual(rows, [{"canonical_query_id": 1, "frequency": 3}])
+        Connection._api_call.assert_called_once_with(
+            "GET", "reports/canonical_hive_commands", params={
+                "start_date": "2015-01-01", "end_date": "2015-01-03", "offset": 0,
+                "limit": 1000})
+        with self.assertRaises(ValueError):
+            ReportClient().rows("foo_bar")
+
+    def test_cache(self):
+        client = ReportClient(cache_dir=self.directory)
+        with patch("qds_sdk.report._today", return_value=datetime.date(2015, 1, 2)):
+            first = client.rows("all_commands", "2015-01-01", "2015-01-03")
+            Connection._api_call.reset_mock()
+            self.assertEqual(client.rows("all_commands", "2015-01-01", "2015-01-03"), first)
+        # Only the day which is not over is fetched again
+        Connection._api_call.assert_called_once_with("GET", "reports/all_commands", params={
+            "start_date": "2015-01-02", "end_date": "2015-01-03", "offset": 0, "limit": 1000})
+        Connection._api_call.reset_mock()
+        client.rows("all_commands", "2015-01-01", "2015-01-02", sort_column="cpu")
+        self.assertEqual(Connection._api_call.call_count, 1)
+
+    def test_cache_unfinished(self):
+        api_call = Connection._api_call.side_effect
+        status = {"2015-01-01": "running"}
+
+        def api_call_with_status(method, path, data=None, params=None):
+            rows = api_call(method, path, data, params)
+            for row in rows["commands"]:
+                row["status"] = status.get(params["start_date"], "done")
+            return rows
+        Connection._api_call = Mock(side_effect=api_call_with_status)
+        client = ReportClient(cache_dir=self.directory)
+        rows = client.rows("all_commands", "2015-01-01", "2015-01-03")
+        self.assertEqual(set(r["status"] for r in rows[:3]), set(["running"]))
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, "all_commands"))), 1)
+        # The range with a running command is fetched again
+        status["2015-01-01"] = "error"
+        Connection._api_call.reset_mock()
+        rows = client.rows("all_commands", "2015-01-01", "2015-01-03")
+        self.assertEqual(set(r["status"] for r in rows[:3]), set(["error"]))
+        Connection._api_call.assert_called_once_with("GET", "reports/all_commands", params={
+            "start_date": "2015-01-01", "end_date": "2015-01-02", "offset": 0, "limit": 1000})
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, "all_commands"))), 2)
+
+    def test_cache_per_account(self):
+        client = ReportClient(cache_dir=self.directory)
+        client.rows("all_commands", "2015-01-01", "2015-01-02")
+        Qubole.configure(api_token="other_token")
+        client.rows("all_commands", "2015-01-01", "2015-01-02")
+        Qubole.configure(api_token="dummy_token", api_url="https://eu.qubole.com/api/")
+        client.rows("all_commands", "2015-01-01", "2015-01-02")
+        self.assertEqual(Connection._api_call.call_count, 3)
+        Qubole.configure(api_token="dummy_token")
+        client.rows("all_commands", "2015-01-01", "2015-01-02")
+        self.assertEqual(Connection._api_call.call_count, 3)
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, "all_commands"))), 3)
+
+    def test_columns(self):
+        columns = ReportClient().columns("all_commands", "2015-01-01", "2015-01-02",
+                                         fields=["id", "cpu"])
+        self.assertEqual(sorted(columns), ["cpu", "id"])
+        self.assertEqual(columns["cpu"], [0, 1, 2])
+        self.assertEqual(to_columns([{"b": 1, "a": 2}]), {"a": [2], "b": [1]})
+        self.assertEqual(to_columns([]), {})
+
+    def test_cli(self):
+        sys.argv = ['qds.py', 'report', 'all_commands', '--start-date', '2015-01-01',
+                    '--end-date', '2015-01-03', '--all', '--cache-dir', self.directory]
+        print_command()
+        qds.main()
+        Connection._api_call.assert_any_call("GET", "reports/all_commands", params={
+            "start_date": "2015-01-02", "end_date": "2015-01-03", "offset": 0, "limit": 1000})
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, "all_commands"))), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
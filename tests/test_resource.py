@@ -0,0 +1,158 @@
+from __future__ import print_function
+import sys
+import os
+import pickle
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from mock import Mock
+from qds_sdk.connection import Connection
+from qds_sdk.qubole import Qubole
+from qds_sdk.commands import Command, HiveCommand
+from qds_sdk.actions import Action
+from qds_sdk.nezha import NezhaCube
+from qds_sdk.exception import ResourceNotFound
+from test_base import QdsCliTestCase
+
+
+class TestCompactResource(unittest.TestCase):
+    def setUp(self):
+        self.attributes = {"id": 1, "status": "done", "query": "show tables",
+                           "meta_data": {"results_resource": "commands/1/results"}}
+
+    def test_fields(self):
+        cmd = HiveCommand(dict(self.attributes))
+        self.assertEqual(cmd.id, 1)
+        self.assertEqual(cmd.status, "done")
+        self.assertEqual(cmd.meta_data["results_resource"], "commands/1/results")
+        with self.assertRaises(AttributeError):
+            cmd.progress
+        self.assertFalse(hasattr(cmd, "__dict__"))
+
+    def test_attributes(self):
+        cmd = HiveCommand(dict(self.attributes))
+        self.assertEqual(cmd.attributes, self.attributes)
+        cmd.attributes["status"] = "error"
+        self.assertEqual(cmd.status, "error")
+        cmd.attributes = {"id": 2}
+        self.assertEqual(cmd.id, 2)
+        with self.assertRaises(AttributeError):
+            cmd.status
+
+    def test_different_fields(self):
+        first = HiveCommand({"id": 1})
+        second = HiveCommand({"progress": 50, "id": 2})
+        self.assertEqual(first.attributes, {"id": 1})
+        self.assertEqual(second.attributes, {"id": 2, "progress": 50})
+        with self.assertRaises(AttributeError):
+            first.progress
+
+    def test_shared_strings(self):
+        first = HiveCommand(dict(self.attributes, status="".join(["do", "ne"])))
+        second = HiveCommand(dict(self.attributes, status="".join(["do", "ne"])))
+        self.assertIs(first.status, second.status)
+
+    def test_setattr(self):
+        cmd = Command(dict(self.attributes))
+        cmd.status = "cancelled"
+        self.assertEqual(cmd.status, "cancelled")
+        self.assertEqual(cmd.attributes["status"], "cancelled")
+
+    def test_set_field_named_like_method(self):
+        action = Action({"id": 1, "status": "running"})
+        action.status = "done"
+        self.assertEqual(action.attributes["status"], "done")
+        self.assertEqual(pickle.loads(pickle.dumps(action)).attributes,
+                         {"id": 1, "status": "done"})
+
+    def test_pickle(self):
+        cmd = pickle.loads(pickle.dumps(HiveCommand(dict(self.attributes)), 2))
+        self.assertEqual(cmd.attributes, self.attributes)
+
+    def test_str(self):
+        action = Action({"id": 3, "command": {"command_type": "HiveCommand", "query": "q"}})
+        self.assertIn('"query": "q"', str(action))
+        self.assertEqual(action.getcommand().query, "q")
+
+
+class TestFieldsAndFilters(QdsCliTestCase):
+    def setUp(self):
+        super(TestFieldsAndFilters, self).setUp()
+        Qubole.configure(api_token="dummy_token")
+
+    def test_list(self):
+        Connection._api_call = Mock(return_value={"nezha_cubes": [
+            {"id": 1, "name": "a", "status": "Active"},
+            {"id": 2, "name": "b", "status": "inactive"},
+            {"id": 3, "name": "c", "status": "active"}]})
+        cubes = NezhaCube.list(per_page=10, fields=["id"], status="active")
+        Connection._api_call.assert_called_with(
+            "GET", "nezha_cubes?per_page=10",
+            params={"fields": "id,status", "status": "active"})
+        self.assertEqual([c.attributes for c in cubes], [{"id": 1}, {"id": 3}])
+
+    def test_list_unchecked_filter(self):
+        # The API ignored the filter and dropped the field filtered on
+        Connection._api_call = Mock(return_value={"nezha_cubes": [{"id": 1}, {"id": 2}]})
+        self.assertEqual(NezhaCube.list(fields=["id"], status="active"), [])
+
+    def test_list_valued_field(self):
+        Connection._api_call = Mock(return_value={"nezha_cubes": [
+            {"id": 1, "tags": ["etl", "Daily"]}, {"id": 2, "tags": ["adhoc"]}]})
+        self.assertEqual([c.id for c in NezhaCube.list(tags="daily")], [1])
+        self.assertEqual([c.id for c in NezhaCube.list(tags=["adhoc", "etl"])], [1, 2])
+
+    def test_list_any_of(self):
+        Connection._api_call = Mock(return_value={"nezha_cubes": [
+            {"id": 1}, {"id": 2}, {"id": 3}]})
+        cubes = NezhaCube.list(id=["1", 3])
+        Connection._api_call.assert_called_with(
+            "GET", "nezha_cubes", params={"id": "1,3"})
+        self.assertEqual([c.id for c in cubes], [1, 3])
+
+    def test_find(self):
+        Connection._api_call = Mock(return_value={"id": 1, "name": "a"})
+        cube = NezhaCube.find(1, fields=["name", "missing"])
+        Connection._api_call.assert_called_with(
+            "GET", "nezha_cubes/1", params={"fields": "name,missing"})
+        self.assertEqual(cube.attributes, {"name": "a"})
+
+
+class TestFindMany(QdsCliTestCase):
+    def setUp(self):
+        super(TestFindMany, self).setUp()
+        Qubole.configure(api_token="dummy_token")
+
+        def get(method, path, params=None):
+            id = path.split("/")[-1]
+            if id == "404":
+                raise ResourceNotFound(Mock(status_code=404))
+            return {"id": int(id), "status": "done"}
+        Connection._api_call = Mock(side_effect=get)
+
+    def test_find_many(self):
+        results = HiveCommand.find_many([1, 2, 404, 2, "1", 3], concurrency=4)
+        self.assertEqual(sorted(results.keys(), key=str), [1, 2, 3, 404])
+        self.assertEqual(results[2].id, 2)
+        self.assertIsInstance(results[2], HiveCommand)
+        self.assertIsInstance(results[404], ResourceNotFound)
+        self.assertEqual(Connection._api_call.call_count, 4)
+
+    def test_cache(self):
+        cache = {1: HiveCommand({"id": 1, "status": "running"})}
+        results = HiveCommand.find_many([1, 2], cache=cache)
+        self.assertEqual(results[1].status, "running")
+        self.assertEqual(cache[2].id, 2)
+        Connection._api_call.assert_called_once_with("GET", "commands/2", params=None)
+
+    def test_stream(self):
+        outcomes = HiveCommand.find_many(range(1, 11), concurrency=3, stream=True)
+        self.assertEqual(sorted(id for id, cmd in outcomes), list(range(1, 11)))
+        self.assertEqual(HiveCommand.find_many([]), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,10 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../bin'))
 import qds
 from qds_sdk.connection import Connection
 from qds_sdk.scheduler import *
+from qds_sdk.exception import ServerError, WaitTimeout, ResourceNotFound
+from qds_sdk.qubole import Qubole
+from qds_sdk import util
+import time
 from test_base import print_command
 from test_base import QdsCliTestCase
 
@@ -76,5 +80,248 @@ class TestSchedulerCheck(QdsCliTestCase):
             [call("GET", "scheduler", params={'name': '123'})])
 
 
+class TestSchedulerNameIndex(QdsCliTestCase):
+    def setUp(self):
+        super(TestSchedulerNameIndex, self).setUp()
+        Qubole.configure(api_token="dummy_token")
+        Scheduler._name_index.clear()
+        self.schedules = [{"id": i, "name": "schedule%d" % i, "status": "RUNNING"}
+                          for i in range(1, 4)]
+
+        def api_call(method, path, data=None, params=None):
+            if params and "name" in params:
+                return {"schedules": [s for s in self.schedules
+                                      if s["name"] == params["name"]]}
+            if "page=" not in path:
+                id = int(path.split("/")[1])
+                found = [s for s in self.schedules if s["id"] == id]
+                if not found:
+                    raise ResourceNotFound(Mock(status_code=404))
+                return found[0]
+            page = int(path.split("page=")[1].split("&")[0])
+            return {"schedules": self.schedules[(page - 1) * 100:page * 100]}
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def test_default(self):
+        self.assertEqual(Scheduler.find_by_name("schedule2").id, 2)
+        Connection._api_call.assert_called_once_with("GET", "scheduler",
+                                                     params={"name": "schedule2"})
+        self.assertEqual(Scheduler._name_index, {})
+
+    def test_index(self):
+        self.assertEqual(Scheduler.find_by_name("schedule2", max_age=300).id, 2)
+        self.assertEqual(Scheduler.find_by_name("schedule3", max_age=300).status, "RUNNING")
+        Connection._api_call.assert_called_once_with("GET", "scheduler?page=1&per_page=100",
+                                                     params=None)
+
+    def test_miss(self):
+        Scheduler.find_by_name("schedule1", max_age=300)
+        self.schedules.append({"id": 4, "name": "schedule4"})
+        self.assertEqual(Scheduler.find_by_name("schedule4", max_age=300).id, 4)
+        self.assertIsNone(Scheduler.find_by_name("unknown", max_age=300))
+        self.assertEqual(Scheduler.find_by_name("schedule4", max_age=300).id, 4)
+        Connection._api_call.assert_any_call("GET", "scheduler", params={"name": "schedule4"})
+        self.assertEqual(Connection._api_call.call_count, 3)
+
+    def test_ttl(self):
+        Scheduler.find_by_name("schedule1", max_age=300)
+        self.schedules[0] = {"id": 5, "name": "schedule1"}
+        # At most max_age secs stale
+        self.assertEqual(Scheduler.find_by_name("schedule1", max_age=300).id, 1)
+        with patch("time.time", return_value=time.time() + 300):
+            self.assertEqual(Scheduler.find_by_name("schedule1", max_age=300).id, 5)
+        self.assertEqual(
+            [c[0][1] for c in Connection._api_call.call_args_list].count(
+                "scheduler?page=1&per_page=100"), 2)
+
+    def test_token(self):
+        Scheduler.find_by_name("schedule1", max_age=300)
+        Qubole.configure(api_token="other_token")
+        Scheduler.find_by_name("schedule1", max_age=300)
+        self.assertEqual(len(Scheduler._name_index), 2)
+        self.assertEqual(Connection._api_call.call_count, 2)
+
+    def test_capped_per_page(self):
+        # The server returns at most 2 schedules per page, with paging_info
+        def api_call(method, path, data=None, params=None):
+            page = int(path.split("page=")[1].split("&")[0])
+            return {"schedules": self.schedules[(page - 1) * 2:page * 2],
+                    "paging_info": {"next_page": page + 1 if page < 2 else None}}
+        Connection._api_call = Mock(side_effect=api_call)
+        self.assertEqual(Scheduler.find_by_name("schedule3", max_age=300).id, 3)
+        self.assertEqual(Connection._api_call.call_count, 2)
+
+    def test_concurrent(self):
+        names = ["schedule%d" % (i % 3 + 1) for i in range(30)]
+        found = [s.id for _, s, _ in util.run_concurrently(
+            lambda name: Scheduler.find_by_name(name, max_age=300), names, 8)]
+        self.assertEqual(sorted(found), sorted(i % 3 + 1 for i in range(30)))
+        self.assertEqual(
+            [c[0][1] for c in Connection._api_call.call_args_list].count(
+                "scheduler?page=1&per_page=100"), 1)
+
+
+class TestSchedulerInstances(QdsCliTestCase):
+    def setUp(self):
+        super(TestSchedulerInstances, self).setUp()
+        self.instances = [{"id": i, "command_type": "HiveCommand", "status": "done"}
+                          for i in range(1, 6)]
+        self.instances[1]["command_type"] = "SomeNewCommand"
+
+        def api_call(method, path, params=None):
+            if path == "scheduler/123":
+                return {"id": 123}
+            page, per_page = int(params.get("page", 1)), int(params.get("per_page", 10))
+            start = (page - 1) * per_page
+            return {"commands": self.instances[start:start + per_page]}
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def test_list_instances_pages(self):
+        sys.argv = ['qds.py', 'scheduler', 'list-instances', '123', '--per-page',
+                    '2', '--page', '2']
+        print_command()
+        qds.main()
+        Connection._api_call.assert_called_with(
+            "GET", "scheduler/123/instances", params={'page': '2', 'per_page': '2'})
+
+    def test_iter_instances(self):
+        schedule = Scheduler({"id": 123})
+        for prefetch in (0, 2):
+            Connection._api_call.reset_mock()
+            instances = list(schedule.iter_instances(per_page=2, prefetch=prefetch))
+            self.assertEqual([i.id for i in instances], [1, 2, 3, 4, 5])
+            self.assertIsInstance(instances[0], HiveCommand)
+            self.assertIs(type(instances[1]), Command)
+            Connection._api_call.assert_any_call(
+                "GET", "scheduler/123/instances", params={"page": 3, "per_page": 2})
+        # At most `prefetch` pages are fetched past the last one
+        self.assertTrue(Connection._api_call.call_count <= 5)
+
+    def test_iter_instances_exact_pages(self):
+        schedule = Scheduler({"id": 123})
+        instances = list(schedule.iter_instances(per_page=5, prefetch=0, fields=["id"]))
+        self.assertEqual([i.attributes for i in instances], [{"id": i} for i in range(1, 6)])
+        Connection._api_call.assert_called_with(
+            "GET", "scheduler/123/instances", params={"page": 2, "per_page": 5, "fields": "id"})
+
+    def test_iter_instances_capped_per_page(self):
+        # The server returns at most 2 instances per page, with paging_info
+        def api_call(method, path, data=None, params=None):
+            page = int(params["page"])
+            return {"commands": self.instances[(page - 1) * 2:page * 2],
+                    "paging_info": {"next_page": page + 1 if page < 3 else None}}
+        Connection._api_call = Mock(side_effect=api_call)
+        schedule = Scheduler({"id": 123})
+        for prefetch in (0, 2):
+            instances = list(schedule.iter_instances(per_page=500, prefetch=prefetch))
+            self.assertEqual([i.id for i in instances], [1, 2, 3, 4, 5])
+
+    def test_iter_instances_close(self):
+        instances = Scheduler({"id": 123}).iter_instances(per_page=1, prefetch=1)
+        self.assertEqual(next(instances).id, 1)
+        instances.close()
+
+    def test_list_instances_all(self):
+        sys.argv = ['qds.py', 'scheduler', 'list-instances', '123', '--all',
+                    '--per-page', '2', '--fields', 'id']
+        print_command()
+        qds.main()
+        Connection._api_call.assert_any_call(
+            "GET", "scheduler/123/instances", params={"page": 3, "per_page": 2, "fields": "id"})
+
+
+class TestSchedulerBackfill(QdsCliTestCase):
+    def setUp(self):
+        super(TestSchedulerBackfill, self).setUp()
+        self.instances = [
+            {"id": 1, "status": "done", "nominal_time": "2015-01-01T00:00Z"},
+            {"id": 2, "status": "error", "nominal_time": "2015-01-02T00:00Z"},
+            {"id": 3, "status": "error", "nominal_time": "2015-01-03T00:00Z"},
+            {"id": 4, "status": "cancelled", "nominal_time": "2015-01-04T00:00Z"},
+            {"id": 5, "status": "error", "nominal_time": "2015-01-05T00:00Z"}]
+        self.statuses = {}
+
+        def api_call(method, path, data=None, params=None):
+            parts = path.split("/")
+            if path == "scheduler/123":
+                return {"id": 123}
+            if path == "scheduler/123/instances":
+                if int(params.get("page", 1)) > 1:
+                    return {"commands": []}
+                return {"commands": self.instances}
+            if parts[-1] == "rerun":
+                if parts[3] == "5":
+                    raise ServerError(Mock(status_code=500, url=path))
+                return {"status": "success"}
+            if parts[0] == "commands":
+                return {"id": int(parts[1]),
+                        "status": self.statuses.get(int(parts[1]), "done")}
+            raise AssertionError(path)
+        Connection._api_call = Mock(side_effect=api_call)
+
+    def test_rerun(self):
+        self.assertEqual(Scheduler({"id": 123}).rerun(2), "success")
+        Connection._api_call.assert_called_with("POST", "scheduler/123/instances/2/rerun",
+                                                None)
+
+    def test_select_instances(self):
+        schedule = Scheduler({"id": 123})
+        self.assertEqual([i.id for i in schedule.select_instances(["error"])], [2, 3, 5])
+        self.assertEqual([i.id for i in schedule.select_instances(
+            start="2015-01-02", end="2015-01-04")], [2, 3])
+        self.assertEqual([i.id for i in schedule.select_instances(
+            ["error", "cancelled"], start="2015-01-03T00:00Z")], [3, 4, 5])
+
+    def test_backfill(self):
+        progress = []
+        outcomes = Scheduler({"id": 123}).backfill(["error"], concurrency=2, rate=100,
+                                                   progress=progress.append)
+        self.assertEqual([(o.instance.id, o.response) for o in outcomes],
+                         [(2, "success"), (3, "success"), (5, None)])
+        self.assertIsInstance(outcomes[2].error, ServerError)
+        self.assertEqual(outcomes[2].status, "error")
+        self.assertEqual([(p.stage, p.done, p.total) for p in progress],
+                         [("rerun", 1, 3), ("rerun", 2, 3), ("rerun", 3, 3)])
+        Connection._api_call.assert_any_call("POST", "scheduler/123/instances/3/rerun", None)
+
+    def test_backfill_wait(self):
+        self.statuses[3] = "running"
+        progress = []
+        outcomes = Scheduler({"id": 123}).backfill(["error"], end="2015-01-04", wait=True,
+                                                   timeout=0, progress=progress.append)
+        self.assertEqual([(o.instance.id, o.status) for o in outcomes],
+                         [(2, "done"), (3, "running")])
+        self.assertIsNone(outcomes[0].error)
+        self.assertIsInstance(outcomes[1].error, WaitTimeout)
+        self.assertEqual(progress[-1][:3], ("wait", 1, 2))
+        Connection._api_call.assert_any_call("GET", "commands/3", params=None)
+
+    def test_backfill_wait_not_rerun(self):
+        # Still shows the status it had before the rerun
+        self.statuses[2] = "error"
+        outcomes = Scheduler({"id": 123}).backfill(["error"], end="2015-01-03", wait=True,
+                                                   timeout=0)
+        self.assertIsNone(outcomes[0].status)
+        self.assertIsInstance(outcomes[0].error, WaitTimeout)
+
+    def test_backfill_dry_run(self):
+        outcomes = Scheduler({"id": 123}).backfill(["error"], dry_run=True)
+        self.assertEqual([(o.instance.id, o.status) for o in outcomes],
+                         [(2, "error"), (3, "error"), (5, "error")])
+        for call in Connection._api_call.call_args_list:
+            self.assertEqual(call[0][0], "GET")
+
+    def test_cli(self):
+        sys.argv = ['qds.py', 'scheduler', 'backfill', '123', '--status', 'error',
+                    '--status', 'cancelled', '--from', '2015-01-03', '--to', '2015-01-05',
+                    '--concurrency', '2']
+        print_command()
+        self.assertEqual(qds.main(), 0)
+        Connection._api_call.assert_any_call("POST", "scheduler/123/instances/3/rerun", None)
+        Connection._api_call.assert_any_call("POST", "scheduler/123/instances/4/rerun", None)
+        sys.argv[-4:] = ['--to', '2015-01-06']
+        self.assertEqual(qds.main(), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
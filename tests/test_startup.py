@@ -0,0 +1,51 @@
+from __future__ import print_function
+import sys
+import os
+import subprocess
+
+if sys.version_info > (2, 7, 0):
+    import unittest
+else:
+    import unittest2 as unittest
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../bin')
+
+# Modules which are expensive to import and are not needed until a
+# subcommand actually runs. Importing qds.py must not pull these in.
+DEFERRED_MODULES = ["boto", "pkg_resources", "inflection",
+                    "qds_sdk.commands", "qds_sdk.cluster",
+                    "qds_sdk.scheduler", "qds_sdk.actions",
+                    "qds_sdk.report", "qds_sdk.dbtaps", "qds_sdk.role",
+                    "qds_sdk.group", "qds_sdk.account", "qds_sdk.app",
+                    "qds_sdk.nezha"]
+
+
+def loaded_modules(statement):
+    code = ("import sys; sys.path.insert(0, %r); %s; "
+            "print('\\n'.join(sys.modules.keys()))" % (BIN_DIR, statement))
+    output = subprocess.check_output([sys.executable, "-c", code])
+    return set(output.decode("utf8").split())
+
+
+class TestStartupImports(unittest.TestCase):
+    def test_qds_import_budget(self):
+        loaded = loaded_modules("import qds")
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, loaded)
+
+    def test_commands_import_budget(self):
+        loaded = loaded_modules("import qds_sdk.commands")
+        self.assertNotIn("boto", loaded)
+        self.assertNotIn("pkg_resources", loaded)
+
+    def test_optparser_built_on_first_access(self):
+        from qds_sdk.commands import HiveCommand, DbexportCommand
+        from qds_sdk.util import GentleOptionParser
+        self.assertIsInstance(HiveCommand.optparser, GentleOptionParser)
+        self.assertIs(HiveCommand.optparser, HiveCommand.optparser)
+        self.assertEqual(DbexportCommand.optparser.usage,
+                         "dbexportcmd <submit|run> [options]")
+
+
+if __name__ == '__main__':
+    unittest.main()